@@ -3,12 +3,15 @@ import sys
 from app.config import Config
 from app.models import db, Source, APIKey
 from app.utils.cache import redis_client
+from app.utils.source_catalog import SourceCatalog
 from app.utils.source_registry import SourceRegistry
 from app.utils.logger import app_logger
+from app.utils.tracing import setup_tracing
 
 from flask import Flask
 from flask_migrate import Migrate
 from redis.exceptions import TimeoutError as RedisTimeoutError
+from sqlalchemy import inspect, text
 
 migrate = Migrate()
 
@@ -23,6 +26,8 @@ def create_app(celery=False) -> Flask:
             app_logger.error("Connection to Redis timed out, exiting")
             sys.exit()
     
+    setup_tracing(f"{Config.TRACING_SERVICE_NAME}-{'worker' if celery else 'web'}")
+    
     app = Flask(__name__)
 
     # Load configuration
@@ -38,31 +43,42 @@ def create_app(celery=False) -> Flask:
         
         with app.app_context():
             db.create_all()
+            upgrade_enrichment_results()
             seed_sources()
 
     return app
 
+def upgrade_enrichment_results():
+    """
+    Adds the schema_version column to enrichment results stored before it existed, create_all doesn't alter existing tables.
+    Those results get version 0, so they are kept as history but never served instead of querying the sources.
+    """
+    columns = {column["name"] for column in inspect(db.engine).get_columns("enrichment_result")}
+    if "schema_version" not in columns:
+        app_logger.info("Adding schema_version to stored enrichment results")
+        with db.engine.begin() as connection:
+            connection.execute(text("ALTER TABLE enrichment_result ADD COLUMN schema_version INTEGER NOT NULL DEFAULT 0"))
+
 def seed_sources():
     source_instances = SourceRegistry.get_instance()
     sources = [{"name": cls.get_name(), "requires_api_key": cls.requires_api_key} for cls in source_instances.values()]
-    all_configured_sources = Source.query.all()
+    # One query for the existing sources and one for the names of the sources with API keys
+    all_configured_sources = {src.name: src for src in Source.query.all()}
+    names_with_api_keys = {name for name, in db.session.query(APIKey.source_name).distinct()}
     if all_configured_sources:
         app_logger.debug("Found existing db, checking for deprecated sources.")
         dict_of_names_of_new_sources = {d["name"] for d in sources}
-        sources_not_in_new_sources: list[Source] = [src for src in all_configured_sources if src.name not in dict_of_names_of_new_sources]
-        for s in sources_not_in_new_sources:
-            remove_source = Source.query.filter_by(name=s.name).first()
-            if remove_source:
-                db.session.delete(remove_source)
-                app_logger.warning(f"Removed deprecated source {remove_source.name}.")
+        sources_not_in_new_sources: list[Source] = [src for src in all_configured_sources.values() if src.name not in dict_of_names_of_new_sources]
+        for remove_source in sources_not_in_new_sources:
+            db.session.delete(remove_source)
+            app_logger.warning(f"Removed deprecated source {remove_source.name}.")
         
     for source_data in sources:
-        existing_source = Source.query.filter_by(name=source_data["name"]).first()
+        existing_source = all_configured_sources.get(source_data["name"])
         if existing_source:
             app_logger.info(f"Source '{source_data['name']}' already exists, skipping creating db entry.")
             if existing_source.requires_api_key:
-                api_key = APIKey.query.filter_by(source_name=source_data["name"]).first()
-                if api_key:
+                if source_data["name"] in names_with_api_keys:
                     app_logger.info(f"\t-> API key configured for '{source_data["name"]}'.")
                 else:
                     app_logger.info(f"\t-> No API key configured for '{source_data["name"]}'.")
@@ -74,4 +90,5 @@ def seed_sources():
             db.session.add(new_source)
             app_logger.info(f"Added new source '{source_data["name"]}'.")
 
-    db.session.commit()
\ No newline at end of file
+    db.session.commit()
+    SourceCatalog.invalidate()
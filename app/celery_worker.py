@@ -1,7 +1,20 @@
+import os
+import time
+
 from app import create_app
 from app.config import Config
+from app.utils.admission import record_worker_heartbeat
+from app.utils.logger import setup_logger, stop_logging
+from app.utils.metrics import TASK_QUEUE_WAIT, TASK_RUN_TIME, mark_process_dead, reset_multiprocess_dir
+from app.utils.tracing import inject_context
 
 from celery import Celery
+from kombu import Queue
+from celery.signals import before_task_publish, heartbeat_sent, task_prerun, task_postrun, worker_init, worker_process_shutdown, worker_ready
+from celery.worker.state import active_requests
+from redis.exceptions import RedisError
+
+logger = setup_logger(__name__)
 
 def make_celery(app) -> Celery:
     """
@@ -21,6 +34,30 @@ def make_celery(app) -> Celery:
 
     celery.conf.broker_connection_retry_on_startup = True
 
+    # Separate queues per priority class, workers started with -Q interactive keep capacity for analysts
+    celery.conf.task_queues = [Queue(Config.QUEUE_INTERACTIVE), Queue(Config.QUEUE_BULK), Queue(Config.QUEUE_REFRESH)]
+    celery.conf.task_default_queue = Config.QUEUE_INTERACTIVE
+    celery.conf.task_routes = {
+        "app.tasks.dispatch_bulk_job": {"queue": Config.QUEUE_BULK},
+        "app.tasks.ingest_task": {"queue": Config.QUEUE_BULK},
+        "app.tasks.webhook_task": {"queue": Config.QUEUE_REFRESH},
+        "app.tasks.refresh_task": {"queue": Config.QUEUE_REFRESH},
+        "app.tasks.prewarm_task": {"queue": Config.QUEUE_REFRESH},
+        "app.tasks.prune_history_task": {"queue": Config.QUEUE_REFRESH},
+        "app.tasks.release_deferred_task": {"queue": Config.QUEUE_REFRESH},
+    }
+
+    # Run by celery beat
+    celery.conf.beat_schedule = {
+        "release-deferred-tasks": {"task": "app.tasks.release_deferred_task", "schedule": Config.QUOTA_DEFERRED_POLL_INTERVAL},
+    }
+    if Config.PREWARM_TOP_N > 0:
+        celery.conf.beat_schedule["prewarm-frequent-lookups"] = {"task": "app.tasks.prewarm_task", "schedule": Config.PREWARM_INTERVAL}
+    if Config.HISTORY_RETENTION_DAYS > 0:
+        celery.conf.beat_schedule["prune-history"] = {"task": "app.tasks.prune_history_task", "schedule": 86400}
+    # Reserve one task per process at a time, so busy processes don't hold queued tasks others could run
+    celery.conf.worker_prefetch_multiplier = Config.WORKER_PREFETCH_MULTIPLIER
+
     class ContextTask(celery.Task):
         def __call__(self, *args, **kwargs):
             with app.app_context():
@@ -30,4 +67,64 @@ def make_celery(app) -> Celery:
     return celery
 
 app = create_app(True)
-celery = make_celery(app)
\ No newline at end of file
+celery = make_celery(app)
+
+# Task start times by task id, used to measure run time
+_task_start_times: dict[str, float] = {}
+
+@before_task_publish.connect
+def stamp_enqueue_time(headers=None, **kwargs):
+    """ Stamps the publish time and trace context to the message headers. """
+    if headers is not None:
+        headers.setdefault("enqueued_at", time.time())
+        inject_context(headers)
+
+@task_prerun.connect
+def record_queue_wait(task_id=None, task=None, **kwargs):
+    """ Records how long the task waited in the queue. """
+    _task_start_times[task_id] = time.perf_counter()
+    enqueued_at = task.request.get("enqueued_at")
+    if enqueued_at:
+        queue = (task.request.delivery_info or {}).get("routing_key") or "unknown"
+        TASK_QUEUE_WAIT.labels(task.name, queue).observe(max(time.time() - float(enqueued_at), 0))
+
+@task_postrun.connect
+def record_run_time(task_id=None, task=None, state=None, **kwargs):
+    """ Records how long running the task took. """
+    start = _task_start_times.pop(task_id, None)
+    if start is not None:
+        TASK_RUN_TIME.labels(task.name, state or "UNKNOWN").observe(time.perf_counter() - start)
+
+# Consumer of the worker, set once it is ready to take tasks
+_consumer = None
+
+@worker_ready.connect
+def keep_consumer(sender=None, **kwargs):
+    """ Keeps the worker's consumer, its pool size is sent with the heartbeats. """
+    global _consumer
+    _consumer = sender
+
+@heartbeat_sent.connect
+def report_saturation(sender=None, **kwargs):
+    """ Stores the worker's busy processes with every heartbeat, read by the web tier's admission control. """
+    if _consumer is None or _consumer.pool is None:
+        return
+    try:
+        record_worker_heartbeat(_consumer.hostname, _consumer.pool.limit, len(active_requests))
+    except RedisError as e:
+        logger.warning(f"Could not record the worker's heartbeat: {e}")
+
+@worker_init.connect
+def clean_metrics(**kwargs):
+    """ Removes metric files of previous worker runs. """
+    reset_multiprocess_dir()
+
+@worker_process_shutdown.connect
+def remove_process_metrics(pid=None, **kwargs):
+    """ Cleans up live metrics of exited pool processes. """
+    mark_process_dead(pid or os.getpid())
+
+@worker_process_shutdown.connect
+def flush_process_logs(**kwargs):
+    """ Writes the queued logs of exiting pool processes, they exit without running exit handlers. """
+    stop_logging()
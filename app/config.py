@@ -1,3 +1,4 @@
+import json
 import os
 
 class Config:
@@ -10,18 +11,167 @@ class Config:
     REDIS_HOST = os.getenv("REDIS_HOST", "redis")  # Default to "redis" (Docker service name)
     REDIS_PORT = os.getenv("REDIS_PORT", 6379)
     REDIS_DB = 0
+    REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 50))  # Connections of each worker process' async Redis client
 
     # Celery settings
     CELERY_BROKER_URL = f"redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}"
     result_backend = f"redis://{REDIS_HOST}:{REDIS_PORT}/{REDIS_DB}"
+
+    # Queues for interactive lookups, bulk jobs and background refreshes
+    QUEUE_INTERACTIVE = os.getenv("QUEUE_INTERACTIVE", "interactive")
+    QUEUE_BULK = os.getenv("QUEUE_BULK", "bulk")
+    QUEUE_REFRESH = os.getenv("QUEUE_REFRESH", "refresh")
+    # Tasks a worker process reserves at a time, 1 keeps long bulk tasks from blocking queued interactive ones
+    WORKER_PREFETCH_MULTIPLIER = int(os.getenv("WORKER_PREFETCH_MULTIPLIER", 1))
+
+    # Admission control, new searches, bulk jobs and uploads are refused while the workers can't keep up, bulk first and interactive last
+    ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "true").lower() in ("1", "true", "yes")
+    # JSON object of priority classes and the most tasks waiting in their queue, new work beyond it is refused with 429
+    ADMISSION_QUEUE_LIMITS = {"interactive": 500, "bulk": 50000, "refresh": 5000, **json.loads(os.getenv("ADMISSION_QUEUE_LIMITS", "{}"))}
+    # JSON object of priority classes and the busy share of the workers' processes at which new work is refused with 503,
+    # while tasks of the class are waiting
+    ADMISSION_SATURATION_LIMITS = {"interactive": 1.0, "bulk": 0.95, "refresh": 0.9, **json.loads(os.getenv("ADMISSION_SATURATION_LIMITS", "{}"))}
+    ADMISSION_RETRY_AFTER = int(os.getenv("ADMISSION_RETRY_AFTER", 30))  # Seconds refused clients are asked to wait
+    ADMISSION_RETRY_JITTER = float(os.getenv("ADMISSION_RETRY_JITTER", 0.2))  # Share of ADMISSION_RETRY_AFTER randomly added or removed
+    ADMISSION_REFRESH_INTERVAL = float(os.getenv("ADMISSION_REFRESH_INTERVAL", 1))  # Seconds the web processes reuse the queue depths and saturation
+
+    # Bulk job settings
+    BULK_MAX_INDICATORS = int(os.getenv("BULK_MAX_INDICATORS", 10000))
+    BULK_JOB_EXPIRATION = int(os.getenv("BULK_JOB_EXPIRATION", 86400))  # Bulk job bookkeeping expiration in seconds (default 1 day)
+    EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", 1000))  # Tasks whose results are read at a time when exporting a bulk job
+    EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", 50000))  # Rows per Parquet row group or Arrow record batch of exports
+
+    # File ingestion settings, uploaded files wait for the bulk worker in a directory shared by the web and worker containers
+    INGEST_DIR = os.getenv("INGEST_DIR", "instance/ingest")
+    INGEST_MAX_BYTES = int(os.getenv("INGEST_MAX_BYTES", 10 * 1024 ** 3))  # Largest accepted upload (default 10 GiB)
+    INGEST_MAX_INDICATORS = int(os.getenv("INGEST_MAX_INDICATORS", 1000000))  # Unique indicators enriched per file, the scan stops after them
+    # Bloom filter removing duplicates while a file is scanned, holds raw and canonical notations of the indicators
+    INGEST_DEDUP_CAPACITY = int(os.getenv("INGEST_DEDUP_CAPACITY", 10000000))
+    INGEST_DEDUP_ERROR_RATE = float(os.getenv("INGEST_DEDUP_ERROR_RATE", 0.0001))  # Share of new indicators taken for duplicates and skipped
+
+    # Webhook settings, results are POSTed to the callback URLs given with searches and bulk jobs
+    WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")  # Key signing the callbacks with HMAC-SHA256, unsigned if empty
+    WEBHOOK_TIMEOUT = float(os.getenv("WEBHOOK_TIMEOUT", 10))  # Seconds a receiver has to answer
+    WEBHOOK_MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", 5))
+    WEBHOOK_RETRY_BACKOFF = float(os.getenv("WEBHOOK_RETRY_BACKOFF", 10))  # Seconds before the first retry, doubled for every further retry
+    WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", 20))  # Pooled connections per worker process
+    WEBHOOK_BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", 100))  # Results of bulk jobs sent per callback
+    WEBHOOK_DEAD_LETTER_SIZE = int(os.getenv("WEBHOOK_DEAD_LETTER_SIZE", 1000))  # Failed deliveries kept for inspection and redelivery
+    # Hosts callbacks may be sent to, comma separated. If empty, any host resolving to public addresses only.
+    WEBHOOK_ALLOWED_HOSTS = frozenset(host.strip().lower() for host in os.getenv("WEBHOOK_ALLOWED_HOSTS", "").split(",") if host.strip())
     
-    # Concurrency
-    MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", 20))
+    # Concurrency, requests to sources in flight. Waiting requests are served interactive first, then in turn between searches.
+    MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", 100))  # Per worker process
+    MAX_CONCURRENT_REQUESTS_PER_HOST = int(os.getenv("MAX_CONCURRENT_REQUESTS_PER_HOST", 25))  # Per worker process and source host
+    # JSON object of host names and their limit replacing MAX_CONCURRENT_REQUESTS_PER_HOST, e.g. {"api.threatminer.org": 5}
+    HOST_CONCURRENCY_LIMITS = json.loads(os.getenv("HOST_CONCURRENCY_LIMITS", "{}"))
+    # Across every worker, counted in Redis, 0 for no cluster-wide limit
+    CLUSTER_MAX_CONCURRENT_REQUESTS = int(os.getenv("CLUSTER_MAX_CONCURRENT_REQUESTS", 0))
+
+    # Source settings
+    # JSON object of source class names and base URLs replacing the source's default URL, e.g. for local mock providers
+    SOURCE_BASE_URLS = json.loads(os.getenv("SOURCE_BASE_URLS", "{}"))
+    # Largest response body read from a source in bytes (default 5 MiB), larger responses fail the request
+    MAX_RESPONSE_BYTES = int(os.getenv("MAX_RESPONSE_BYTES", 5 * 1024 * 1024))
+    # JSON object of source class names and largest response body in bytes, replacing MAX_RESPONSE_BYTES for the source
+    SOURCE_MAX_RESPONSE_BYTES = json.loads(os.getenv("SOURCE_MAX_RESPONSE_BYTES", "{}"))
+    # record stores every response of the sources in SOURCE_FIXTURES_DIR, replay answers the sources' requests with the recorded
+    # responses without any network, e.g. for benchmarks and offline development. Empty (default) for neither
+    SOURCE_FIXTURES_MODE = os.getenv("SOURCE_FIXTURES_MODE", "").lower()
+    SOURCE_FIXTURES_DIR = os.getenv("SOURCE_FIXTURES_DIR", "benchmarks/fixtures")  # Directory of the recorded responses, a JSON file per source
+    # JSON object of source class names and quotas replacing the source's default quotas of the public plan,
+    # each quota is an object of window (minute, hour, day or month) and requests allowed, e.g. {"VirusTotalSource": {"day": 20000}}
+    SOURCE_QUOTAS = json.loads(os.getenv("SOURCE_QUOTAS", "{}"))
+    # JSON object of source class names and whether their requests are hedged, replacing the source's default.
+    # Sources requiring an API key or having quotas are never hedged, e.g. {"TrancoListSource": false}
+    SOURCE_HEDGING = json.loads(os.getenv("SOURCE_HEDGING", "{}"))
+    # A hedged source's request without a response after this percentile of its recent latencies is sent again
+    HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", 95))
+    HEDGE_MIN_DELAY_MS = float(os.getenv("HEDGE_MIN_DELAY_MS", 50))  # Shortest wait before a hedged request
+    HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", 20))  # Requests observed before a source's requests are hedged
+    HEDGE_LATENCY_WINDOW = int(os.getenv("HEDGE_LATENCY_WINDOW", 500))  # Recent requests the percentile is computed from
+    # Hedged requests allowed per request of hedged sources in each worker process, 0 disables hedging
+    HEDGE_BUDGET_RATIO = float(os.getenv("HEDGE_BUDGET_RATIO", 0.05))
+    HEDGE_BUDGET_BURST = float(os.getenv("HEDGE_BUDGET_BURST", 10))  # Hedged requests allowed at once after a calm period
+    # Most time a request to a source may take, retries included
+    SOURCE_REQUEST_DEADLINE = float(os.getenv("SOURCE_REQUEST_DEADLINE", 30))
+    # Adaptive timeouts, the connect and read timeouts of each attempt are learned from the source's latencies,
+    # counted by every process in a rolling histogram in Redis. Sources use their default timeout until enough requests were seen.
+    ADAPTIVE_TIMEOUTS = os.getenv("ADAPTIVE_TIMEOUTS", "true").lower() in ("1", "true", "yes")
+    TIMEOUT_PERCENTILE = float(os.getenv("TIMEOUT_PERCENTILE", 99))
+    TIMEOUT_FACTOR = float(os.getenv("TIMEOUT_FACTOR", 3))  # Timeouts are the percentile of the latencies times this factor
+    CONNECT_TIMEOUT_MIN = float(os.getenv("CONNECT_TIMEOUT_MIN", 1))
+    CONNECT_TIMEOUT_MAX = float(os.getenv("CONNECT_TIMEOUT_MAX", 10))
+    READ_TIMEOUT_MIN = float(os.getenv("READ_TIMEOUT_MIN", 2))
+    READ_TIMEOUT_MAX = float(os.getenv("READ_TIMEOUT_MAX", 30))
+    TIMEOUT_MIN_SAMPLES = int(os.getenv("TIMEOUT_MIN_SAMPLES", 50))  # Requests observed before a source's timeouts are learned
+    TIMEOUT_WINDOW_SECONDS = int(os.getenv("TIMEOUT_WINDOW_SECONDS", 600))  # Latencies of this many recent seconds are used
+    TIMEOUT_REFRESH_INTERVAL = float(os.getenv("TIMEOUT_REFRESH_INTERVAL", 15))  # Seconds between syncs of a process' latencies with Redis
+    # Share of every quota window only interactive searches may use, bulk searches and refreshes stop short of it
+    QUOTA_INTERACTIVE_RESERVE = float(os.getenv("QUOTA_INTERACTIVE_RESERVE", 0.2))
+    # What happens to non-interactive searches when a source's quota is used up: skip returns a quota exhausted result
+    # for the source, defer puts the search on the delayed queue until the quota resets. Interactive searches and refreshes always skip.
+    QUOTA_EXHAUSTED_ACTION = os.getenv("QUOTA_EXHAUSTED_ACTION", "skip")
+    QUOTA_DEFERRED_POLL_INTERVAL = int(os.getenv("QUOTA_DEFERRED_POLL_INTERVAL", 30))  # Seconds between releases of deferred searches
+    # Seconds an API key is taken out of the source's key pool after the source answered 429 Too Many Requests or 401 Unauthorized
+    API_KEY_COOLDOWN_RATE_LIMITED = int(os.getenv("API_KEY_COOLDOWN_RATE_LIMITED", 60))
+    API_KEY_COOLDOWN_UNAUTHORIZED = int(os.getenv("API_KEY_COOLDOWN_UNAUTHORIZED", 3600))
 
     # Cache expiration settings
     CACHE_EXPIRATION = int(os.getenv("CACHE_EXPIRATION", 3600))  # Cache expiration in seconds (default 1 hour)
+    # Seconds expired results are still served, marked stale, while a background task refreshes them (default 1 day)
+    CACHE_STALE_EXPIRATION = int(os.getenv("CACHE_STALE_EXPIRATION", 86400))
+    # Seconds a refresh of a stale result is claimed for, other workers won't trigger another refresh meanwhile
+    CACHE_REFRESH_LOCK_EXPIRATION = int(os.getenv("CACHE_REFRESH_LOCK_EXPIRATION", 60))
+    # Share of CACHE_EXPIRATION randomly added or removed, so entries cached together don't expire together
+    CACHE_TTL_JITTER = float(os.getenv("CACHE_TTL_JITTER", 0.1))
+    # Eagerness of probabilistic early refreshes (XFetch) relative to the time computing the results took, 0 disables them
+    CACHE_XFETCH_BETA = float(os.getenv("CACHE_XFETCH_BETA", 1.0))
+
+    # Enrichment history settings
+    # Seconds results stored in the database are reused instead of querying the source again (default 1 hour)
+    HISTORY_MAX_AGE = int(os.getenv("HISTORY_MAX_AGE", 3600))
+    HISTORY_RETENTION_DAYS = int(os.getenv("HISTORY_RETENTION_DAYS", 90))  # Days results are kept in the database, 0 keeps them forever
+
+    # Pre-warming of frequently looked up indicators
+    PREWARM_TOP_N = int(os.getenv("PREWARM_TOP_N", 100))  # Most frequent lookups kept warm, 0 disables pre-warming
+    PREWARM_INTERVAL = int(os.getenv("PREWARM_INTERVAL", 300))  # Seconds between pre-warming runs
+    PREWARM_QUOTA_SHARE = float(os.getenv("PREWARM_QUOTA_SHARE", 0.2))  # Share of each source's daily quota pre-warming may use
+    LOOKUP_FREQUENCY_HALF_LIFE = int(os.getenv("LOOKUP_FREQUENCY_HALF_LIFE", 86400))  # Seconds until a lookup counts half as much
+    LOOKUP_FREQUENCY_MAX_TRACKED = int(os.getenv("LOOKUP_FREQUENCY_MAX_TRACKED", 10000))
+
+    # Metrics settings
+    # Directory shared by the web and worker containers, each service writes to its own PROMETHEUS_MULTIPROC_DIR under it
+    METRICS_SHARED_DIR = os.getenv("METRICS_SHARED_DIR", "")
+
+    # Logging settings
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    # Levels of single loggers and the loggers below them, JSON object of logger names and levels,
+    # e.g. {"app.tasks": "DEBUG", "app.sources": "WARNING"}
+    LOG_LEVELS = json.loads(os.getenv("LOG_LEVELS", "{}"))
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "text")  # text or json
+    # Share of the messages logged for every indicator that are written, e.g. 0.01 writes one in a hundred
+    LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 1.0))
+    LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))  # Records waiting to be written, records logged while it's full are dropped
+
+    # Tracing settings
+    TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() in ("1", "true", "yes")
+    TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "otlp")  # console, memory, file or otlp
+    TRACING_FILE_PATH = os.getenv("TRACING_FILE_PATH", "traces.jsonl")
+    TRACING_SERVICE_NAME = os.getenv("TRACING_SERVICE_NAME", "threat-lense")
+    TRACING_SAMPLE_RATIO = float(os.getenv("TRACING_SAMPLE_RATIO", 1.0))
 
     # SQLAlchemy settings
     SQLALCHEMY_DATABASE_URI = os.getenv("SQLALCHEMY_DATABASE_URI", "sqlite:///app_management.db")
     SECRET_KEY = os.getenv("SECRET_KEY", "ET2Hri8wOF5dVplna91hLJfH2Ry3M1KMf1kCVddJrM0=")
-    SQLALCHEMY_TRACK_MODIFICATIONS = False
\ No newline at end of file
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Connections kept open by each process, the web and worker containers share the SQLite file through a volume
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", 5)),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", 10)),
+        "pool_pre_ping": True,
+    }
+    # In WAL mode readers don't block the writer and the writer doesn't block readers, so processes don't contend on the file
+    SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+    SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")  # NORMAL is durable in WAL mode, except for the last commits on power loss
+    SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", 5000))  # Time a write waits for another process' write lock
\ No newline at end of file
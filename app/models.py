@@ -1,10 +1,26 @@
+from datetime import datetime, timezone
+import sqlite3
+
 from app.config import Config
 
 from flask_sqlalchemy import SQLAlchemy
 from cryptography.fernet import Fernet
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
 
 db = SQLAlchemy()
 
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """ Configures every new SQLite connection for concurrent access by the web and worker processes. """
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={Config.SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA synchronous={Config.SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA busy_timeout={Config.SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.close()
+
 # Encrypt/Decrypt helper
 def encrypt_data(data):
     """ Encrypt given data. Secret key is used to encrypt. """
@@ -16,23 +32,18 @@ def decrypt_data(data):
     cipher_suite = Fernet(Config.SECRET_KEY.encode("utf-8"))
     return cipher_suite.decrypt(data.encode("utf-8")).decode("utf-8")
 
-def fetch_api_key(name):
-    api_key_entry = APIKey.query.filter_by(source_name=name).first()
-    
-    if api_key_entry:
-        return api_key_entry.get_key()
-    else:
+def fetch_api_keys(name):
+    """ Fetch every API key of the source as tuples of the key's ID and the decrypted key, oldest first. """
+    api_key_entries = APIKey.query.filter_by(source_name=name).order_by(APIKey.id).all()
+    if not api_key_entries:
         raise ValueError(f"No API key found for source '{name}'")
+    return [(api_key_entry.id, api_key_entry.get_key()) for api_key_entry in api_key_entries]
 
 class Source(db.Model):
     """ Represents different external sources. """
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(150), unique=True, nullable=False)
     requires_api_key = db.Column(db.Boolean, default=False)
-        
-    @property
-    def is_api_key_configured(self):
-        return APIKey.query.filter_by(source_name=self.name).first() is not None
 
 class APIKey(db.Model):
     """ Stores encrypted API keys for sources that need them. """
@@ -45,3 +56,21 @@ class APIKey(db.Model):
 
     def get_key(self):
         return decrypt_data(self.encrypted_key)
+
+    def masked_key(self):
+        """ Last four characters of the key, identifying it without revealing it. """
+        return "..." + self.get_key()[-4:]
+
+class EnrichmentResult(db.Model):
+    """ Stores results fetched from sources, so they survive cache flushes and past verdicts can be queried. """
+    __table_args__ = (
+        db.Index("ix_enrichment_result_lookup", "indicator", "source_name", "fetched_at"),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    indicator = db.Column(db.String(2048), nullable=False)  # Canonical form of the indicator
+    indicator_type = db.Column(db.String(10), nullable=False)
+    source_name = db.Column(db.String(150), nullable=False)
+    verdict = db.Column(db.String(20), nullable=False)
+    result = db.Column(db.JSON, nullable=False)
+    schema_version = db.Column(db.Integer, nullable=False, default=0)  # Source's schema_version the result was parsed with
+    fetched_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc).replace(tzinfo=None), index=True)
@@ -1,21 +1,53 @@
 from datetime import datetime, timezone
 import json
+import os
+import uuid
 
-from app.utils.indicator_type import is_valid_indicator
-from app.utils.cache import cache_results, delete_from_cache, flush_cache
-from app.utils.logger import setup_logger
-from app.models import Source, APIKey, db
+from app.config import Config
+from app.utils.admission import Overloaded, admit, check_admission, get_load
+from app.utils.bulk_jobs import create_bulk_job, create_ingest_job, get_bulk_job, get_job_task_ids
+from app.utils.enums import IndicatorType
+from app.utils.export import EXPORT_FORMATS, available_formats, stream_export
+from app.utils.history import discard_fresh_results, query_history
+from app.utils.indicator_type import canonicalize_indicator, is_valid_indicator
+from app.utils.concurrency import count_cluster_requests
+from app.utils.cache import delete_from_cache, invalidate_namespace, invalidate_results, make_key, read_cached_result
+from app.utils.key_pool import forget_key, get_key_usage, quota_subject
+from app.utils.logger import sampled, setup_logger
+from app.utils.metrics import QUEUE_DEPTH, WORKER_SATURATION, render_metrics
+from app.utils.queues import PRIORITY_QUEUES, count_deferred_tasks, get_queue_depths, queue_for_priority
+from app.utils.quotas import get_quota_usage
+from app.utils.source_catalog import CatalogSource, SourceCatalog
+from app.utils.source_registry import SourceRegistry
+from app.utils.timeouts import get_source_timeouts
+from app.utils.tracing import extract_context, start_span
+from app.utils.webhooks import get_dead_letters, pop_dead_letters, validate_callback_url
+from app.models import APIKey, db
 
-from flask import Blueprint, jsonify, request
-from celery.result import AsyncResult
+from flask import Blueprint, Response, g, jsonify, request
+from redis.exceptions import RedisError
 
 logger = setup_logger(__name__)
+# Messages logged for every request
+request_logger = sampled(logger)
 
 main = Blueprint("main", __name__)
 
 @main.before_request
 def log_request_info():
-    logger.info(f"{request.method} request for {request.path}")
+    request_logger.info("%s request for %s", request.method, request.path)
+
+@main.before_request
+def start_request_span():
+    route = request.url_rule.rule if request.url_rule else request.path
+    g.request_span = start_span(f"{request.method} {route}", {"http.method": request.method, "http.route": route}, context=extract_context(request.headers))
+    g.request_span.__enter__()
+
+@main.teardown_request
+def end_request_span(error=None):
+    request_span = g.pop("request_span", None)
+    if request_span is not None:
+        request_span.__exit__(None, None, None)
 
 @main.errorhandler(400)
 def bad_request_error(error):
@@ -39,14 +71,135 @@ def not_found_error(error):
         "timestamp": str(datetime.now(timezone.utc)),
     }), 404
 
+@main.errorhandler(413)
+def request_entity_too_large_error(error):
+    error_str = str(error)
+    return jsonify({
+        "error": "Request Entity Too Large",
+        "message": error_str,
+        "status_code": 413,
+        "path": request.path,
+        "timestamp": str(datetime.now(timezone.utc)),
+    }), 413
+
+@main.errorhandler(Overloaded)
+def overloaded_error(error):
+    response = jsonify({
+        "error": "Too Many Requests" if error.status_code == 429 else "Service Unavailable",
+        "message": str(error),
+        "status_code": error.status_code,
+        "retry_after": error.retry_after,
+        "path": request.path,
+        "timestamp": str(datetime.now(timezone.utc)),
+    })
+    response.headers["Retry-After"] = str(error.retry_after)
+    return response, error.status_code
+
 @main.route("/health", methods=["GET"])
 def health_check():
     return jsonify({"status": "successful", "message": "API is running"}), 200
 
+@main.route("/health/saturation", methods=["GET"])
+def saturation_check():
+    # Load balancers check the class they route, interactive by default
+    priority = request.args.get("priority", "interactive")
+    try:
+        queue_for_priority(priority)
+    except ValueError as e:
+        return bad_request_error(str(e))
+    try:
+        load = get_load()
+    except RedisError as e:
+        return jsonify({"status": "unavailable", "message": f"Could not read the load: {e}"}), 503
+    admitting = {name: check_admission(load, name) is None for name in PRIORITY_QUEUES}
+    return jsonify({
+        "status": "successful" if admitting[priority] else "saturated",
+        "saturation": load["saturation"],
+        "workers": {"count": load["workers"], "processes": load["capacity"], "busy": load["active"]},
+        "queues": load["queues"],
+        "admitting": admitting,
+    }), 200 if admitting[priority] or not Config.ADMISSION_CONTROL else 503
+
+@main.route("/metrics", methods=["GET"])
+def metrics():
+    try:
+        load = get_load()
+    except RedisError as e:
+        # The other metrics are still served, queue depths and saturation keep their last values
+        logger.warning(f"Could not read the load for metrics: {e}")
+    else:
+        for priority, depth in load["queues"].items():
+            QUEUE_DEPTH.labels(priority).set(depth)
+        if load["saturation"] is not None:
+            WORKER_SATURATION.set(load["saturation"])
+    data, content_type = render_metrics()
+    return Response(data, mimetype=content_type)
+
 @main.route("/purge", methods=["DELETE"])
 def purge():
-    flush_cache()
-    return jsonify({"status": "successful", "message": "cache flushed successfully"}), 200
+    scope = request.args.get("scope", "results")
+    kind, _, value = scope.partition(":")
+    discarded = 0
+    try:
+        if scope == "results":
+            deleted = invalidate_results()
+        elif scope == "all":
+            deleted = invalidate_namespace()
+        elif kind == "source" and value:
+            key, = SourceRegistry.resolve_source_names([value])
+            deleted = invalidate_results(source_key=key)
+            # Results stored in the database would refill the cache otherwise
+            discarded = discard_fresh_results(Config.HISTORY_MAX_AGE, source_name=SourceRegistry.get_instance()[key].get_name())
+        elif kind == "type" and value:
+            indicator_type = next((t for t in IndicatorType if t.value == value.upper() and t != IndicatorType.UNKNOWN), None)
+            if not indicator_type:
+                raise ValueError(f"Invalid indicator type: {value}")
+            deleted = invalidate_results(indicator_type=indicator_type.name)
+            discarded = discard_fresh_results(Config.HISTORY_MAX_AGE, indicator_type=indicator_type)
+        elif kind == "namespace" and value:
+            deleted = invalidate_namespace(value)
+        else:
+            raise ValueError(f"Invalid scope: {scope}")
+    except ValueError as e:
+        return bad_request_error(str(e))
+    return jsonify({"status": "successful", "message": f"cache purged with scope {scope}", "deleted": deleted, "discarded": discarded}), 200
+
+@main.route("/queues", methods=["GET"])
+def queues():
+    response = {"status": "successful", "queues": get_queue_depths(), "deferred": count_deferred_tasks()}
+    if Config.CLUSTER_MAX_CONCURRENT_REQUESTS > 0:
+        response["source_requests"] = {"in_flight": count_cluster_requests(), "limit": Config.CLUSTER_MAX_CONCURRENT_REQUESTS}
+    return jsonify(response), 200
+
+@main.route("/quotas", methods=["GET"])
+def quotas():
+    # Sources with API keys have a quota per key
+    subjects = {}
+    for key, source in SourceRegistry.get_instance().items():
+        if not source.quotas:
+            continue
+        catalog_source = SourceCatalog.find(source.get_name())
+        key_ids = (catalog_source.key_ids if catalog_source else []) if source.requires_api_key else [None]
+        for key_id in key_ids:
+            subjects[quota_subject(key, key_id)] = (source, key_id)
+    usage = get_quota_usage({subject: source.quotas for subject, (source, _) in subjects.items()})
+    result = [{"name": source.get_name(), "key_id": key_id, "windows": usage[subject]} for subject, (source, key_id) in subjects.items()]
+    return jsonify({"status": "successful", "quotas": result}), 200
+
+@main.route("/timeouts", methods=["GET"])
+def timeouts():
+    sources = {source.get_name(): source.default_timeout for source in SourceRegistry.get_instance().values()}
+    result = []
+    for name, values in get_source_timeouts(sources).items():
+        result.append({
+            "name": name,
+            "adaptive": values["adaptive"],
+            "samples": values["samples"],
+            "connect": round(values["connect"], 3),
+            "read": round(values["read"], 3),
+            "percentiles": {phase: round(value, 3) if value is not None else None for phase, value in values["percentiles"].items()},
+        })
+    return jsonify({"status": "successful", "percentile": Config.TIMEOUT_PERCENTILE, "timeouts": result}), 200
 
 @main.route("/search", methods=["GET"])
 def search():    
@@ -55,12 +208,37 @@ def search():
     if not indicator:
         return bad_request_error("Invalid parameter")
     
-    logger.info(f"Received /search, with indicator: {indicator}")
+    request_logger.info("Received /search, with indicator: %s", indicator)
     indicator = indicator.strip()
     if not is_valid_indicator(indicator):
         return bad_request_error(f"Invalid indicator: {indicator}")
-    # Start Celery task
-    task = search_task.delay(indicator)
+    
+    # Optional filters limiting the searched sources
+    try:
+        sources = parse_source_filter(request.json.get("sources"))
+        exclude_sources = parse_source_filter(request.json.get("exclude_sources"))
+        priority = request.json.get("priority", "interactive")
+        queue = queue_for_priority(priority)
+        callback_url = request.json.get("callback_url")
+        if callback_url is not None:
+            validate_callback_url(callback_url)
+    except ValueError as e:
+        return bad_request_error(str(e))
+    
+    try:
+        admit(priority)
+    except Overloaded:
+        # Cached results are still served while new searches are refused, stale ones too since no refresh is started
+        cached = read_cached_search(indicator, sources, exclude_sources)
+        if not cached:
+            raise
+        return jsonify({"status": "successful", "result": cached}), 200
+    
+    # Start Celery task, the result is POSTed to the callback URL once ready
+    kwargs = {"priority": priority}
+    if callback_url:
+        kwargs["callback_url"] = callback_url
+    task = search_task.apply_async((indicator, sources, exclude_sources), kwargs, queue=queue)
 
     return jsonify({
         "status": "started",
@@ -68,15 +246,262 @@ def search():
         "status_url": f"/search/status/{task.id}"
     }), 202
 
+def read_cached_search(indicator: str, sources: list[str]=None, exclude_sources: list[str]=None) -> dict | None:
+    """
+    Reads a search's cached results in the web process, without starting a task.
+    
+    :param indicator: Searched indicator
+    :param sources: Registry keys of sources the search is limited to
+    :param exclude_sources: Registry keys of sources left out of the search
+    
+    :return: Results with their cache age and staleness, None if not cached
+    """
+    from app.tasks import resolve_search
+    _, _, cache_key = resolve_search(indicator, sources, exclude_sources)
+    cached = read_cached_result(cache_key)
+    if not cached:
+        return None
+    result, age, stale, _ = cached
+    result["cache"] = {"stale": stale, "age": round(age)}
+    return result
+
+def parse_source_filter(value) -> list[str] | None:
+    """
+    Parses a list or a comma separated string of source names and validates them against the registry.
+    
+    :param value: Source names given in the request
+    
+    :return: Sorted list of registry keys, None if no filter was given
+    :raises ValueError: If the filter is malformed or contains unknown sources
+    """
+    if not value:
+        return None
+    if isinstance(value, str):
+        value = [name for name in value.split(",") if name.strip()]
+    if not isinstance(value, list):
+        raise ValueError("Source filter must be a list or a comma separated string")
+    return sorted(SourceRegistry.resolve_source_names(value))
+
+@main.route("/search/bulk", methods=["POST"])
+def search_bulk():
+    from app.tasks import dispatch_bulk_job
+    indicators = request.json.get("indicators")
+    if not indicators or not isinstance(indicators, list):
+        return bad_request_error("Invalid parameter")
+    if len(indicators) > Config.BULK_MAX_INDICATORS:
+        return bad_request_error(f"Too many indicators, at most {Config.BULK_MAX_INDICATORS} are allowed")
+    
+    try:
+        sources = parse_source_filter(request.json.get("sources"))
+        exclude_sources = parse_source_filter(request.json.get("exclude_sources"))
+        priority = request.json.get("priority", "bulk")
+        queue_for_priority(priority)
+        callback_url = request.json.get("callback_url")
+        if callback_url is not None:
+            validate_callback_url(callback_url)
+    except ValueError as e:
+        return bad_request_error(str(e))
+    
+    # Invalid indicators are reported back instead of failing the whole job
+    valid, invalid = [], []
+    for indicator in indicators:
+        indicator = indicator.strip() if isinstance(indicator, str) else indicator
+        (valid if isinstance(indicator, str) and is_valid_indicator(indicator) else invalid).append(indicator)
+    if not valid:
+        return bad_request_error("No valid indicators")
+    admit(priority, len(valid))
+    
+    logger.info(f"Received /search/bulk, with {len(valid)} indicators and priority {priority}")
+    job_id = create_bulk_job(valid, priority, sources, exclude_sources, callback_url)
+    dispatch_bulk_job.delay(job_id)
+
+    return jsonify({
+        "status": "started",
+        "job_id": job_id,
+        "total": len(valid),
+        "invalid_indicators": invalid,
+        "status_url": f"/search/bulk/{job_id}"
+    }), 202
+
+@main.route("/search/bulk/<job_id>", methods=["GET"])
+def get_bulk_status(job_id):
+    job = get_bulk_job(job_id)
+    if not job:
+        return not_found_error("Bulk job not found")
+    job["results_url"] = f"/search/bulk/{job_id}/results"
+    job["export_url"] = f"/search/bulk/{job_id}/export"
+    return jsonify(job), 200
+
+@main.route("/search/bulk/<job_id>/results", methods=["GET"])
+def get_bulk_results(job_id):
+    from app.tasks import search_task
+    if not get_bulk_job(job_id):
+        return not_found_error("Bulk job not found")
+    offset = request.args.get("offset", 0, type=int)
+    limit = min(request.args.get("limit", 100, type=int), 1000)
+    if offset < 0 or limit < 1:
+        return bad_request_error("Invalid offset or limit")
+    
+    results = []
+    for task_id in get_job_task_ids(job_id, offset, limit):
+        task_result = search_task.AsyncResult(task_id)
+        entry = {"task_id": task_id, "state": task_result.state}
+        if task_result.state == "SUCCESS":
+            entry["result"] = json.loads(task_result.result) if isinstance(task_result.result, str) else task_result.result
+        elif task_result.state == "DEFERRED":
+            entry["retry_after"] = task_result.info.get("retry_after")
+        elif task_result.state == "FAILURE":
+            entry["error"] = str(task_result.info)
+        results.append(entry)
+    
+    return jsonify({"status": "successful", "offset": offset, "limit": limit, "results": results}), 200
+
+@main.route("/search/bulk/<job_id>/export", methods=["GET"])
+def export_bulk_results(job_id):
+    from app.tasks import search_task
+    if not get_bulk_job(job_id):
+        return not_found_error("Bulk job not found")
+    file_format = request.args.get("format", "ndjson")
+    formats = available_formats()
+    if file_format not in formats:
+        hint = ", parquet and arrow require pyarrow" if file_format in EXPORT_FORMATS else ""
+        return bad_request_error(f"Invalid format: {file_format}, expected one of {', '.join(formats)}{hint}")
+    
+    # Results are read and written in chunks while the response is sent
+    content_type, extension = EXPORT_FORMATS[file_format]
+    return Response(stream_export(job_id, search_task.backend, file_format), mimetype=content_type,
+                    headers={"Content-Disposition": f'attachment; filename="{job_id}.{extension}"'})
+
+def parse_indicator_types(value: str) -> list[str] | None:
+    """
+    Parses the indicator types to extract from a file.
+    
+    :param value: Comma separated names of indicator types, e.g. ipv4,domain
+    
+    :return: List of IndicatorType values, None if not given
+    :raises ValueError: If a name is not an indicator type
+    """
+    if not value:
+        return None
+    indicator_types = {indicator_type.name.lower(): indicator_type.value for indicator_type in IndicatorType if indicator_type != IndicatorType.UNKNOWN}
+    result = []
+    for name in value.split(","):
+        name = name.strip().lower()
+        if name not in indicator_types:
+            raise ValueError(f"Unknown indicator type: {name}")
+        result.append(indicator_types[name])
+    return result
+
+def save_upload(stream, path: str, limit: int) -> int | None:
+    """
+    Writes the request body to the file in chunks, without holding it in memory.
+    
+    :param stream: Stream of the request body
+    :param path: Path of the file
+    :param limit: Maximum size in bytes
+    
+    :return: Size of the file, None if the body exceeds the limit
+    """
+    size = 0
+    with open(path, "wb") as file:
+        while chunk := stream.read(1024 * 1024):
+            size += len(chunk)
+            if size > limit:
+                return None
+            file.write(chunk)
+    return size
+
+@main.route("/ingest", methods=["POST"])
+def ingest():
+    from app.tasks import ingest_task
+    if request.content_length is not None and request.content_length > Config.INGEST_MAX_BYTES:
+        return request_entity_too_large_error(f"File exceeds the maximum size of {Config.INGEST_MAX_BYTES} bytes")
+    try:
+        sources = parse_source_filter(request.args.get("sources"))
+        exclude_sources = parse_source_filter(request.args.get("exclude_sources"))
+        priority = request.args.get("priority", "bulk")
+        queue_for_priority(priority)
+        types = parse_indicator_types(request.args.get("types"))
+        callback_url = request.args.get("callback_url")
+        if callback_url is not None:
+            validate_callback_url(callback_url)
+    except ValueError as e:
+        return bad_request_error(str(e))
+    # Refused before the upload is stored
+    admit(priority)
+    
+    # Stored where the bulk worker can read it, the worker removes it once scanned
+    os.makedirs(Config.INGEST_DIR, exist_ok=True)
+    path = os.path.join(Config.INGEST_DIR, f"{uuid.uuid4()}.upload")
+    if request.mimetype == "multipart/form-data":
+        upload = request.files.get("file")
+        if not upload:
+            return bad_request_error("Missing file")
+        file_name = upload.filename or "upload"
+        upload.save(path)
+        size = os.path.getsize(path)
+        if size > Config.INGEST_MAX_BYTES:
+            size = None
+    else:
+        file_name = request.args.get("name", "upload")
+        size = save_upload(request.stream, path, Config.INGEST_MAX_BYTES)
+    if not size:
+        os.remove(path)
+        if size is None:
+            return request_entity_too_large_error(f"File exceeds the maximum size of {Config.INGEST_MAX_BYTES} bytes")
+        return bad_request_error("Empty file")
+    
+    logger.info(f"Received /ingest, with {file_name} of {size} bytes and priority {priority}")
+    job_id = create_ingest_job(file_name, size, priority, sources, exclude_sources, callback_url)
+    ingest_task.delay(job_id, path, types)
+
+    return jsonify({
+        "status": "started",
+        "job_id": job_id,
+        "file_name": file_name,
+        "file_size": size,
+        "status_url": f"/search/bulk/{job_id}"
+    }), 202
+
+@main.route("/webhooks/failed", methods=["GET"])
+def get_failed_webhooks():
+    offset = request.args.get("offset", 0, type=int)
+    limit = min(request.args.get("limit", 100, type=int), 1000)
+    if offset < 0 or limit < 1:
+        return bad_request_error("Invalid offset or limit")
+    return jsonify({"status": "successful", "offset": offset, "limit": limit, "deliveries": get_dead_letters(offset, limit)}), 200
+
+@main.route("/webhooks/failed/retry", methods=["POST"])
+def retry_failed_webhooks():
+    from app.tasks import webhook_task
+    limit = min(request.args.get("limit", 100, type=int), 1000)
+    if limit < 1:
+        return bad_request_error("Invalid limit")
+    # Delivered again with their delivery IDs and a fresh set of attempts
+    deliveries = pop_dead_letters(limit)
+    for delivery in deliveries:
+        webhook_task.delay(delivery["url"], delivery["event"], delivery["body"], delivery["delivery_id"], 1)
+    logger.info(f"Retrying {len(deliveries)} failed webhook deliveries")
+    return jsonify({"status": "successful", "retried": len(deliveries)}), 202
+
 @main.route("/search/status/<task_id>", methods=["GET"])
 def get_task_status(task_id):
-    task_result = AsyncResult(task_id)
+    from app.tasks import search_task
+    # Bound to the task's app, the default app of a request thread has no result backend
+    task_result = search_task.AsyncResult(task_id)
     
     if task_result.state == "PENDING":
         response = {
             "state": task_result.state,
             "status": "Pending..."
         }
+    elif task_result.state == "DEFERRED":
+        # Deferred until a source's quota resets, then sent again with the same task ID
+        response = {
+            "state": task_result.state,
+            "status": task_result.info.get("message", "Deferred"),
+            "retry_after": task_result.info.get("retry_after")
+        }
     elif task_result.state == "FAILURE":
         response = {
             "state": task_result.state,
@@ -98,9 +523,57 @@ def get_task_status(task_id):
         }
     return jsonify(response), 200
 
+@main.route("/history", methods=["GET"])
+def get_history():
+    indicator = request.args.get("indicator", "").strip()
+    if not indicator or not is_valid_indicator(indicator):
+        return bad_request_error(f"Invalid indicator: {indicator}")
+    
+    source_name = None
+    try:
+        if request.args.get("source"):
+            key, = SourceRegistry.resolve_source_names([request.args["source"]])
+            source_name = SourceRegistry.get_instance()[key].get_name()
+        since = parse_timestamp(request.args.get("since"))
+        until = parse_timestamp(request.args.get("until"))
+    except ValueError as e:
+        return bad_request_error(str(e))
+    limit = min(request.args.get("limit", 100, type=int), 1000)
+    
+    history = query_history(indicator, source_name, since, until, limit)
+    return jsonify({
+        "status": "successful",
+        "indicator": canonicalize_indicator(indicator),
+        "history": [{
+            "source": entry.source_name,
+            "verdict": entry.verdict,
+            "fetched_at": entry.fetched_at.replace(tzinfo=timezone.utc).isoformat(),
+            "result": entry.result,
+        } for entry in history]
+    }), 200
+
+def parse_timestamp(value: str) -> datetime | None:
+    """
+    Parses an ISO 8601 timestamp given in the request. Timestamps without a timezone are UTC.
+    
+    :param value: Timestamp given in the request
+    
+    :return: Naive UTC datetime as stored in the database, None if no timestamp was given
+    :raises ValueError: If the timestamp is malformed
+    """
+    if not value:
+        return None
+    try:
+        timestamp = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Invalid timestamp: {value}")
+    if timestamp.tzinfo:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
 @main.route("/sources", methods=["GET"])
 def get_sources():    
-    sources = Source.query.all()
+    sources = SourceCatalog.get_sources()
         
     result = []
     for source in sources:
@@ -108,70 +581,149 @@ def get_sources():
             "id": source.id,
             "name": source.name,
             "requires_api_key": source.requires_api_key,
-            "api_key_configured": source.is_api_key_configured
+            "api_key_configured": source.is_api_key_configured,
+            "api_keys": source.api_key_count
         })
     
     return jsonify({"status": "successful", "sources": result}), 200
 
 @main.route("/sources/configured", methods=["GET"])
 def fetch_configured():
-    all = APIKey.query.all()
-    source_names = [i.source_name for i in all]
+    source_names = [source.name for source in SourceCatalog.get_sources() if source.is_api_key_configured]
     return jsonify({"status": "successful", "configured_sources": source_names}), 200
 
+def find_source(source_id) -> CatalogSource | None:
+    """ Get a source by its name or ID, from the source catalog. """
+    return SourceCatalog.find(source_id)
+
+def api_keys_changed(source: CatalogSource, invalidate: bool=True) -> None:
+    """
+    Drops the source catalog and the source's cached API keys, so they are loaded from the database again.
+    
+    :param source: Source whose keys changed
+    :param invalidate: Whether cached and recently stored results of the source are invalidated too
+    """
+    if invalidate:
+        logger.debug(f"Change in API keys, invalidating cached results of {source.name}")
+        key, = SourceRegistry.resolve_source_names([source.name])
+        invalidate_results(source_key=key)
+        discard_fresh_results(Config.HISTORY_MAX_AGE, source_name=SourceRegistry.get_instance()[key].get_name())
+    SourceCatalog.invalidate()
+    delete_from_cache(make_key("api_key", source.name))
+
 @main.route("/sources/<source_id>", methods=["POST"])
 def set_api_key(source_id):    
-    api_key = request.json.get("api_key")
-    if not api_key:
+    api_keys = request.json.get("api_keys")
+    if api_keys is None and request.json.get("api_key"):
+        api_keys = [request.json.get("api_key")]
+    if not api_keys or not isinstance(api_keys, list) or not all(isinstance(api_key, str) and api_key for api_key in api_keys):
         return bad_request_error("Invalid parameter")
     
-    source = Source.query.filter_by(name=source_id).first()
+    source = find_source(source_id)
     if not source:
-        source = Source.query.filter_by(id=source_id).first()
-        if not source:
-            return not_found_error("Source not found")
+        return not_found_error("Source not found")
 
     if not source.requires_api_key:
         return bad_request_error("This source does not required an API key")
     
-    api_key_entry = APIKey.query.filter_by(source_name=source.name).first()
-    if not api_key_entry:
+    # Replace the source's keys with the given ones, set and save the encrypted API keys
+    registry_key, = SourceRegistry.resolve_source_names([source.name])
+    for key_id in source.key_ids:
+        forget_key(registry_key, key_id)
+    APIKey.query.filter_by(source_name=source.name).delete()
+    for api_key in api_keys:
         api_key_entry = APIKey(source_name=source.name)
-
-    # Set and save the encrypted API key
-    api_key_entry.set_key(api_key)
-    db.session.add(api_key_entry)
+        api_key_entry.set_key(api_key)
+        db.session.add(api_key_entry)
     db.session.commit()
-    
-    logger.debug("Change in API keys, flushing cached results")
-    flush_cache()
-    redis_key = f"api_key:{source.name}"
-    cache_results(redis_key, api_key)
+    api_keys_changed(source)
 
     return jsonify({"status": "successful", "message": f"API key for {source.name} set successfully"}), 200
 
 @main.route("/sources/<source_id>", methods=["DELETE"])
 def delete_api_key(source_id):    
-    source = Source.query.filter_by(name=source_id).first()
+    source = find_source(source_id)
     if not source:
-        source = Source.query.filter_by(id=source_id).first()
-        if not source:
-            return not_found_error("Source not found")
+        return not_found_error("Source not found")
 
     if not source.requires_api_key:
         return bad_request_error("This source does not required an API key")
     
-    api_key_entry = APIKey.query.filter_by(source_name=source.name).first()
-    
-    if not api_key_entry:
+    if not source.is_api_key_configured:
         return not_found_error(f"No API key found for source {source.name}")
     
-    logger.debug("Deleting API key from database")
-    db.session.delete(api_key_entry)
+    logger.debug("Deleting API keys from database")
+    registry_key, = SourceRegistry.resolve_source_names([source.name])
+    for key_id in source.key_ids:
+        forget_key(registry_key, key_id)
+    APIKey.query.filter_by(source_name=source.name).delete()
+    db.session.commit()
+    
+    logger.debug("Deleting API keys from cache")
+    api_keys_changed(source, invalidate=False)
+    
+    return jsonify({"status": "successful", "message": f"API key for {source.name} deleted successfully"}), 200
+
+@main.route("/sources/<source_id>/keys", methods=["GET"])
+def get_api_keys(source_id):
+    source = find_source(source_id)
+    if not source:
+        return not_found_error("Source not found")
+    
+    registry_key, = SourceRegistry.resolve_source_names([source.name])
+    quotas = SourceRegistry.get_instance()[registry_key].quotas
+    api_key_entries = APIKey.query.filter_by(source_name=source.name).order_by(APIKey.id).all()
+    key_ids = [api_key_entry.id for api_key_entry in api_key_entries]
+    usage = get_key_usage(registry_key, key_ids)
+    quota_usage = get_quota_usage({quota_subject(registry_key, key_id): quotas for key_id in key_ids})
+    
+    result = []
+    for api_key_entry in api_key_entries:
+        result.append({
+            "id": api_key_entry.id,
+            "key": api_key_entry.masked_key(),
+            "cooldown": usage[api_key_entry.id]["cooldown"],
+            "requests": usage[api_key_entry.id]["requests"],
+            "quotas": quota_usage[quota_subject(registry_key, api_key_entry.id)]
+        })
+    return jsonify({"status": "successful", "name": source.name, "keys": result}), 200
+
+@main.route("/sources/<source_id>/keys", methods=["POST"])
+def add_api_key(source_id):
+    api_key = request.json.get("api_key")
+    if not api_key or not isinstance(api_key, str):
+        return bad_request_error("Invalid parameter")
+    
+    source = find_source(source_id)
+    if not source:
+        return not_found_error("Source not found")
+
+    if not source.requires_api_key:
+        return bad_request_error("This source does not required an API key")
+    
+    # Results only change when the source gets its first key, further keys only add throughput
+    first_key = not source.is_api_key_configured
+    api_key_entry = APIKey(source_name=source.name)
+    api_key_entry.set_key(api_key)
+    db.session.add(api_key_entry)
     db.session.commit()
+    api_keys_changed(source, invalidate=first_key)
     
-    logger.debug("Deleting API key from cache")
-    redis_key = f"api_key:{source.name}"
-    delete_from_cache(redis_key)
+    return jsonify({"status": "successful", "message": f"API key added to {source.name}", "id": api_key_entry.id}), 201
+
+@main.route("/sources/<source_id>/keys/<int:key_id>", methods=["DELETE"])
+def remove_api_key(source_id, key_id):
+    source = find_source(source_id)
+    if not source:
+        return not_found_error("Source not found")
+    
+    if key_id not in source.key_ids:
+        return not_found_error(f"No API key {key_id} found for source {source.name}")
+    
+    registry_key, = SourceRegistry.resolve_source_names([source.name])
+    forget_key(registry_key, key_id)
+    APIKey.query.filter_by(source_name=source.name, id=key_id).delete()
+    db.session.commit()
+    api_keys_changed(source, invalidate=False)
     
-    return jsonify({"status": "successful", "message": f"API key for {source.name} deleted successfully"}), 200
\ No newline at end of file
+    return jsonify({"status": "successful", "message": f"API key {key_id} of {source.name} deleted successfully"}), 200
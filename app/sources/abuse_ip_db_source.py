@@ -1,4 +1,5 @@
 from app.sources.base_source import BaseSource
+from app.utils.enums import IndicatorType
 from app.utils.logger import setup_logger
 
 import aiohttp
@@ -7,18 +8,19 @@ logger = setup_logger(__name__)
 
 class AbuseIpDbSource(BaseSource):
     def __init__(self):
-        super().__init__(url="https://api.abuseipdb.com/api/v2/check", name="AbuseIPDB", requires_api_key=True)
+        super().__init__(url="https://api.abuseipdb.com/api/v2/check", name="AbuseIPDB", requires_api_key=True,
+                         supported_types={IndicatorType.IPv4, IndicatorType.IPv6}, quotas={"day": 1000})
     
-    async def fetch_ipv4_intel(self, indicator: str) -> dict:
-        return await self.fetch_ip_intel(indicator)
+    async def fetch_ipv4_intel(self, indicator: str, api_key: str=None) -> dict:
+        return await self.fetch_ip_intel(indicator, api_key)
     
-    async def fetch_ipv6_intel(self, indicator: str) -> dict:
-        return await self.fetch_ip_intel(indicator)
+    async def fetch_ipv6_intel(self, indicator: str, api_key: str=None) -> dict:
+        return await self.fetch_ip_intel(indicator, api_key)
     
-    async def fetch_ip_intel(self, indicator: str) -> dict:         
+    async def fetch_ip_intel(self, indicator: str, api_key: str) -> dict:         
         headers = {
             "Accept": "application/json",
-            "Key": self.api_key
+            "Key": api_key
         }
         querystring = {
             "ipAddress": indicator,
@@ -44,11 +46,11 @@ class AbuseIpDbSource(BaseSource):
             return self.format_error(self.create_url(indicator), message=str(e))
         return self.parse_intel(response)
     
-    async def fetch_domain_intel(self, indicator: str):
+    async def fetch_domain_intel(self, indicator: str, api_key: str=None):
         return None
-    async def fetch_url_intel(self, indicator: str):
+    async def fetch_url_intel(self, indicator: str, api_key: str=None):
         return None
-    async def fetch_hash_intel(self, indicator: str):
+    async def fetch_hash_intel(self, indicator: str, api_key: str=None):
         return None
     
     def create_url(self, indicator: str) -> str:
@@ -1,4 +1,5 @@
 from app.sources.base_source import BaseSource
+from app.utils.enums import IndicatorType
 from app.utils.logger import setup_logger
 
 import aiohttp
@@ -6,27 +7,32 @@ import aiohttp
 logger = setup_logger(__name__)
 
 class AlienVaultSource(BaseSource):
+    # Full pulses, often hundreds of them with their descriptions, the verdict is based on pulse_info.count
+    excluded_fields = ("pulse_info.pulses",)
+    schema_version = 2
+
     def __init__(self):
-        super().__init__(url="https://otx.alienvault.com/api/v1/indicators/{}/{}/general/", name="Open Threat Exchange", requires_api_key=True)
+        super().__init__(url="https://otx.alienvault.com/api/v1/indicators/{}/{}/general/", name="Open Threat Exchange", requires_api_key=True,
+                         supported_types={IndicatorType.IPv4, IndicatorType.IPv6, IndicatorType.DOMAIN, IndicatorType.URL, IndicatorType.HASH})
     
-    async def fetch_ipv4_intel(self, ip: str) -> dict:
-        return await self.make_request("IPv4", ip)
+    async def fetch_ipv4_intel(self, ip: str, api_key: str=None) -> dict:
+        return await self.make_request("IPv4", ip, api_key)
     
-    async def fetch_ipv6_intel(self, ip: str) -> dict:
-        return await self.make_request("IPv6", ip)
+    async def fetch_ipv6_intel(self, ip: str, api_key: str=None) -> dict:
+        return await self.make_request("IPv6", ip, api_key)
     
-    async def fetch_domain_intel(self, domain: str) -> dict:
-        return await self.make_request("domain", domain)
+    async def fetch_domain_intel(self, domain: str, api_key: str=None) -> dict:
+        return await self.make_request("domain", domain, api_key)
     
-    async def fetch_url_intel(self, url: str) -> dict:
-        return await self.make_request("url", url)
+    async def fetch_url_intel(self, url: str, api_key: str=None) -> dict:
+        return await self.make_request("url", url, api_key)
     
-    async def fetch_hash_intel(self, hash: str) -> dict:
-        return await self.make_request("file", hash)
+    async def fetch_hash_intel(self, hash: str, api_key: str=None) -> dict:
+        return await self.make_request("file", hash, api_key)
     
-    async def make_request(self, type: str, indicator: str) -> dict:        
+    async def make_request(self, type: str, indicator: str, api_key: str) -> dict:        
         headers = {
-            "X-OTX-API-KEY": self.api_key,
+            "X-OTX-API-KEY": api_key,
             "Content-Type": "application/json"
         }
         
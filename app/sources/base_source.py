@@ -1,25 +1,83 @@
 import abc
 from datetime import datetime, timezone
+import functools
+import json
+import math
+import time
+from urllib.parse import urlsplit
 
-from app.models import fetch_api_key
-from app.utils.cache import fetch_from_cache, cache_results
+from app.config import Config
+from app.models import fetch_api_keys
+from app.utils.cache import fetch_from_cache, cache_results, make_key
+from app.utils.concurrency import get_governor, get_request_flow
 from app.utils.enums import IndicatorType, Verdict
+from app.utils.fixtures import FixtureResponse, fixture_key, get_fixture_store
+from app.utils.hedging import LatencyTracker, hedged_request
 from app.utils.logger import setup_logger
+from app.utils.metrics import SOURCE_ERRORS, SOURCE_REQUEST_LATENCY, SOURCE_RESPONSES, SOURCE_RETRIES, record_quota_headers
+from app.utils.quotas import validate_quotas
+from app.utils.streaming import read_body, read_json
+from app.utils.timeouts import AdaptiveTimeouts
+from app.utils.tracing import set_span_attribute, start_span
 
 import aiohttp
 import xmltodict
 
 logger = setup_logger(__name__)
 
+async def _on_connection_create_start(session, context, params):
+    context.trace_request_ctx["connect_start"] = time.perf_counter()
+
+async def _on_connection_create_end(session, context, params):
+    context.trace_request_ctx["connected"] = time.perf_counter()
+
+# Measures how long connecting took, requests pass a dict the times are stored in as trace_request_ctx
+CONNECT_TRACE = aiohttp.TraceConfig()
+CONNECT_TRACE.on_connection_create_start.append(_on_connection_create_start)
+CONNECT_TRACE.on_connection_create_end.append(_on_connection_create_end)
+
 class BaseSource(abc.ABC):
     """
     Base class for all API sources. Every source should implement this. Unified handling of sources with different features. 
     """
+    # Version of the results returned by parse_intel, bump when they change so cached results of the source are not served
+    schema_version = 1
+    # Dotted paths of JSON response fields parse_intel doesn't need, skipped while the response is parsed, e.g. long lists.
+    # List items are named item. Bump schema_version when changing them.
+    excluded_fields: tuple[str, ...] = ()
+    # Whether slow requests are sent again and the first response used, only for free sources without API keys or quotas,
+    # where the extra requests cost nothing. Replaced by SOURCE_HEDGING.
+    hedge_requests = False
+    # Read timeout of requests in seconds until the source's latencies were observed, see AdaptiveTimeouts
+    default_timeout = 10
     
-    def __init__(self, url: str="", name: str="", requires_api_key: bool=False):
-        self.url = url
+    def __init__(self, url: str="", name: str="", requires_api_key: bool=False, supported_types: set[IndicatorType]=None, quotas: dict[str, int]=None):
+        self.url = Config.SOURCE_BASE_URLS.get(self.__class__.__name__, url)
         self.name = name
         self.requires_api_key = requires_api_key
+        # Requests allowed per window (minute, hour, day or month) by the provider's plan, empty if unlimited or unknown
+        self.quotas = validate_quotas(Config.SOURCE_QUOTAS.get(self.__class__.__name__, quotas or {}))
+        self.daily_quota = self.quotas.get("day")
+        # Largest response body read, larger responses fail instead of taking up the worker's memory
+        self.max_response_bytes = Config.SOURCE_MAX_RESPONSE_BYTES.get(self.__class__.__name__, Config.MAX_RESPONSE_BYTES)
+        if supported_types is None:
+            supported_types = {t for t in IndicatorType if t != IndicatorType.UNKNOWN}
+        self.supported_types = frozenset(supported_types)
+        self.hedged = (Config.SOURCE_HEDGING.get(self.__class__.__name__, self.hedge_requests)
+                       and not self.requires_api_key and not self.quotas)
+        self.latency = LatencyTracker(Config.HEDGE_LATENCY_WINDOW, Config.HEDGE_MIN_SAMPLES) if self.hedged else None
+        self.timeouts = AdaptiveTimeouts(self.get_name(), self.default_timeout)
+    
+    def __init_subclass__(cls, **kwargs):
+        """ Wraps the subclass' parse_intel in a tracing span, so parsing is measured separately from the HTTP request. """
+        super().__init_subclass__(**kwargs)
+        parse_intel = cls.__dict__.get("parse_intel")
+        if parse_intel is not None and not getattr(parse_intel, "__isabstractmethod__", False):
+            @functools.wraps(parse_intel)
+            def traced_parse_intel(self, *args, **kwargs):
+                with start_span("parse_intel", {"source": self.get_name()}):
+                    return parse_intel(self, *args, **kwargs)
+            cls.parse_intel = traced_parse_intel
     
     def get_name(self) -> str:
         """
@@ -32,6 +90,16 @@ class BaseSource(abc.ABC):
         else:
             return self.__class__.__name__
     
+    def supports(self, indicator_type: IndicatorType) -> bool:
+        """
+        Checks if the source is able to enrich given indicator type.
+        
+        :param indicator_type: IndicatorType of the IOC
+        
+        :return: Boolean if the source supports the indicator type
+        """
+        return indicator_type in self.supported_types
+    
     def get_verdict(self, value: int) -> Verdict:
         """
         Transforms integer value to a Verdict enum. 
@@ -53,31 +121,58 @@ class BaseSource(abc.ABC):
         else:
             return Verdict(-1)
     
-    def fetch_api_key(self) -> str:
+    def get_api_keys_cache_key(self) -> str:
         """
-        Fetch API key from Redis database if available. 
-        If API key not in Redis, attempts to fetch it from the database and cache it on Redis for future use.
+        Get the Redis key the source's API keys are cached at.
         
-        :return: API key in string format
+        :return: Key
+        """
+        return make_key("api_key", self.get_name())
+    
+    def fetch_api_keys(self) -> list[tuple[int, str]]:
+        """
+        Fetch the source's API keys from Redis database if available. 
+        If the API keys are not in Redis, attempts to fetch them from the database and cache them on Redis for future use.
+        
+        :return: List of tuples of the key's ID and API key in string format
+        """
+        redis_key = self.get_api_keys_cache_key()
+        logger.debug("Fetching API keys from redis with value %s", redis_key)
+        return self.load_api_keys(fetch_from_cache(redis_key))
+    
+    def load_api_keys(self, cached_api_keys: str | None) -> list[tuple[int, str]]:
+        """
+        Parse the source's API keys cached on Redis, fetched e.g. with one MGET for several sources.
+        If the API keys are not cached, attempts to fetch them from the database and cache them on Redis for future use.
+        
+        :param cached_api_keys: Value cached at get_api_keys_cache_key, None if not cached
+        
+        :return: List of tuples of the key's ID and API key in string format
         """
         name = self.get_name()
-        redis_key = f"api_key:{name}"
-        logger.debug(f"Fetching API key from redis with value {redis_key}")
-        cached_api_key = fetch_from_cache(redis_key)
-        if cached_api_key:
-            logger.debug(f"API key found from redis, with key {redis_key}")
-            api_key = cached_api_key
-            return api_key
+        redis_key = self.get_api_keys_cache_key()
+        if cached_api_keys and cached_api_keys.startswith("["):
+            logger.debug("API keys found from redis, with key %s", redis_key)
+            return [(key_id, api_key) for key_id, api_key in json.loads(cached_api_keys)]
         else:
-            logger.debug(f"Fetching API key from database with name {name}")
-            api_key = fetch_api_key(name)
-            if api_key:
-                logger.debug(f"API key found from database, storing to redis")
-                cache_results(redis_key, api_key)
-                return api_key
-            else:
+            # Entries cached before sources had several keys hold a single key and are replaced
+            logger.debug(f"Fetching API keys from database with name {name}")
+            try:
+                api_keys = fetch_api_keys(name)
+            except ValueError:
                 logger.error(f"Empty API key found in the database for {name}")
                 raise ValueError(f"Empty API key found in the database for {name}")
+            logger.debug(f"{len(api_keys)} API keys found from database, storing to redis")
+            cache_results(redis_key, json.dumps(api_keys))
+            return api_keys
+    
+    def fetch_api_key(self) -> str:
+        """
+        Fetch the source's first API key, see fetch_api_keys.
+        
+        :return: API key in string format
+        """
+        return self.fetch_api_keys()[0][1]
     
     def format_response(self, summary: str="", verdict: int=-1, url: str="", data: dict={}) -> dict:
         """
@@ -137,7 +232,26 @@ class BaseSource(abc.ABC):
         }
         return return_dict
     
-    async def http_request(self, url: str, method="GET", headers=None, json=None, params=None, timeout=10, retries=3) -> dict:
+    def format_quota_exhausted(self, window: str, retry_after: float) -> dict:
+        """
+        Formats the result of a source skipped because its quota is used up, as an error so it is not cached.
+        
+        :param window: Quota window that is used up, cooldown if every API key is cooling down
+        :param retry_after: Seconds until the window resets
+        
+        :return: Dict of error summary, with the window and seconds until it resets under data.quota_exhausted
+        """
+        retry_after = math.ceil(retry_after)
+        if window == "cooldown":
+            message = f"All API keys are cooling down after being rate limited or rejected, retry after {retry_after} seconds"
+        else:
+            message = f"Quota exhausted for the {window} window, retry after {retry_after} seconds"
+        result = self.format_error(message=message, status_code=429,
+                                   timestamp=datetime.now(timezone.utc))
+        result["data"]["quota_exhausted"] = {"window": window, "retry_after": retry_after}
+        return result
+    
+    async def http_request(self, url: str, method="GET", headers=None, json=None, params=None, timeout=None, retries=3) -> dict:
         """
         A helper method to handle HTTP requests uniformly and handle errors.
         
@@ -146,108 +260,241 @@ class BaseSource(abc.ABC):
         :param headers: Dictionary of HTTP headers to send with the request
         :param json: Dictionary of JSON data to send in the request body (for POST/PUT requests)
         :param params: Dictionary of query parameters to append to the URL
-        :param timeout: Timeout for the request in seconds
+        :param timeout: Deadline of the request in seconds, retries included, defaults to SOURCE_REQUEST_DEADLINE.
+                        Each attempt is limited by the source's adaptive connect and read timeouts too.
         :param retries: Number of times to retry the request in case of transient errors
         
         :return: Dict of HTTP response
         """
+        if Config.SOURCE_FIXTURES_MODE == "replay":
+            return await self.replay_request(url, method, params)
+        name = self.get_name()
+        timeout = timeout or Config.SOURCE_REQUEST_DEADLINE
+        deadline = time.monotonic() + timeout
         attempt = 0
         while attempt < retries:
-            logger.debug(f"Sending request to {url}, attempt {attempt}/{retries}")
-            try:
-                # Set timeout configuration
-                timeout_config = aiohttp.ClientTimeout(total=timeout)
+            if time.monotonic() >= deadline:
+                # Retries stop at the deadline, instead of each getting a full timeout
+                SOURCE_ERRORS.labels(name, "DeadlineExceeded").inc()
+                logger.error(f"Request to {url} exceeded its deadline of {timeout} seconds after {attempt} attempts")
+                raise TimeoutError(f"Deadline of {timeout} seconds exceeded after {attempt} attempts")
+            logger.debug("Sending request to %s, attempt %d/%d", url, attempt, retries)
+            start = time.perf_counter()
+            with start_span("http_request", {"source": name, "http.method": method, "attempt": attempt}):
+                try:
+                    send = functools.partial(self.send_request, url, method, headers, json, params, deadline)
+                    if self.hedged:
+                        return await hedged_request(name, send, self.latency)
+                    return await send()
 
-                # Make the request
-                async with aiohttp.ClientSession(timeout=timeout_config) as session:
-                    async with session.request(method, url, headers=headers, json=json, params=params) as response:
-                        response.raise_for_status() # Raise an error for bad HTTP responses (4xx, 5xx)
-                        
-                        content_type = response.headers.get("Content-Type")
-                        if "application/json" in content_type:
-                            data = await response.json() # Parse JSON response
-                            return data
-                        elif "text/txt" in content_type or "text/plain" in content_type or "application/xml" in content_type:
-                            text_data = await response.text() # Fetch as text
-                            data = xmltodict.parse(text_data) # Convert XML to dict
-                            return data
-                        else:
-                            logger.warning(f"Unsupported content type: {content_type}")
-                            return None
-
-            except aiohttp.ClientResponseError as e:
-                logger.error(f"URL: {url}, HTTP Error: {e.status} - {e.message}")
-                if e.status in {500, 502, 503, 504}: # Retry on server errors
-                    attempt += 1
-                    logger.error(f"Server error, retrying... ({attempt}/{retries})")
-                else:
+                except aiohttp.ClientResponseError as e:
+                    SOURCE_ERRORS.labels(name, type(e).__name__).inc()
+                    logger.error(f"URL: {url}, HTTP Error: {e.status} - {e.message}")
+                    if e.status in {500, 502, 503, 504}: # Retry on server errors
+                        attempt += 1
+                        SOURCE_RETRIES.labels(name).inc()
+                        logger.error(f"Server error, retrying... ({attempt}/{retries})")
+                    else:
+                        raise
+                except aiohttp.ClientError as e:
+                    # Handle other connection-related errors (timeouts, network failures)
+                    SOURCE_ERRORS.labels(name, type(e).__name__).inc()
+                    logger.error(f"URL: {url}, Connection error: {str(e)}")
                     raise
-            except aiohttp.ClientError as e:
-                # Handle other connection-related errors (timeouts, network failures)
-                logger.error(f"URL: {url}, Connection error: {str(e)}")
-                raise
-            except TimeoutError as e:
-                logger.error(f"Request to {url} timed out after {timeout} seconds")
-                raise
+                except TimeoutError as e:
+                    SOURCE_ERRORS.labels(name, type(e).__name__).inc()
+                    logger.error(f"Request to {url} timed out")
+                    raise
+                finally:
+                    SOURCE_REQUEST_LATENCY.labels(name).observe(time.perf_counter() - start)
         
         raise RuntimeError(f"Failed after {retries} attempts")
     
-    async def fetch_intel(self, indicator: str, indicator_type: IndicatorType=IndicatorType.UNKNOWN) -> dict | None:
+    async def send_request(self, url: str, method: str="GET", headers=None, json=None, params=None, deadline: float=None) -> dict:
+        """
+        Sends one HTTP request and parses the response, see http_request.
+        The request waits for a slot of the concurrency governor, is limited by the source's current connect and read timeouts,
+        and its latency is counted towards them.
+        
+        :param url: The URL to send the request to
+        :param method: The HTTP method to use
+        :param headers: Dictionary of HTTP headers to send with the request
+        :param json: Dictionary of JSON data to send in the request body
+        :param params: Dictionary of query parameters to append to the URL
+        :param deadline: time.monotonic() the request must have finished by
+        
+        :return: Dict of HTTP response
+        :raises aiohttp.ClientResponseError: If the response has an error status
+        :raises TimeoutError: If the request timed out
+        """
+        name = self.get_name()
+        # Waiting for a free slot counts towards the deadline
+        wait = deadline - time.monotonic() if deadline is not None else None
+        async with get_governor().slot(urlsplit(url).hostname or "", wait):
+            # Set timeout configuration
+            connect_timeout, read_timeout = await self.timeouts.get()
+            total = connect_timeout + read_timeout
+            cut_by_deadline = deadline is not None and deadline - time.monotonic() < total
+            if cut_by_deadline:
+                total = max(deadline - time.monotonic(), 0.001)
+            timeout_config = aiohttp.ClientTimeout(total=total, sock_connect=connect_timeout)
+
+            # Make the request
+            timing = {}
+            answered = False
+            start = time.perf_counter()
+            try:
+                async with aiohttp.ClientSession(timeout=timeout_config, trace_configs=[CONNECT_TRACE]) as session:
+                    async with session.request(method, url, headers=headers, json=json, params=params, trace_request_ctx=timing) as response:
+                        answered = True
+                        set_span_attribute("http.status_code", response.status)
+                        SOURCE_RESPONSES.labels(name, response.status).inc()
+                        record_quota_headers(name, response.headers)
+                        if Config.SOURCE_FIXTURES_MODE == "record":
+                            response = await self.record_response(url, method, params, response)
+                        response.raise_for_status() # Raise an error for bad HTTP responses (4xx, 5xx)
+                        return await self.read_response(response)
+            except TimeoutError:
+                # Requests cut short by the deadline say nothing about the provider's latency
+                answered = not cut_by_deadline
+                raise
+            finally:
+                # Timed out requests count with the time they took, so timeouts grow when a provider slows down
+                if answered:
+                    self.record_latency(start, timing)
+    
+    async def read_response(self, response: aiohttp.ClientResponse | FixtureResponse) -> dict | None:
+        """
+        Parses the body of a successful response, read in chunks up to the source's maximum response size.
+        
+        :param response: Response of the provider, or a recorded one
+        
+        :return: Dict of the JSON or XML body, None for other content types
+        """
+        content_type = response.headers.get("Content-Type", "")
+        if "application/json" in content_type:
+            data = await read_json(response, self.max_response_bytes, self.excluded_fields) # Parse JSON response
+            return data
+        elif "text/txt" in content_type or "text/plain" in content_type or "application/xml" in content_type:
+            text_data = (await read_body(response, self.max_response_bytes)).decode(response.charset or "utf-8") # Fetch as text
+            data = xmltodict.parse(text_data) # Convert XML to dict
+            return data
+        else:
+            logger.warning(f"Unsupported content type: {content_type}")
+            return None
+    
+    async def replay_request(self, url: str, method: str="GET", params=None) -> dict | None:
+        """
+        Answers a request with its response recorded in SOURCE_FIXTURES_DIR, without any network, see app/utils/fixtures.py.
+        
+        :param url: The URL of the request
+        :param method: The HTTP method of the request
+        :param params: Dictionary of query parameters of the request
+        
+        :return: Dict of the recorded response
+        :raises MissingFixtureError: If no response was recorded for the request
+        :raises aiohttp.ClientResponseError: If the recorded response has an error status
+        """
+        response = get_fixture_store().replay(self.__class__.__name__, fixture_key(self.url, url, method, params), url)
+        response.raise_for_status()
+        return await self.read_response(response)
+    
+    async def record_response(self, url: str, method: str, params, response: aiohttp.ClientResponse) -> FixtureResponse:
+        """
+        Stores a response of the provider in SOURCE_FIXTURES_DIR, under the indicator of the running search.
+        
+        :param url: The URL of the request
+        :param method: The HTTP method of the request
+        :param params: Dictionary of query parameters of the request
+        :param response: Response, its body is read
+        
+        :return: FixtureResponse of the stored response, parsed like the provider's
+        """
+        body = await read_body(response, self.max_response_bytes)
+        content_type = response.headers.get("Content-Type", "")
+        get_fixture_store().record(self.__class__.__name__, fixture_key(self.url, url, method, params), get_request_flow()[1],
+                                   response.status, response.reason or "", content_type, body)
+        return FixtureResponse(url, method, response.status, content_type, body, response.reason or "")
+    
+    def record_latency(self, start: float, timing: dict) -> None:
+        """
+        Counts the latency of a request towards the source's adaptive timeouts.
+        
+        :param start: time.perf_counter() the request was sent at
+        :param timing: Times the connection was created at, stored by CONNECT_TRACE
+        """
+        now = time.perf_counter()
+        connect_start, connected = timing.get("connect_start"), timing.get("connected")
+        if connect_start is not None:
+            self.timeouts.observe("connect", (connected or now) - connect_start)
+        # Requests timing out while connecting never reached the read phase
+        if connect_start is None or connected is not None:
+            self.timeouts.observe("read", now - (connected or start))
+    
+    async def fetch_intel(self, indicator: str, indicator_type: IndicatorType=IndicatorType.UNKNOWN, api_key: str=None) -> dict | None:
         """
         Categorizes the indicator and calls the correct method to fetch IOC intel. 
         
         :param indicator: IOC that will be enriched
+        :param indicator_type: IndicatorType of the IOC
+        :param api_key: Already resolved API key, fetched if not given and the source requires one
         
         :return: Enriched IOC data from the source
         """
-        logger.debug(f"Fetching intel for {indicator}, for {self.get_name()}")
-        if self.requires_api_key:
+        logger.debug("Fetching intel for %s, for %s", indicator, self.get_name())
+        if not self.supports(indicator_type):
+            logger.debug("%s does not support indicator type %s", self.get_name(), indicator_type.name)
+            return None
+        
+        with start_span("fetch_intel", {"source": self.get_name(), "indicator.type": indicator_type.name}):
+            # The key is passed down, not kept on the instance, concurrent searches share the source with their own keys
+            if self.requires_api_key and not api_key:
+                try:
+                    api_key = self.fetch_api_key()
+                except ValueError as e:
+                    logger.error(e)
+                    return None
+        
+            data = None
             try:
-                self.api_key = self.fetch_api_key()
-            except ValueError as e:
-                logger.error(e)
-                return None
-        
-        data = None
-        try:
-            if indicator_type == IndicatorType.IPv4:
-                data = await self.fetch_ipv4_intel(indicator)
-            elif indicator_type == IndicatorType.IPv6:
-                data = await self.fetch_ipv6_intel(indicator)
-            elif indicator_type == IndicatorType.DOMAIN:
-                data = await self.fetch_domain_intel(indicator)
-            elif indicator_type == IndicatorType.URL:
-                data = await self.fetch_url_intel(indicator)
-            elif indicator_type == IndicatorType.HASH:
-                data = await self.fetch_hash_intel(indicator)
-            else:
-                logger.warning(f"Invalid indicator type for indicator {indicator}")
-        except Exception as e:
-            logger.error(f"Error occurred during fetching intel: {str(e)}")
-        return data
+                if indicator_type == IndicatorType.IPv4:
+                    data = await self.fetch_ipv4_intel(indicator, api_key)
+                elif indicator_type == IndicatorType.IPv6:
+                    data = await self.fetch_ipv6_intel(indicator, api_key)
+                elif indicator_type == IndicatorType.DOMAIN:
+                    data = await self.fetch_domain_intel(indicator, api_key)
+                elif indicator_type == IndicatorType.URL:
+                    data = await self.fetch_url_intel(indicator, api_key)
+                elif indicator_type == IndicatorType.HASH:
+                    data = await self.fetch_hash_intel(indicator, api_key)
+                else:
+                    logger.warning(f"Invalid indicator type for indicator {indicator}")
+            except Exception as e:
+                logger.error(f"Error occurred during fetching intel: {str(e)}")
+            return data
     
     @abc.abstractmethod
     def create_url(self, indicator: str) -> str:
         raise NotImplementedError("Subclasses should implement this method")
 
     @abc.abstractmethod
-    async def fetch_ipv4_intel(self, indicator: str):
+    async def fetch_ipv4_intel(self, indicator: str, api_key: str=None):
         raise NotImplementedError("Subclasses should implement this method")
     
     @abc.abstractmethod
-    async def fetch_ipv6_intel(self, indicator: str):
+    async def fetch_ipv6_intel(self, indicator: str, api_key: str=None):
         raise NotImplementedError("Subclasses should implement this method")
     
     @abc.abstractmethod
-    async def fetch_domain_intel(self, indicator: str):
+    async def fetch_domain_intel(self, indicator: str, api_key: str=None):
         raise NotImplementedError("Subclasses should implement this method")
     
     @abc.abstractmethod
-    async def fetch_url_intel(self, indicator: str):
+    async def fetch_url_intel(self, indicator: str, api_key: str=None):
         raise NotImplementedError("Subclasses should implement this method")
     
     @abc.abstractmethod
-    async def fetch_hash_intel(self, indicator: str):
+    async def fetch_hash_intel(self, indicator: str, api_key: str=None):
         raise NotImplementedError("Subclasses should implement this method")
     
     @abc.abstractmethod
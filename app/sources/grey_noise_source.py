@@ -1,4 +1,5 @@
 from app.sources.base_source import BaseSource
+from app.utils.enums import IndicatorType
 from app.utils.logger import setup_logger
 
 import aiohttp
@@ -7,18 +8,19 @@ logger = setup_logger(__name__)
 
 class GreyNoiseSource(BaseSource):
     def __init__(self):
-        super().__init__("https://api.greynoise.io/v3/community/", "GreyNoise Community", requires_api_key=True)
+        super().__init__("https://api.greynoise.io/v3/community/", "GreyNoise Community", requires_api_key=True,
+                         supported_types={IndicatorType.IPv4, IndicatorType.IPv6}, quotas={"day": 50})
     
-    async def fetch_ipv4_intel(self, indicator: str) -> dict:
-        return await self.fetch_ip_intel(indicator)
+    async def fetch_ipv4_intel(self, indicator: str, api_key: str=None) -> dict:
+        return await self.fetch_ip_intel(indicator, api_key)
     
-    async def fetch_ipv6_intel(self, indicator: str) -> dict:
-        return await self.fetch_ip_intel(indicator)
+    async def fetch_ipv6_intel(self, indicator: str, api_key: str=None) -> dict:
+        return await self.fetch_ip_intel(indicator, api_key)
     
-    async def fetch_ip_intel(self, indicator: str) -> dict:        
+    async def fetch_ip_intel(self, indicator: str, api_key: str) -> dict:        
         headers = {
             "accept": "application/json", 
-            "key": self.api_key
+            "key": api_key
         }
         search_url = self.url + indicator
         
@@ -47,11 +49,11 @@ class GreyNoiseSource(BaseSource):
             return self.format_error(self.create_url(indicator), message=str(e))
         return self.parse_intel(response)
         
-    async def fetch_domain_intel(self, indicator: str):
+    async def fetch_domain_intel(self, indicator: str, api_key: str=None):
         return None
-    async def fetch_url_intel(self, indicator: str):
+    async def fetch_url_intel(self, indicator: str, api_key: str=None):
         return None
-    async def fetch_hash_intel(self, indicator: str):
+    async def fetch_hash_intel(self, indicator: str, api_key: str=None):
         return None
     
     def create_url(self, indicator: str) -> str:
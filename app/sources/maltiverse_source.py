@@ -1,6 +1,7 @@
 from hashlib import sha256
 
 from app.sources.base_source import BaseSource
+from app.utils.enums import IndicatorType
 from app.utils.logger import setup_logger
 
 import aiohttp
@@ -9,31 +10,32 @@ logger = setup_logger(__name__)
 
 class MaltiverseSource(BaseSource):
     def __init__(self):
-        super().__init__("https://api.maltiverse.com/", "Maltiverse", requires_api_key=True)
+        super().__init__("https://api.maltiverse.com/", "Maltiverse", requires_api_key=True,
+                         supported_types={IndicatorType.IPv4, IndicatorType.DOMAIN, IndicatorType.URL, IndicatorType.HASH})
     
-    async def fetch_ipv4_intel(self, ip: str) -> dict:
-        return await self.make_request("ip", ip)
+    async def fetch_ipv4_intel(self, ip: str, api_key: str=None) -> dict:
+        return await self.make_request("ip", ip, api_key)
     
-    async def fetch_domain_intel(self, domain: str) -> dict:
-        return await self.make_request("hostname", domain)
+    async def fetch_domain_intel(self, domain: str, api_key: str=None) -> dict:
+        return await self.make_request("hostname", domain, api_key)
     
-    async def fetch_url_intel(self, url: str) -> dict:
-        return await self.make_request("url", url)
+    async def fetch_url_intel(self, url: str, api_key: str=None) -> dict:
+        return await self.make_request("url", url, api_key)
     
-    async def fetch_hash_intel(self, hash: str) -> dict:
+    async def fetch_hash_intel(self, hash: str, api_key: str=None) -> dict:
         # Supports SHA256 (64), SHA1 (40) and MD5 (32)
         if len(hash) == 64: # SHA256
-            return await self.make_request("sample", hash)
+            return await self.make_request("sample", hash, api_key)
         elif len(hash) == 40: # SHA1
-            return await self.make_request("sha1", hash)
+            return await self.make_request("sha1", hash, api_key)
         elif len(hash) == 32: # MD5
-            return await self.make_request("md5", hash)
+            return await self.make_request("md5", hash, api_key)
         return None
     
-    async def make_request(self, type: str, indicator: str) -> dict:
+    async def make_request(self, type: str, indicator: str, api_key: str) -> dict:
         headers = {
             "accept": "application/json",
-            "Authorization": f"Bearer {self.api_key}"
+            "Authorization": f"Bearer {api_key}"
         }
         
         # Maltiverse requires URLs to be SHA256 hashed for searches
@@ -62,7 +64,7 @@ class MaltiverseSource(BaseSource):
             return self.format_error(self.create_url(indicator), message=str(e))
         return self.parse_intel(response)
     
-    async def fetch_ipv6_intel(self, indicator: str):
+    async def fetch_ipv6_intel(self, indicator: str, api_key: str=None):
         return None
     
     def create_url(self, indicator: str) -> str:
@@ -84,9 +86,10 @@ class MaltiverseSource(BaseSource):
             if key in indicator_fields:
                 indicator = intel.get(key, "")
         
+        # Blacklist is a list of the feeds listing the indicator
         if blacklisted:
             verdict += 1
-            if blacklisted > 2:
+            if len(blacklisted) > 2:
                 verdict = 2
         
         if classification == "malicious":
@@ -1,4 +1,5 @@
 from app.sources.base_source import BaseSource
+from app.utils.enums import IndicatorType
 from app.utils.logger import setup_logger
 
 import aiohttp
@@ -6,13 +7,16 @@ import aiohttp
 logger = setup_logger(__name__)
 
 class StopForumSpamSource(BaseSource):
+    hedge_requests = True
+    
     def __init__(self):
-        super().__init__(url="https://api.stopforumspam.org/api", name="Stop Forum Spam", requires_api_key=False)
+        super().__init__(url="https://api.stopforumspam.org/api", name="Stop Forum Spam", requires_api_key=False,
+                         supported_types={IndicatorType.IPv4, IndicatorType.IPv6})
     
-    async def fetch_ipv4_intel(self, ip: str) -> dict:
+    async def fetch_ipv4_intel(self, ip: str, api_key: str=None) -> dict:
         return await self.fetch_ip_intel(ip)
     
-    async def fetch_ipv6_intel(self, ip: str) -> dict:
+    async def fetch_ipv6_intel(self, ip: str, api_key: str=None) -> dict:
         return await self.fetch_ip_intel(ip)
     
     async def fetch_ip_intel(self, indicator: str) -> dict:
@@ -48,11 +52,11 @@ class StopForumSpamSource(BaseSource):
             return self.parse_intel(response)
         return response
     
-    async def fetch_domain_intel(self, indicator: str):
+    async def fetch_domain_intel(self, indicator: str, api_key: str=None):
         return None
-    async def fetch_url_intel(self, indicator: str):
+    async def fetch_url_intel(self, indicator: str, api_key: str=None):
         return None
-    async def fetch_hash_intel(self, indicator: str):
+    async def fetch_hash_intel(self, indicator: str, api_key: str=None):
         return None
     
     def create_url(self, indicator):
@@ -1,30 +1,36 @@
 from app.sources.base_source import BaseSource
+from app.utils.enums import IndicatorType
 from app.utils.logger import setup_logger
 
 logger = setup_logger(__name__)
 
 class ThreatMinerSource(BaseSource):
+    hedge_requests = True
+    # The API is slow, until its latencies were observed
+    default_timeout = 30
+    
     def __init__(self):
-        super().__init__(url="https://api.threatminer.org/v2/", name="ThreatMiner", requires_api_key=False)
+        super().__init__(url="https://api.threatminer.org/v2/", name="ThreatMiner", requires_api_key=False,
+                         supported_types={IndicatorType.IPv4, IndicatorType.IPv6, IndicatorType.DOMAIN, IndicatorType.HASH})
     
-    async def fetch_ipv4_intel(self, ip: str) -> dict:
+    async def fetch_ipv4_intel(self, ip: str, api_key: str=None) -> dict:
         search_url = self.url + f"host.php?q={ip}&rt=6"
         return await self.fetch_intel_by_url(search_url)
     
-    async def fetch_ipv6_intel(self, ip: str) -> dict:
+    async def fetch_ipv6_intel(self, ip: str, api_key: str=None) -> dict:
         search_url = self.url + f"host.php?q={ip}&rt=6"
         return await self.fetch_intel_by_url(search_url)
     
-    async def fetch_domain_intel(self, domain: str) -> dict:
+    async def fetch_domain_intel(self, domain: str, api_key: str=None) -> dict:
         search_url = self.url + f"domain.php?q={domain}&rt=6"
         return await self.fetch_intel_by_url(search_url)
     
-    async def fetch_hash_intel(self, hash: str) -> dict:
+    async def fetch_hash_intel(self, hash: str, api_key: str=None) -> dict:
         search_url = self.url + f"sample.php?q={hash}&rt=7"
         return await self.fetch_intel_by_url(search_url)
     
     async def fetch_intel_by_url(self, url: str) -> dict:
-        response = await self.http_request(url, timeout=30)
+        response = await self.http_request(url)
 
         # Bad API design
         # HTTP Status code 200 --> Response "status_code" contains the actual status, in str format
@@ -37,7 +43,7 @@ class ThreatMinerSource(BaseSource):
             
         return self.parse_intel(response)
     
-    async def fetch_url_intel(self, indicator: str):
+    async def fetch_url_intel(self, indicator: str, api_key: str=None):
         return None
     
     def create_url(self, indicator) -> str:
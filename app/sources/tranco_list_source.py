@@ -1,4 +1,5 @@
 from app.sources.base_source import BaseSource
+from app.utils.enums import IndicatorType
 from app.utils.logger import setup_logger
 
 import aiohttp
@@ -6,10 +7,13 @@ import aiohttp
 logger = setup_logger(__name__)
 
 class TrancoListSource(BaseSource):
+    hedge_requests = True
+    
     def __init__(self):
-        super().__init__(url="https://tranco-list.eu/api/ranks/domain/", name="Tranco", requires_api_key=False)
+        super().__init__(url="https://tranco-list.eu/api/ranks/domain/", name="Tranco", requires_api_key=False,
+                         supported_types={IndicatorType.DOMAIN})
         
-    async def fetch_domain_intel(self, indicator: str) -> dict:
+    async def fetch_domain_intel(self, indicator: str, api_key: str=None) -> dict:
         domain_url = self.url + indicator
         
         try:
@@ -42,13 +46,13 @@ class TrancoListSource(BaseSource):
             return self.parse_intel(response)
         return response
     
-    async def fetch_ipv4_intel(self, indicator: str):
+    async def fetch_ipv4_intel(self, indicator: str, api_key: str=None):
         return None
-    async def fetch_ipv6_intel(self, indicator: str):
+    async def fetch_ipv6_intel(self, indicator: str, api_key: str=None):
         return None
-    async def fetch_url_intel(self, indicator: str):
+    async def fetch_url_intel(self, indicator: str, api_key: str=None):
         return None
-    async def fetch_hash_intel(self, indicator: str):
+    async def fetch_hash_intel(self, indicator: str, api_key: str=None):
         return None
     
     def create_url(self, indicator) -> str:
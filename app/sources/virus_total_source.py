@@ -1,4 +1,5 @@
 from app.sources.base_source import BaseSource
+from app.utils.enums import IndicatorType
 from app.utils.logger import setup_logger
 
 import base64
@@ -8,34 +9,40 @@ import aiohttp
 logger = setup_logger(__name__)
 
 class VirusTotalSource(BaseSource):
+    # Per-engine verdicts, the verdict is based on last_analysis_stats summarizing them
+    excluded_fields = ("data.attributes.last_analysis_results",)
+    schema_version = 2
+
     def __init__(self):
-        super().__init__("https://www.virustotal.com/api/v3/", "VirusTotal", requires_api_key=True)
+        super().__init__("https://www.virustotal.com/api/v3/", "VirusTotal", requires_api_key=True,
+                         supported_types={IndicatorType.IPv4, IndicatorType.IPv6, IndicatorType.DOMAIN, IndicatorType.URL, IndicatorType.HASH},
+                         quotas={"minute": 4, "day": 500, "month": 15500})
     
-    async def fetch_ipv4_intel(self, ip: str) -> dict:
+    async def fetch_ipv4_intel(self, ip: str, api_key: str=None) -> dict:
         url = self.url + "ip_addresses/" + ip
-        return await self.fetch_intel_by_url(url, ip)
+        return await self.fetch_intel_by_url(url, ip, api_key)
     
-    async def fetch_ipv6_intel(self, ip: str) -> dict:
+    async def fetch_ipv6_intel(self, ip: str, api_key: str=None) -> dict:
         url = self.url + "ip_addresses/" + ip
-        return await self.fetch_intel_by_url(url, ip)
+        return await self.fetch_intel_by_url(url, ip, api_key)
     
-    async def fetch_domain_intel(self, domain: str) -> dict:
+    async def fetch_domain_intel(self, domain: str, api_key: str=None) -> dict:
         url = self.url + "domains/" + domain
-        return await self.fetch_intel_by_url(url, domain)
+        return await self.fetch_intel_by_url(url, domain, api_key)
     
-    async def fetch_url_intel(self, url_ioc: str) -> dict:
+    async def fetch_url_intel(self, url_ioc: str, api_key: str=None) -> dict:
         url_hash = base64.urlsafe_b64encode(url_ioc.encode()).decode().strip("=")
         url = f"{self.url}urls/{url_hash}"
-        return await self.fetch_intel_by_url(url, url_ioc)
+        return await self.fetch_intel_by_url(url, url_ioc, api_key)
     
-    async def fetch_hash_intel(self, hash: str) -> dict:
+    async def fetch_hash_intel(self, hash: str, api_key: str=None) -> dict:
         url = f"{self.url}files/{hash}"
-        return await self.fetch_intel_by_url(url, hash)
+        return await self.fetch_intel_by_url(url, hash, api_key)
     
-    async def fetch_intel_by_url(self, url, indicator="") -> dict:
+    async def fetch_intel_by_url(self, url, indicator="", api_key: str=None) -> dict:
         headers = {
             "accept": "application/json",
-            "x-apikey": self.api_key
+            "x-apikey": api_key
         }
         
         try:
@@ -2,54 +2,411 @@ from app.celery_worker import celery
 from app.config import Config
 from app.sources.base_source import BaseSource
 from app.utils.source_registry import SourceRegistry
-from app.utils.cache import generate_cache_key, cache_results, fetch_from_cache
+from app.utils.bulk_jobs import (CHUNK_SIZE, add_job_tasks, append_job_indicators, claim_job_completion, finish_ingest, get_bulk_job, iter_job_indicators,
+                                 pop_job_results, queue_job_result, record_task_finished)
+from app.utils.concurrency import set_request_flow
+from app.utils.cache import cache_result, claim_refresh, claim_refresh_async, fetch_cached_result, fetch_many_from_cache, generate_cache_key, get_fresh_ttls
+from app.utils.history import load_fresh_results, prune_history, run_in_thread, store_results
+from app.utils.enums import IndicatorType
 from app.utils.indicator_type import get_indicator_type
-from app.utils.logger import setup_logger
+from app.utils.ioc_extraction import BloomFilter, extract_indicators
+from app.utils.key_pool import COOLDOWN_STATUSES, acquire_api_key, quota_subject, record_key_result
+from app.utils.logger import sampled, setup_logger
+from app.utils.metrics import PREWARM_LOOKUPS, WEBHOOK_DELIVERIES
+from app.utils.prewarm import decay_frequencies, get_hot_lookups, get_remaining_budgets, record_lookup, spend_budget
+from app.utils.queues import defer_task, pop_due_tasks, queue_for_priority
+from app.utils.quotas import QuotaExhausted, acquire_quota, release_quota
+from app.utils.tracing import extract_context, start_span
+from app.utils.webhooks import WebhookDeliveryError, close_http_session, dead_letter, deliver_webhook, retry_delay
+
+from celery.exceptions import Ignore
+from celery.signals import worker_process_shutdown
 
 import asyncio
+import json
+import os
+import threading
+import time
+import uuid
 
 logger = setup_logger(__name__)
+# Messages logged for every searched indicator
+indicator_logger = sampled(logger)
+
+# Event loop of the worker thread, kept between tasks
+_event_loop = threading.local()
+
+def run_async(coroutine):
+    """
+    Runs the coroutine on the worker's event loop. Unlike asyncio.run the loop is kept between tasks,
+    so the connections of the async Redis client are reused. Forked processes create their own loop.
+    
+    :param coroutine: Coroutine to run
+    
+    :return: Result of the coroutine
+    """
+    if getattr(_event_loop, "pid", None) != os.getpid() or _event_loop.loop.is_closed():
+        _event_loop.loop = asyncio.new_event_loop()
+        _event_loop.pid = os.getpid()
+    return _event_loop.loop.run_until_complete(coroutine)
+
+@worker_process_shutdown.connect
+def close_event_loop(**kwargs):
+    """ Closes the pooled connections of the worker's event loop, called when the process exits. """
+    if getattr(_event_loop, "pid", None) == os.getpid() and not _event_loop.loop.is_closed():
+        _event_loop.loop.run_until_complete(close_http_session())
+        _event_loop.loop.close()
 
 @celery.task(bind=True)
-def search_task(self, indicator: str):
-    logger.info(f"Starting search task for {indicator}")
-    return asyncio.run(main_task(indicator))
+def search_task(self, indicator: str, sources: list[str]=None, exclude_sources: list[str]=None, job_id: str=None, priority: str="interactive",
+                callback_url: str=None):
+    indicator_logger.info("Starting search task for %s", indicator)
+    try:
+        with start_span("search_task", {"celery.task_id": self.request.id or ""}, context=extract_context(self.request)):
+            result = run_async(main_task(indicator, sources, exclude_sources, priority=priority))
+    except QuotaExhausted as e:
+        # Sent again with the same ID once the quota resets, the bulk job counts it when it finally runs
+        logger.info("Deferring search task for %s by %d seconds: %s", indicator, round(e.retry_after), e)
+        defer_task(self.name, self.request.id, [indicator, sources, exclude_sources], {"job_id": job_id, "priority": priority, "callback_url": callback_url},
+                   queue_for_priority(priority), e.retry_after)
+        self.update_state(state="DEFERRED", meta={"message": str(e), "retry_after": round(e.retry_after)})
+        raise Ignore()
+    except Exception as e:
+        job_completed = record_task_finished(job_id, failed=True) if job_id else False
+        if callback_url:
+            notify_search_finished(callback_url, {"task_id": self.request.id, "indicator": indicator, "state": "FAILURE", "error": str(e)}, job_id, job_completed)
+        raise
+    job_completed = record_task_finished(job_id) if job_id else False
+    if callback_url:
+        notify_search_finished(callback_url, {"task_id": self.request.id, "indicator": indicator, "state": "SUCCESS", "result": result}, job_id, job_completed)
+    return result
 
-async def main_task(indicator: str):
-    # Generate cache key
-    cache_key = generate_cache_key(indicator)
+def send_webhook(url: str, event: str, payload: dict) -> None:
+    """
+    Queues a callback, delivered by webhook_task on the refresh queue so slow receivers don't hold the search workers.
+    
+    :param url: Callback URL
+    :param event: Event name
+    :param payload: Body of the callback
+    """
+    body = json.dumps({"event": event, **payload}, default=str)
+    webhook_task.delay(url, event, body, str(uuid.uuid4()), 1)
 
-    # Check for cached results
-    cached_results = fetch_from_cache(cache_key)
-    if cached_results:
-        logger.info(f"Cached result found for {indicator}, returning cached result")
-        return handle_result(cached_results)
+def schedule_webhook_retry(url: str, event: str, body: str, delivery_id: str, attempt: int, error: WebhookDeliveryError) -> None:
+    """ Schedules the next attempt of a failed delivery, or dead-letters it once the attempts are used up. """
+    if not error.retryable or attempt >= Config.WEBHOOK_MAX_ATTEMPTS:
+        dead_letter(url, event, body, delivery_id, attempt, str(error))
+        return
+    delay = retry_delay(attempt)
+    logger.info(f"Callback {delivery_id} to {url} failed, retrying in {delay:.0f} seconds: {error}")
+    WEBHOOK_DELIVERIES.labels(event=event, outcome="retried").inc()
+    webhook_task.apply_async((url, event, body, delivery_id, attempt + 1), countdown=delay)
 
-    logger.info(f"No cached result found for {indicator}, proceeding to searching")
+@celery.task
+def webhook_task(url: str, event: str, body: str, delivery_id: str, attempt: int):
+    """
+    Delivers a callback, failed attempts are retried with another task.
+    
+    :param url: Callback URL
+    :param event: Event name
+    :param body: JSON body
+    :param delivery_id: ID of the delivery
+    :param attempt: Number of this attempt, 1 for redeliveries of dead-lettered callbacks
+    """
+    try:
+        run_async(deliver_webhook(url, event, body, delivery_id))
+    except WebhookDeliveryError as e:
+        schedule_webhook_retry(url, event, body, delivery_id, attempt, e)
+
+def notify_search_finished(callback_url: str, entry: dict, job_id: str=None, job_completed: bool=False) -> None:
+    """
+    Sends the result of a finished search to its callback URL. Results of bulk jobs are sent in batches of
+    WEBHOOK_BATCH_SIZE, and the rest with the job's completion.
+    
+    :param callback_url: Callback URL
+    :param entry: Task ID, indicator, state and result or error of the search
+    :param job_id: ID of the bulk job the search belongs to
+    :param job_completed: Whether the job completed with this search
+    """
+    if not job_id:
+        send_webhook(callback_url, "search.completed", entry)
+        return
+    waiting = queue_job_result(job_id, json.dumps(entry, default=str))
+    if waiting >= Config.WEBHOOK_BATCH_SIZE or job_completed:
+        flush_job_results(job_id, callback_url, everything=job_completed)
+    if job_completed:
+        send_webhook(callback_url, "bulk.completed", {"job": get_bulk_job(job_id)})
 
-    sources = SourceRegistry.get_instance()
+def flush_job_results(job_id: str, callback_url: str, everything: bool=False) -> None:
+    """
+    Sends the bulk job's waiting results in batches.
     
-    # List to store results
-    results = []
+    :param job_id: ID of the job
+    :param callback_url: Callback URL
+    :param everything: Whether to send a last partial batch too
+    """
+    # Only full batches are popped until the job completes, a partial one is left for a later task or the completing one
+    minimum = 1 if everything else Config.WEBHOOK_BATCH_SIZE
+    while results := pop_job_results(job_id, Config.WEBHOOK_BATCH_SIZE, minimum):
+        send_webhook(callback_url, "bulk.results", {"job_id": job_id, "results": [json.loads(entry) for entry in results]})
+
+@celery.task
+def dispatch_bulk_job(job_id: str):
+    """
+    Enqueues a search task for every indicator of the bulk job, in chunks so large jobs are not held in memory.
+    
+    :param job_id: ID of the job
+    """
+    job = get_bulk_job(job_id)
+    if not job:
+        logger.warning(f"Bulk job {job_id} not found, it may have expired")
+        return
+    queue = queue_for_priority(job["priority"])
+    logger.info(f"Dispatching {job['total']} tasks of bulk job {job_id} to {queue}")
+    for indicators in iter_job_indicators(job_id):
+        dispatch_job_indicators(job_id, job, indicators, queue)
+
+def dispatch_job_indicators(job_id: str, job: dict, indicators: list[str], queue: str) -> None:
+    """
+    Enqueues a search task for each of the indicators of the bulk job.
+    
+    :param job_id: ID of the job
+    :param job: Bulk job
+    :param indicators: Indicators to search
+    :param queue: Queue of the job's priority
+    """
+    kwargs = {"job_id": job_id, "priority": job["priority"]}
+    if job["callback_url"]:
+        kwargs["callback_url"] = job["callback_url"]
+    task_ids = [
+        search_task.apply_async((indicator, job["sources"], job["exclude_sources"]), kwargs, queue=queue).id
+        for indicator in indicators
+    ]
+    add_job_tasks(job_id, task_ids)
+
+@celery.task
+def ingest_task(job_id: str, path: str, types: list[str]=None):
+    """
+    Scans an uploaded file for indicators and enqueues a search task for every unique one, in chunks while the file
+    is read, so neither the file nor its indicators are held in memory. The file is removed afterwards.
+    
+    :param job_id: ID of the bulk job created for the file
+    :param path: Path of the uploaded file
+    :param types: Values of the IndicatorTypes to extract, all if not given
+    """
+    try:
+        job = get_bulk_job(job_id)
+        if not job:
+            logger.warning(f"Ingest job {job_id} not found, it may have expired")
+            return
+        queue = queue_for_priority(job["priority"])
+        seen = BloomFilter(Config.INGEST_DEDUP_CAPACITY, Config.INGEST_DEDUP_ERROR_RATE)
+        indicator_types = {IndicatorType(value) for value in types} if types else None
+        logger.info(f"Scanning {path} for bulk job {job_id}")
+        
+        batch, total, truncated = [], 0, False
+        with open(path, "rb") as file:
+            try:
+                for indicator, _ in extract_indicators(file, seen, indicator_types):
+                    if total >= Config.INGEST_MAX_INDICATORS:
+                        truncated = True
+                        break
+                    batch.append(indicator)
+                    total += 1
+                    if len(batch) >= CHUNK_SIZE:
+                        append_job_indicators(job_id, batch, file.tell())
+                        dispatch_job_indicators(job_id, job, batch, queue)
+                        batch = []
+                if batch:
+                    append_job_indicators(job_id, batch, file.tell())
+                    dispatch_job_indicators(job_id, job, batch, queue)
+            except Exception as e:
+                logger.exception(f"Scanning {path} for bulk job {job_id} failed")
+                finish_ingest(job_id, file.tell(), error=str(e))
+                raise
+            finish_ingest(job_id, file.tell(), truncated)
+        logger.info(f"Extracted {total} unique indicators for bulk job {job_id}" + (", stopped at INGEST_MAX_INDICATORS" if truncated else ""))
+        # Searches that finished while the file was scanned couldn't complete the job
+        job = get_bulk_job(job_id)
+        if job["callback_url"] and job["state"] == "COMPLETED" and claim_job_completion(job_id):
+            flush_job_results(job_id, job["callback_url"], everything=True)
+            send_webhook(job["callback_url"], "bulk.completed", {"job": job})
+    finally:
+        if os.path.exists(path):
+            os.remove(path)
+
+@celery.task
+def refresh_task(indicator: str, sources: list[str]=None, exclude_sources: list[str]=None):
+    """
+    Refreshes stale cached results of a search in the background.
+    
+    :param indicator: Searched indicator
+    :param sources: Registry keys of sources the search was limited to
+    :param exclude_sources: Registry keys of sources left out of the search
+    """
+    indicator_logger.info("Refreshing cached results for %s", indicator)
+    with start_span("refresh_task"):
+        run_async(main_task(indicator, sources, exclude_sources, refresh=True, priority="refresh"))
+
+@celery.task
+def release_deferred_task():
+    """ Sends searches deferred until their sources' quotas reset back to their queues. """
+    due = pop_due_tasks()
+    for task in due:
+        celery.send_task(task["task"], task["args"], task["kwargs"], task_id=task["id"], queue=task["queue"])
+    if due:
+        logger.info(f"Released {len(due)} deferred tasks")
+
+@celery.task
+def prewarm_task():
+    """
+    Refreshes the most frequently looked up searches before their cached results turn stale.
+    Each source is sent at most PREWARM_QUOTA_SHARE of its daily quota by pre-warming.
+    """
+    decay_frequencies()
+    budgets = get_remaining_budgets({key: source.daily_quota for key, source in SourceRegistry.get_instance().items() if source.daily_quota})
+    hot_lookups = get_hot_lookups(Config.PREWARM_TOP_N)
+    searches = [(indicator, sources, exclude_sources, *resolve_search(indicator, sources, exclude_sources)) for indicator, sources, exclude_sources, _ in hot_lookups]
+    fresh_ttls = get_fresh_ttls([cache_key for *_, cache_key in searches])
+
+    # Refresh results turning stale before the run after next, so a missed run doesn't let them expire
+    horizon = 2 * Config.PREWARM_INTERVAL
+    refreshed = 0
+    for (indicator, sources, exclude_sources, include, exclude, cache_key), fresh_ttl in zip(searches, fresh_ttls):
+        if fresh_ttl is not None and fresh_ttl > horizon:
+            continue
+        applicable = [key for key in SourceRegistry.get_sources_for(get_indicator_type(indicator), include, exclude) if key in budgets]
+        if any(budgets[key] < 1 for key in applicable):
+            PREWARM_LOOKUPS.labels("quota_exhausted").inc()
+            continue
+        if not claim_refresh(cache_key):
+            PREWARM_LOOKUPS.labels("in_progress").inc()
+            continue
+        for key in applicable:
+            budgets[key] -= 1
+        spend_budget(applicable)
+        refresh_task.delay(indicator, sources, exclude_sources)
+        PREWARM_LOOKUPS.labels("refreshed").inc()
+        refreshed += 1
+    logger.info(f"Pre-warming {refreshed} of the {len(hot_lookups)} most frequent lookups")
+
+@celery.task
+def prune_history_task():
+    """ Deletes stored results older than HISTORY_RETENTION_DAYS. """
+    deleted = prune_history(Config.HISTORY_RETENTION_DAYS)
+    logger.info(f"Pruned {deleted} stored results older than {Config.HISTORY_RETENTION_DAYS} days")
+
+def resolve_search(indicator: str, sources: list[str]=None, exclude_sources: list[str]=None) -> tuple[set[str] | None, set[str] | None, str]:
+    """
+    Resolves the search's source filters and cache key.
+    
+    :param indicator: Searched indicator
+    :param sources: Source names to limit the search to
+    :param exclude_sources: Source names to leave out of the search
+    
+    :return: Tuple of registry keys to include (None for all), registry keys to exclude and the cache key
+    """
+    include = SourceRegistry.resolve_source_names(sources) if sources else None
+    exclude = SourceRegistry.resolve_source_names(exclude_sources) if exclude_sources else None
+    indicator_type = get_indicator_type(indicator)
+    source_versions = {key: source.schema_version for key, source in SourceRegistry.get_sources_for(indicator_type, include, exclude).items()}
+    return include, exclude, generate_cache_key(indicator, indicator_type.name, source_versions)
+
+async def main_task(indicator: str, sources: list[str]=None, exclude_sources: list[str]=None, refresh: bool=False, priority: str="interactive"):
+    # Resolve optional source filters and generate cache key
+    include, exclude, cache_key = resolve_search(indicator, sources, exclude_sources)
+
+    # Check for cached results, refreshes skip the cache
+    cached = None
+    if not refresh:
+        with start_span("cache.lookup"):
+            _, cached = await asyncio.gather(record_lookup(indicator, sources, exclude_sources), fetch_cached_result(cache_key))
+    if cached:
+        cached_result, age, stale, refresh_due = cached
+        cached_result["cache"] = {"stale": stale, "age": round(age)}
+        if refresh_due and await claim_refresh_async(cache_key):
+            indicator_logger.info("Cached result found for %s, returning it and refreshing in the background", indicator)
+            refresh_task.delay(indicator, sources, exclude_sources)
+        else:
+            indicator_logger.info("Cached result found for %s, returning cached result", indicator)
+        return handle_result(cached_result)
+
+    indicator_logger.info("No cached result found for %s, proceeding to searching", indicator)
+    start = time.perf_counter()
+    set_request_flow(indicator, priority)
 
     indicator_type = get_indicator_type(indicator)
-    logger.debug(f"Indicator type: {indicator_type.name}")
+    logger.debug("Indicator type: %s", indicator_type.name)
+
+    # Only sources supporting the indicator type and having an API key configured are scheduled
+    applicable_sources = SourceRegistry.get_sources_for(indicator_type, include, exclude)
+
+    # Recent results stored in the database are reused, so a flushed cache is rehydrated without querying the sources
+    stored_results = {}
+    if not refresh:
+        with start_span("history.lookup"):
+            stored_results = await run_in_thread(load_fresh_results, indicator, indicator_type,
+                                                 {source.get_name(): source.schema_version for source in applicable_sources.values()},
+                                                 Config.HISTORY_MAX_AGE)
+    pending_sources = {key: source for key, source in applicable_sources.items() if source.get_name() not in stored_results}
+
+    with start_span("resolve_api_keys"):
+        api_keys = await resolve_api_keys(pending_sources)
+    sources = {key: source for key, source in pending_sources.items() if not source.requires_api_key or key in api_keys}
+    logger.debug("Scheduling %d/%d applicable sources, %d found from the database", len(sources), len(applicable_sources), len(stored_results))
+
+    # Requests are counted against the quotas of the sources, or of the API keys picked from their key pools, before any is sent,
+    # so a deferred search doesn't spend quota
+    key_ids, exhausted = {}, {}
+
+    async def acquire(key: str, source: BaseSource):
+        if key in api_keys:
+            key_ids[key], denied = await acquire_api_key(key, list(api_keys[key]), source.quotas, priority)
+        else:
+            denied = await acquire_quota(key, source.quotas, priority)
+        if denied:
+            exhausted[key] = denied
+
+    with start_span("quota.acquire"):
+        await asyncio.gather(*(acquire(key, source) for key, source in sources.items()))
+    if exhausted and priority != "interactive" and not refresh and Config.QUOTA_EXHAUSTED_ACTION == "defer":
+        await asyncio.gather(*(release_quota(quota_subject(key, key_ids.get(key)), source.quotas) for key, source in sources.items() if key not in exhausted))
+        raise QuotaExhausted(list(exhausted), max(retry_after for _, retry_after in exhausted.values()))
+    skipped_results = {sources[key].get_name(): sources[key].format_quota_exhausted(*denied) for key, denied in exhausted.items()}
+    sources = {key: source for key, source in sources.items() if key not in exhausted}
 
-    async def query_source(source: BaseSource):
-        semaphore = asyncio.Semaphore(Config.MAX_CONCURRENT_REQUESTS)
-        async with semaphore:
+    # Requests wait for slots of the process' concurrency governor, see BaseSource.send_request
+    async def query_source(key: str, source: BaseSource):
+        key_id = key_ids.get(key)
+        tried = set()
+        while True:
             try:
-                response = await source.fetch_intel(indicator, indicator_type)
-                return response
+                response = await source.fetch_intel(indicator, indicator_type, api_keys[key][key_id] if key_id is not None else None)
             except Exception as e:
                 logger.error(f"Error fetching data from {source.get_name()}: {e}")
                 return None
+            if key_id is None:
+                return response
+            status_code = error_status(response)
+            await record_key_result(key, key_id, status_code)
+            if status_code not in COOLDOWN_STATUSES:
+                return response
+            # The key was taken out of rotation, retry with another key of the pool
+            tried.add(key_id)
+            key_id, _ = await acquire_api_key(key, [other for other in api_keys[key] if other not in tried], source.quotas, priority)
+            if key_id is None:
+                return response
     
-    tasks = [query_source(source) for source in sources.values()]
+    tasks = [query_source(key, source) for key, source in sources.items()]
     
     results = await asyncio.gather(*tasks)
     
     results = {source.get_name(): result for source, result in zip(sources.values(), results) if result}
+    if results:
+        with start_span("history.store"):
+            await run_in_thread(store_results, indicator, indicator_type, results,
+                                {source.get_name(): source.schema_version for source in sources.values()})
+    results = {**stored_results, **skipped_results, **results}
     
     encountered_error = False
     
@@ -70,13 +427,47 @@ async def main_task(indicator: str):
     
     # Cache results, ignore if error was encountered and empty results
     if encountered_error:
-        logger.info("Source encountered an error, skipping caching")
+        indicator_logger.info("Source encountered an error, skipping caching")
     elif results:
-        cache_results(cache_key, final_result, expiration=Config.CACHE_EXPIRATION)
+        # Failed refreshes keep their claim until it expires, so a failing source isn't retried on every stale hit
+        with start_span("cache.store"):
+            await cache_result(cache_key, final_result, compute_time=time.perf_counter() - start, release_claim=refresh)
     else:
-        logger.info("Empty results, skipping caching")
+        indicator_logger.info("Empty results, skipping caching")
 
     return handle_result(final_result)
 
+async def resolve_api_keys(sources: dict[str, BaseSource]) -> dict[str, dict[int, str]]:
+    """
+    Fetch API keys for the sources requiring one, with one MGET for all of them. Sources without a configured key are left out.
+    
+    :param sources: Dict of source's name and the class
+    
+    :return: Dict of source's name and dict of its keys' IDs and API keys
+    """
+    keyed_sources = {key: source for key, source in sources.items() if source.requires_api_key}
+    cached = await fetch_many_from_cache([source.get_api_keys_cache_key() for source in keyed_sources.values()])
+    api_keys = {}
+    for (key, source), cached_api_keys in zip(keyed_sources.items(), cached):
+        try:
+            api_keys[key] = dict(source.load_api_keys(cached_api_keys))
+        except ValueError:
+            logger.debug("No API key configured for %s, skipping source", source.get_name())
+    return api_keys
+
+def error_status(result: dict | None) -> int | None:
+    """
+    Get the HTTP status code of a source's error result.
+    
+    :param result: Result returned by the source
+    
+    :return: Status code, 0 if the request failed without one, None if the result is not an error
+    """
+    if result is None:
+        return 0
+    if result.get("summary") != "error":
+        return None
+    return result.get("data", {}).get("status_code") or 0
+
 def handle_result(results: dict):
     return results
\ No newline at end of file
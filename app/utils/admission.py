@@ -0,0 +1,134 @@
+import json
+import time
+
+from app.config import Config
+from app.utils.cache import jittered_expiration, make_key, redis_client
+from app.utils.logger import setup_logger
+from app.utils.metrics import ADMISSION_REJECTIONS
+from app.utils.queues import PRIORITY_QUEUES
+
+from redis.exceptions import RedisError
+
+logger = setup_logger(__name__)
+
+# Worker heartbeats, a hash of worker host names and their pool size, busy processes and expiry
+WORKERS_KEY = make_key("admission", "workers")
+# Seconds a heartbeat counts, workers sending none for this long are left out of the saturation
+WORKER_HEARTBEAT_TTL = 10
+
+class Overloaded(Exception):
+    """ Raised when new work of a priority class is refused because the workers can't keep up. """
+    def __init__(self, priority: str, reason: str, message: str, status_code: int, retry_after: int):
+        self.priority = priority
+        self.reason = reason
+        self.status_code = status_code
+        self.retry_after = retry_after
+        super().__init__(message)
+
+def record_worker_heartbeat(hostname: str, concurrency: int, active: int) -> None:
+    """
+    Stores a worker's pool size and busy processes, called with every Celery heartbeat.
+    Heartbeats of workers gone for longer than WORKER_HEARTBEAT_TTL are removed.
+
+    :param hostname: Host name of the worker, e.g. bulk@host
+    :param concurrency: Processes of the worker's pool
+    :param active: Tasks the worker is running
+    """
+    now = time.time()
+    pipeline = redis_client.pipeline(transaction=False)
+    pipeline.hset(WORKERS_KEY, hostname, json.dumps({"concurrency": concurrency, "active": active, "expires": now + WORKER_HEARTBEAT_TTL}))
+    pipeline.expire(WORKERS_KEY, WORKER_HEARTBEAT_TTL)
+    pipeline.hgetall(WORKERS_KEY)
+    workers = pipeline.execute()[-1]
+    gone = [name for name, heartbeat in workers.items() if json.loads(heartbeat)["expires"] <= now]
+    if gone:
+        redis_client.hdel(WORKERS_KEY, *gone)
+
+def read_load() -> dict:
+    """
+    Get the tasks waiting in each priority class' queue and the busy share of the workers' processes, with one round trip.
+
+    :return: Dict of queue depths by priority class, number of live workers, their processes, the busy ones
+             and the saturation, the busy share of the processes, None without live workers
+    """
+    pipeline = redis_client.pipeline(transaction=False)
+    for queue in PRIORITY_QUEUES.values():
+        pipeline.llen(queue)
+    pipeline.hgetall(WORKERS_KEY)
+    *depths, heartbeats = pipeline.execute()
+
+    now = time.time()
+    workers = [heartbeat for heartbeat in map(json.loads, heartbeats.values()) if heartbeat["expires"] > now]
+    capacity = sum(worker["concurrency"] for worker in workers)
+    active = sum(worker["active"] for worker in workers)
+    return {
+        "queues": dict(zip(PRIORITY_QUEUES, depths)),
+        "workers": len(workers),
+        "capacity": capacity,
+        "active": active,
+        "saturation": round(min(active / capacity, 1.0), 3) if capacity else None,
+    }
+
+# Tuple of the time the load was read and the load, shared by the requests of the process
+_snapshot: tuple[float, dict | None] = (0.0, None)
+
+def get_load() -> dict:
+    """
+    Get the load, read again once it is older than ADMISSION_REFRESH_INTERVAL, so requests don't each query Redis.
+
+    :return: Dict of the load, see read_load
+    """
+    global _snapshot
+    read_at, load = _snapshot
+    if load is None or time.monotonic() - read_at >= Config.ADMISSION_REFRESH_INTERVAL:
+        load = read_load()
+        _snapshot = (time.monotonic(), load)
+    return load
+
+def check_admission(load: dict, priority: str, incoming: int=1) -> Overloaded | None:
+    """
+    Checks whether new work of a priority class is admitted under the load.
+
+    :param load: Load, see read_load
+    :param priority: Priority class of the work
+    :param incoming: Tasks the work adds to the queue, e.g. the indicators of a bulk job
+
+    :return: Overloaded error if the work is refused, None if it is admitted
+    """
+    depth = load["queues"].get(priority, 0)
+    queue_limit = Config.ADMISSION_QUEUE_LIMITS.get(priority)
+    if queue_limit is not None and depth + incoming > queue_limit:
+        return Overloaded(priority, "queue_depth", f"{depth} {priority} tasks are waiting, at most {queue_limit} are accepted",
+                          429, retry_after())
+    # Busy workers alone are fine, new work is refused once it would wait behind others too
+    saturation_limit = Config.ADMISSION_SATURATION_LIMITS.get(priority)
+    if saturation_limit is not None and load["saturation"] is not None and load["saturation"] >= saturation_limit and depth > 0:
+        return Overloaded(priority, "saturation", f"Workers are saturated ({load['saturation']:.0%} busy), {priority} work is not accepted",
+                          503, retry_after())
+    return None
+
+def admit(priority: str, incoming: int=1) -> None:
+    """
+    Admits new work of a priority class, or refuses it while the queue is too long or the workers are saturated.
+    Work is admitted when the load can't be read, the work would fail on the broker anyway.
+
+    :param priority: Priority class of the work
+    :param incoming: Tasks the work adds to the queue
+
+    :raises Overloaded: If the work is refused
+    """
+    if not Config.ADMISSION_CONTROL:
+        return
+    try:
+        load = get_load()
+    except RedisError as e:
+        logger.warning(f"Could not read the load, admitting {priority} work: {e}")
+        return
+    error = check_admission(load, priority, incoming)
+    if error:
+        ADMISSION_REJECTIONS.labels(priority, error.reason).inc()
+        raise error
+
+def retry_after() -> int:
+    """ Get the seconds refused clients should wait, ADMISSION_RETRY_AFTER jittered so they don't all come back at once. """
+    return jittered_expiration(Config.ADMISSION_RETRY_AFTER, Config.ADMISSION_RETRY_JITTER)
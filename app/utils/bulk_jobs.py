@@ -0,0 +1,285 @@
+from datetime import datetime, timezone
+import json
+import uuid
+
+from app.config import Config
+from app.utils.cache import make_key, redis_client
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Number of list entries read or written to Redis at a time
+CHUNK_SIZE = 1000
+
+# Pops up to ARGV[1] entries of a list, none unless at least ARGV[2] are waiting
+_POP_BATCH_SCRIPT = """
+local count = tonumber(ARGV[1])
+if redis.call('LLEN', KEYS[1]) < tonumber(ARGV[2]) then
+    return {}
+end
+local entries = redis.call('LRANGE', KEYS[1], 0, count - 1)
+redis.call('LTRIM', KEYS[1], count, -1)
+return entries
+"""
+
+def job_key(job_id: str) -> str:
+    """ Redis key of the bulk job's metadata hash. """
+    return make_key("bulk_job", job_id)
+
+def _job_meta(total: int, priority: str, sources: list[str]=None, exclude_sources: list[str]=None, callback_url: str=None) -> dict:
+    return {
+        "total": total,
+        "priority": priority,
+        "sources": json.dumps(sources),
+        "exclude_sources": json.dumps(exclude_sources),
+        "callback_url": callback_url or "",
+        "created_at": str(datetime.now(timezone.utc)),
+        "dispatched": 0,
+        "completed": 0,
+        "failed": 0,
+    }
+
+def create_bulk_job(indicators: list[str], priority: str, sources: list[str]=None, exclude_sources: list[str]=None, callback_url: str=None) -> str:
+    """
+    Stores a bulk job and its indicators in Redis. Tasks are dispatched separately by dispatch_bulk_job.
+
+    :param indicators: Validated indicators to enrich
+    :param priority: Priority class of the job's tasks
+    :param sources: Registry keys of sources to limit the search to
+    :param exclude_sources: Registry keys of sources to leave out of the search
+    :param callback_url: URL the results are POSTed to in batches
+
+    :return: ID of the created job
+    """
+    job_id = str(uuid.uuid4())
+    key = job_key(job_id)
+    pipeline = redis_client.pipeline()
+    pipeline.hset(key, mapping=_job_meta(len(indicators), priority, sources, exclude_sources, callback_url))
+    for i in range(0, len(indicators), CHUNK_SIZE):
+        pipeline.rpush(f"{key}:indicators", *indicators[i:i + CHUNK_SIZE])
+    pipeline.expire(key, Config.BULK_JOB_EXPIRATION)
+    pipeline.expire(f"{key}:indicators", Config.BULK_JOB_EXPIRATION)
+    pipeline.execute()
+    logger.info(f"Created bulk job {job_id} with {len(indicators)} indicators")
+    return job_id
+
+def create_ingest_job(file_name: str, file_size: int, priority: str, sources: list[str]=None, exclude_sources: list[str]=None, callback_url: str=None) -> str:
+    """
+    Stores a bulk job for the indicators of an uploaded file. The job starts empty, indicators are added
+    with append_job_indicators while the file is scanned by ingest_task.
+
+    :param file_name: Name of the uploaded file
+    :param file_size: Size of the file in bytes
+    :param priority: Priority class of the job's tasks
+    :param sources: Registry keys of sources to limit the search to
+    :param exclude_sources: Registry keys of sources to leave out of the search
+    :param callback_url: URL the results are POSTed to in batches
+
+    :return: ID of the created job
+    """
+    job_id = str(uuid.uuid4())
+    key = job_key(job_id)
+    meta = _job_meta(0, priority, sources, exclude_sources, callback_url)
+    meta.update({"ingesting": 1, "file_name": file_name, "file_size": file_size, "scanned_bytes": 0, "truncated": 0, "error": ""})
+    pipeline = redis_client.pipeline()
+    pipeline.hset(key, mapping=meta)
+    pipeline.expire(key, Config.BULK_JOB_EXPIRATION)
+    pipeline.execute()
+    logger.info(f"Created ingest job {job_id} for {file_name}, {file_size} bytes")
+    return job_id
+
+def append_job_indicators(job_id: str, indicators: list[str], scanned_bytes: int) -> None:
+    """
+    Adds indicators extracted from the ingested file to the bulk job.
+
+    :param job_id: ID of the job
+    :param indicators: Unique indicators extracted since the last call
+    :param scanned_bytes: Bytes of the file scanned so far
+    """
+    key = job_key(job_id)
+    pipeline = redis_client.pipeline()
+    pipeline.rpush(f"{key}:indicators", *indicators)
+    pipeline.expire(f"{key}:indicators", Config.BULK_JOB_EXPIRATION)
+    pipeline.hincrby(key, "total", len(indicators))
+    pipeline.hset(key, "scanned_bytes", scanned_bytes)
+    pipeline.execute()
+
+def finish_ingest(job_id: str, scanned_bytes: int, truncated: bool=False, error: str=None) -> None:
+    """
+    Marks the scan of the bulk job's file as finished, the job completes once the dispatched tasks finished.
+
+    :param job_id: ID of the job
+    :param scanned_bytes: Bytes of the file scanned
+    :param truncated: Whether the scan stopped at INGEST_MAX_INDICATORS
+    :param error: Error the scan failed with
+    """
+    redis_client.hset(job_key(job_id), mapping={"ingesting": 0, "scanned_bytes": scanned_bytes, "truncated": int(truncated), "error": error or ""})
+
+def get_bulk_job(job_id: str) -> dict | None:
+    """
+    Get the bulk job's metadata and progress.
+
+    :param job_id: ID of the job
+
+    :return: Dict of the job, None if the job does not exist or has expired
+    """
+    meta = redis_client.hgetall(job_key(job_id))
+    if not meta:
+        return None
+    total = int(meta["total"])
+    dispatched = int(meta["dispatched"])
+    finished = int(meta["completed"]) + int(meta["failed"])
+    ingesting = meta.get("ingesting") == "1"
+    if ingesting:
+        state = "INGESTING"
+    elif finished >= total:
+        state = "COMPLETED"
+    elif dispatched < total:
+        state = "DISPATCHING"
+    else:
+        state = "RUNNING"
+    job = {
+        "job_id": job_id,
+        "state": state,
+        "priority": meta["priority"],
+        "sources": json.loads(meta["sources"]),
+        "exclude_sources": json.loads(meta["exclude_sources"]),
+        "callback_url": meta.get("callback_url") or None,
+        "created_at": meta["created_at"],
+        "total": total,
+        "dispatched": dispatched,
+        "completed": int(meta["completed"]),
+        "failed": int(meta["failed"]),
+        "pending": total - finished,
+    }
+    if "file_name" in meta:
+        job["ingest"] = {
+            "file_name": meta["file_name"],
+            "file_size": int(meta["file_size"]),
+            "scanned_bytes": int(meta["scanned_bytes"]),
+            "truncated": meta["truncated"] == "1",
+            "error": meta["error"] or None,
+        }
+    return job
+
+def iter_job_indicators(job_id: str, chunk_size: int=CHUNK_SIZE):
+    """
+    Iterates the bulk job's indicators in chunks, without loading them all to memory.
+
+    :param job_id: ID of the job
+    :param chunk_size: Number of indicators read from Redis at a time
+
+    :return: Generator of lists of indicators
+    """
+    key = f"{job_key(job_id)}:indicators"
+    start = 0
+    while True:
+        chunk = redis_client.lrange(key, start, start + chunk_size - 1)
+        if not chunk:
+            return
+        yield chunk
+        start += len(chunk)
+
+def add_job_tasks(job_id: str, task_ids: list[str]) -> None:
+    """
+    Records dispatched tasks of the bulk job.
+
+    :param job_id: ID of the job
+    :param task_ids: IDs of the dispatched tasks
+    """
+    key = job_key(job_id)
+    pipeline = redis_client.pipeline()
+    pipeline.rpush(f"{key}:tasks", *task_ids)
+    pipeline.expire(f"{key}:tasks", Config.BULK_JOB_EXPIRATION)
+    pipeline.hincrby(key, "dispatched", len(task_ids))
+    pipeline.execute()
+
+def get_job_task_ids(job_id: str, offset: int=0, limit: int=100) -> list[str]:
+    """
+    Get a page of the bulk job's task IDs, in the order the indicators were submitted.
+
+    :param job_id: ID of the job
+    :param offset: Index of the first task
+    :param limit: Maximum number of tasks
+
+    :return: List of task IDs
+    """
+    return redis_client.lrange(f"{job_key(job_id)}:tasks", offset, offset + limit - 1)
+
+def iter_job_tasks(job_id: str, chunk_size: int=CHUNK_SIZE):
+    """
+    Iterates the bulk job's dispatched tasks and their indicators in chunks, without loading them all to memory.
+
+    :param job_id: ID of the job
+    :param chunk_size: Number of tasks read from Redis at a time
+
+    :return: Generator of lists of tuples of task ID and indicator
+    """
+    key = job_key(job_id)
+    start = 0
+    while True:
+        # Tasks are recorded in the order of the job's indicators
+        pipeline = redis_client.pipeline(transaction=False)
+        pipeline.lrange(f"{key}:tasks", start, start + chunk_size - 1)
+        pipeline.lrange(f"{key}:indicators", start, start + chunk_size - 1)
+        task_ids, indicators = pipeline.execute()
+        if not task_ids:
+            return
+        yield list(zip(task_ids, indicators))
+        start += len(task_ids)
+
+def record_task_finished(job_id: str, failed: bool=False) -> bool:
+    """
+    Counts a finished task of the bulk job.
+
+    :param job_id: ID of the job
+    :param failed: Whether the task failed
+
+    :return: Whether the job completed with this task
+    """
+    key = job_key(job_id)
+    pipeline = redis_client.pipeline()
+    pipeline.hincrby(key, "failed" if failed else "completed", 1)
+    pipeline.hmget(key, "total", "completed", "failed", "ingesting")
+    _, (total, completed, failed_count, ingesting) = pipeline.execute()
+    if total is None or ingesting == "1" or int(completed) + int(failed_count) < int(total):
+        return False
+    return claim_job_completion(job_id)
+
+def claim_job_completion(job_id: str) -> bool:
+    """
+    Claims the completion of the bulk job, so only one task sends its completion callback.
+
+    :param job_id: ID of the job
+
+    :return: Whether the caller claimed it
+    """
+    return bool(redis_client.hsetnx(job_key(job_id), "completion_claimed", 1))
+
+def queue_job_result(job_id: str, entry: str) -> int:
+    """
+    Adds the result of a task to the bulk job's results waiting for their callback.
+
+    :param job_id: ID of the job
+    :param entry: JSON of the task's result
+
+    :return: Number of results waiting
+    """
+    key = f"{job_key(job_id)}:callback"
+    pipeline = redis_client.pipeline()
+    pipeline.rpush(key, entry)
+    pipeline.expire(key, Config.BULK_JOB_EXPIRATION)
+    return pipeline.execute()[0]
+
+def pop_job_results(job_id: str, count: int, minimum: int=1) -> list[str]:
+    """
+    Removes results waiting for their callback, oldest first. Checking and popping is atomic, so tasks popping
+    concurrently never take part of a batch they have to put back.
+
+    :param job_id: ID of the job
+    :param count: Maximum number of results
+    :param minimum: Number of results that must be waiting, none are removed otherwise
+
+    :return: List of JSON results, empty if fewer than minimum are waiting
+    """
+    return redis_client.register_script(_POP_BATCH_SCRIPT)(keys=[f"{job_key(job_id)}:callback"], args=[count, minimum])
@@ -1,13 +1,29 @@
+import asyncio
 import hashlib
 import json
+import math
+import random
+import time
+import weakref
 
 from app.config import Config
 from app.utils.logger import setup_logger
+from app.utils.metrics import record_cache_operation
 
 import redis
+import redis.asyncio
 
 logger = setup_logger(__name__)
 
+# Prefix of every key the app stores, keeping them apart from the Celery broker and result backend sharing the database
+KEY_PREFIX = "tl"
+# Version of the cached search result format, bump when it changes to stop serving entries of the old format
+RESULT_SCHEMA_VERSION = 1
+# Keys deleted per UNLINK call when invalidating
+UNLINK_BATCH_SIZE = 500
+# Namespaces left alone when all of the app's keys are removed, quota counters track requests the providers already counted
+PRESERVED_NAMESPACES = ("quota",)
+
 # Create a Redis connection
 redis_client = redis.StrictRedis(
     host=Config.REDIS_HOST,
@@ -16,29 +32,266 @@ redis_client = redis.StrictRedis(
     decode_responses=True
 )
 
-def generate_cache_key(indicator: str) -> str:
-    """ Generate a unique key based on query parameter. """
-    logger.info(f"Creating cache key for {indicator}")
-    return hashlib.md5(indicator.encode()).hexdigest()
+# Async clients of the event loops, connections can't be shared between loops
+_async_clients = weakref.WeakKeyDictionary()
+
+def get_async_redis() -> redis.asyncio.StrictRedis:
+    """
+    Get the async Redis client of the running event loop, so coroutines don't block the loop waiting for Redis.
+    Coroutines of the loop share the client's connection pool, waiting for a connection when all REDIS_MAX_CONNECTIONS are in use.
+
+    :return: Async Redis client
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        pool = redis.asyncio.BlockingConnectionPool(
+            host=Config.REDIS_HOST,
+            port=Config.REDIS_PORT,
+            db=Config.REDIS_DB,
+            decode_responses=True,
+            max_connections=Config.REDIS_MAX_CONNECTIONS
+        )
+        client = _async_clients[loop] = redis.asyncio.StrictRedis.from_pool(pool)
+    return client
+
+def make_key(namespace: str, *parts) -> str:
+    """
+    Build a namespaced key, e.g. tl:api_key:VirusTotal.
+
+    :param namespace: Namespace of the key, e.g. search, api_key or bulk_job
+    :param parts: Parts identifying the entry within the namespace
+
+    :return: Key
+    """
+    return ":".join((KEY_PREFIX, namespace, *map(str, parts)))
+
+def generate_cache_key(indicator: str, indicator_type: str, source_versions: dict[str, int]) -> str:
+    """
+    Generate the key of a search's cached results.
+    The key names the indicator type and every searched source with its schema version,
+    e.g. tl:search:v1:IPV4:AbuseIpDbSource@1,VirusTotalSource@1:<digest>,
+    so entries can be invalidated by source or type, and a changed source only invalidates searches including it.
+
+    :param indicator: Searched indicator
+    :param indicator_type: Name of the indicator's type
+    :param source_versions: Dict of searched sources' registry keys and schema versions
+
+    :return: Cache key
+    """
+    logger.debug("Creating cache key for %s", indicator)
+    sources = ",".join(f"{key}@{version}" for key, version in sorted(source_versions.items()))
+    return make_key("search", f"v{RESULT_SCHEMA_VERSION}", indicator_type, sources, hashlib.md5(indicator.encode()).hexdigest())
 
 def fetch_from_cache(key: str) -> str:
     """ Fetch results from Redis. """
-    logger.info(f"Fetching results from Redis for key: {key}")
-    return redis_client.get(key)
+    logger.debug("Fetching results from Redis for key: %s", key)
+    value = redis_client.get(key)
+    record_cache_operation("hit" if value is not None else "miss")
+    return value
+
+async def fetch_many_from_cache(keys: list[str]) -> list[str | None]:
+    """
+    Fetch several entries from Redis with one MGET.
+
+    :param keys: Keys of the entries
+
+    :return: List of the entries' values, None for missing entries
+    """
+    if not keys:
+        return []
+    values = await get_async_redis().mget(keys)
+    hits = sum(value is not None for value in values)
+    record_cache_operation("hit", count=hits)
+    record_cache_operation("miss", count=len(values) - hits)
+    return values
 
 def cache_results(key: str, data: str | dict, expiration: int=Config.CACHE_EXPIRATION) -> None:
     """ Cache results in Redis with expiration. """
-    logger.info(f"Caching data to redis with key: {key}")
+    logger.debug("Caching data to redis with key: %s", key)
     if isinstance(data, dict):
         data = json.dumps(data)
     redis_client.setex(key, expiration, data)
+    record_cache_operation("set")
+
+def jittered_expiration(expiration: int, jitter: float=Config.CACHE_TTL_JITTER, rng: random.Random=random) -> int:
+    """
+    Randomizes the expiration by up to the jitter share in either direction,
+    so entries cached at the same time, e.g. by a bulk job, don't expire at the same time.
+
+    :param expiration: Expiration in seconds
+    :param jitter: Maximum share of the expiration added or removed, e.g. 0.1 for 10 %
+    :param rng: Random number generator
+
+    :return: Randomized expiration in seconds
+    """
+    return max(round(expiration * (1 + rng.uniform(-jitter, jitter))), 1)
+
+def should_refresh_early(now: float, fresh_until: float, compute_time: float, beta: float=Config.CACHE_XFETCH_BETA, rng: random.Random=random) -> bool:
+    """
+    Probabilistic early expiration (XFetch). The closer the entry is to turning stale and the longer computing it took,
+    the likelier a lookup refreshes it early, so refreshes of popular entries are spread out instead of bunching up at expiry.
+
+    :param now: Current time
+    :param fresh_until: Time the entry turns stale
+    :param compute_time: Seconds computing the entry took
+    :param beta: Eagerness of early refreshes, 0 disables them
+    :param rng: Random number generator
+
+    :return: Boolean if the entry should be refreshed now
+    """
+    if beta <= 0 or compute_time <= 0:
+        return False
+    return now - compute_time * beta * math.log(1 - rng.random()) >= fresh_until
+
+async def fetch_cached_result(key: str) -> tuple[dict, float, bool, bool] | None:
+    """
+    Fetch search results cached with cache_result.
+
+    :param key: Cache key of the search
+
+    :return: Tuple of the results, their age in seconds, whether they are stale and whether they should be refreshed, None if not cached
+    """
+    logger.debug("Fetching results from Redis for key: %s", key)
+    return _parse_cached_result(await get_async_redis().get(key))
+
+def read_cached_result(key: str) -> tuple[dict, float, bool, bool] | None:
+    """
+    Fetch search results cached with cache_result, without an event loop. See fetch_cached_result.
+
+    :param key: Cache key of the search
+
+    :return: Tuple of the results, their age in seconds, whether they are stale and whether they should be refreshed, None if not cached
+    """
+    logger.debug("Fetching results from Redis for key: %s", key)
+    return _parse_cached_result(redis_client.get(key))
+
+def _parse_cached_result(value: str | None) -> tuple[dict, float, bool, bool] | None:
+    entry = json.loads(value) if value is not None else None
+    if not isinstance(entry, dict) or "result" not in entry:
+        record_cache_operation("miss")
+        return None
+
+    now = time.time()
+    stale = now >= entry["fresh_until"]
+    refresh = stale or should_refresh_early(now, entry["fresh_until"], entry.get("compute_time", 0))
+    record_cache_operation("stale_hit" if stale else "hit")
+    if refresh and not stale:
+        record_cache_operation("early_refresh")
+    return entry["result"], max(now - entry["cached_at"], 0), stale, refresh
+
+async def cache_result(key: str, result: dict, compute_time: float=0, release_claim: bool=False,
+                       expiration: int=Config.CACHE_EXPIRATION, stale_expiration: int=Config.CACHE_STALE_EXPIRATION) -> None:
+    """
+    Cache search results with a soft and a hard expiration.
+    After the soft expiration the results are stale, they are still served until the hard expiration while being refreshed.
+    The soft expiration is jittered by CACHE_TTL_JITTER.
+
+    :param key: Cache key of the search
+    :param result: Search results
+    :param compute_time: Seconds computing the results took, drives early refreshes
+    :param release_claim: Release the refresh claimed with claim_refresh in the same round trip
+    :param expiration: Seconds the results are fresh
+    :param stale_expiration: Seconds the results are served stale after they expired
+    """
+    logger.debug("Caching data to redis with key: %s", key)
+    now = time.time()
+    expiration = jittered_expiration(expiration)
+    entry = {"cached_at": now, "fresh_until": now + expiration, "compute_time": round(compute_time, 3), "result": result}
+    pipeline = get_async_redis().pipeline(transaction=False)
+    pipeline.setex(key, expiration + stale_expiration, json.dumps(entry))
+    if release_claim:
+        pipeline.delete(make_key("refresh_lock", key))
+    await pipeline.execute()
+    record_cache_operation("set")
+
+def get_fresh_ttls(keys: list[str]) -> list[float | None]:
+    """
+    Get how long search results cached with cache_result stay fresh, without fetching them.
+
+    :param keys: Cache keys of the searches
+
+    :return: List of seconds until each entry turns stale (negative if already stale), None if not cached
+    """
+    pipeline = redis_client.pipeline(transaction=False)
+    for key in keys:
+        pipeline.ttl(key)
+    return [ttl - Config.CACHE_STALE_EXPIRATION if ttl >= 0 else None for ttl in pipeline.execute()]
+
+def claim_refresh(key: str) -> bool:
+    """
+    Claims refreshing a stale cache entry, so only one worker triggers a refresh.
+
+    :param key: Cache key of the search
+
+    :return: True if the refresh was claimed, False if it is already in progress
+    """
+    return bool(redis_client.set(make_key("refresh_lock", key), 1, nx=True, ex=Config.CACHE_REFRESH_LOCK_EXPIRATION))
+
+async def claim_refresh_async(key: str) -> bool:
+    """ Async claim_refresh. """
+    return bool(await get_async_redis().set(make_key("refresh_lock", key), 1, nx=True, ex=Config.CACHE_REFRESH_LOCK_EXPIRATION))
+
+def release_refresh(key: str) -> None:
+    """ Releases a refresh claimed with claim_refresh. """
+    redis_client.delete(make_key("refresh_lock", key))
 
 def delete_from_cache(key: str) -> None:
     """ Remove an entry from Redis """
-    logger.info(f"Removing entry from Redis with key: {key}")
+    logger.debug("Removing entry from Redis with key: %s", key)
     redis_client.delete(key)
+    record_cache_operation("delete")
+
+def delete_matching(pattern: str, keep_prefixes: tuple[str, ...]=()) -> int:
+    """
+    Remove entries matching the glob-style pattern.
+    Keys are iterated with SCAN and removed with UNLINK in batches, so Redis isn't blocked on large databases.
+
+    :param pattern: Glob-style pattern of the keys
+    :param keep_prefixes: Prefixes of matching keys that are not removed
+
+    :return: Number of removed entries
+    """
+    logger.warning(f"Removing entries from Redis matching: {pattern}")
+    deleted = 0
+    batch = []
+    for key in redis_client.scan_iter(match=pattern, count=1000):
+        if keep_prefixes and key.startswith(keep_prefixes):
+            continue
+        batch.append(key)
+        if len(batch) >= UNLINK_BATCH_SIZE:
+            deleted += redis_client.unlink(*batch)
+            batch = []
+    if batch:
+        deleted += redis_client.unlink(*batch)
+    record_cache_operation("delete", count=deleted)
+    return deleted
+
+def invalidate_results(source_key: str=None, indicator_type: str=None) -> int:
+    """
+    Remove cached search results, all of them or only those of a source or an indicator type.
+
+    :param source_key: Registry key of the source, results of searches including it are removed
+    :param indicator_type: Name of the indicator type
+
+    :return: Number of removed entries
+    """
+    pattern = make_key("search", "*", indicator_type or "*")
+    if source_key:
+        # Sources are listed comma separated after the type, so the source follows either a colon or a comma
+        pattern += f"*[:,]{source_key}@*"
+    else:
+        pattern += ":*"
+    return delete_matching(pattern)
+
+def invalidate_namespace(namespace: str="*") -> int:
+    """
+    Remove entries of a namespace. Celery's queued tasks and results are never removed,
+    neither are the PRESERVED_NAMESPACES unless named explicitly.
+
+    :param namespace: Namespace of the keys, all of the app's keys if *
 
-def flush_cache() -> None:
-    """ Remove all entries from the current Redis database. """
-    logger.warning(f"FLUSHING current Redis database")
-    redis_client.flushdb()
\ No newline at end of file
+    :return: Number of removed entries
+    """
+    keep_prefixes = tuple(make_key(preserved, "") for preserved in PRESERVED_NAMESPACES) if namespace == "*" else ()
+    return delete_matching(make_key(namespace, "*"), keep_prefixes)
@@ -0,0 +1,218 @@
+import asyncio
+from collections import OrderedDict, deque
+import contextlib
+import contextvars
+import time
+import uuid
+import weakref
+
+from app.config import Config
+from app.utils.cache import get_async_redis, make_key, redis_client
+from app.utils.metrics import SOURCE_REQUESTS_IN_FLIGHT, SOURCE_REQUESTS_QUEUED
+
+# Priority classes in the order waiting requests are served, lookups of analysts go before bulk jobs and refreshes
+PRIORITY_ORDER = ("interactive", "bulk", "refresh")
+# Leases of the requests in flight across the cluster, a sorted set of lease IDs scored by their expiry
+CLUSTER_KEY = make_key("concurrency", "cluster")
+# Seconds between attempts to get a cluster-wide slot while the cap is reached
+CLUSTER_POLL_INTERVAL = 0.05
+
+# Takes a cluster-wide slot if fewer than the cap are in flight, leases of crashed processes expire
+_CLUSTER_ACQUIRE_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call('ZADD', KEYS[1], ARGV[3], ARGV[4])
+    redis.call('EXPIRE', KEYS[1], ARGV[5])
+    return 1
+end
+return 0
+"""
+
+# Flow of the requests sent by the running coroutine, a tuple of priority class and indicator
+_flow = contextvars.ContextVar("request_flow", default=("interactive", ""))
+
+def set_request_flow(indicator: str, priority: str) -> None:
+    """
+    Marks the requests the running task and the tasks it starts send as belonging to a search, so searches get slots in turn.
+
+    :param indicator: Searched indicator
+    :param priority: Priority class of the search
+    """
+    _flow.set((priority, indicator))
+
+def get_request_flow() -> tuple[str, str]:
+    """
+    Get the flow of the requests the running task sends, see set_request_flow.
+
+    :return: Tuple of priority class and indicator, interactive and an empty indicator outside of searches
+    """
+    return _flow.get()
+
+class FairLimiter:
+    """
+    Caps the requests in flight. When the cap is reached, waiting requests are served by priority class and
+    in turn between flows within a class, so a search with many requests doesn't hold up the others.
+
+    :param limit: Most requests in flight
+    :param scope: Name of the limiter in metrics, process or a host
+    """
+    def __init__(self, limit: int, scope: str):
+        self.limit = limit
+        self.scope = scope
+        self.in_flight = 0
+        self.queued = 0
+        # Waiting requests of each class by flow, flows are moved to the end once served
+        self.waiters = {priority: OrderedDict() for priority in PRIORITY_ORDER}
+
+    async def acquire(self, flow: tuple[str, str]) -> None:
+        """
+        Waits for a slot.
+
+        :param flow: Tuple of priority class and indicator of the request
+        """
+        if self.in_flight < self.limit and not self.queued:
+            self._take()
+            return
+        priority = flow[0] if flow[0] in self.waiters else PRIORITY_ORDER[-1]
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[priority].setdefault(flow, deque()).append(future)
+        self.queued += 1
+        SOURCE_REQUESTS_QUEUED.labels(self.scope).inc()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over as the request was cancelled
+                self.release()
+            else:
+                self._remove(priority, flow, future)
+            raise
+
+    def release(self) -> None:
+        """ Frees a slot and hands it to the next waiting request. """
+        self.in_flight -= 1
+        SOURCE_REQUESTS_IN_FLIGHT.labels(self.scope).dec()
+        while self.queued and self.in_flight < self.limit:
+            future = self._next_waiter()
+            # Cancelled requests are removed from the queue once they run again, they may still be in it
+            if future.cancelled():
+                continue
+            self._take()
+            future.set_result(None)
+
+    def _take(self) -> None:
+        self.in_flight += 1
+        SOURCE_REQUESTS_IN_FLIGHT.labels(self.scope).inc()
+
+    def _next_waiter(self) -> asyncio.Future:
+        for flows in self.waiters.values():
+            if flows:
+                flow, futures = next(iter(flows.items()))
+                future = futures.popleft()
+                del flows[flow]
+                if futures:
+                    flows[flow] = futures
+                self.queued -= 1
+                SOURCE_REQUESTS_QUEUED.labels(self.scope).dec()
+                return future
+        raise RuntimeError("No waiting requests")
+
+    def _remove(self, priority: str, flow: tuple[str, str], future: asyncio.Future) -> None:
+        futures = self.waiters[priority].get(flow)
+        if futures and future in futures:
+            futures.remove(future)
+            if not futures:
+                del self.waiters[priority][flow]
+            self.queued -= 1
+            SOURCE_REQUESTS_QUEUED.labels(self.scope).dec()
+
+class ConcurrencyGovernor:
+    """
+    Caps requests to sources in flight in the process, to each host and optionally across the cluster.
+    Limiters are bound to the event loop they are used on, see get_governor.
+    """
+    def __init__(self):
+        self.process = FairLimiter(Config.MAX_CONCURRENT_REQUESTS, "process")
+        self.hosts: dict[str, FairLimiter] = {}
+
+    def host_limiter(self, host: str) -> FairLimiter:
+        """
+        Get the limiter of a host.
+
+        :param host: Host name
+
+        :return: FairLimiter of the host, created on first use
+        """
+        limiter = self.hosts.get(host)
+        if limiter is None:
+            limit = Config.HOST_CONCURRENCY_LIMITS.get(host, Config.MAX_CONCURRENT_REQUESTS_PER_HOST)
+            limiter = self.hosts[host] = FairLimiter(limit, host)
+        return limiter
+
+    @contextlib.asynccontextmanager
+    async def slot(self, host: str, timeout: float=None):
+        """
+        Holds a slot of the host, the process and the cluster for a request. The host's slot is taken first,
+        so requests waiting for a busy host don't hold process slots requests to other hosts could use.
+
+        :param host: Host the request is sent to
+        :param timeout: Most seconds to wait for the slots
+
+        :raises TimeoutError: If the slots weren't free within the timeout
+        """
+        flow = _flow.get()
+        async with contextlib.AsyncExitStack() as stack:
+            async with asyncio.timeout(timeout):
+                for limiter in (self.host_limiter(host), self.process):
+                    await limiter.acquire(flow)
+                    stack.callback(limiter.release)
+                if Config.CLUSTER_MAX_CONCURRENT_REQUESTS > 0:
+                    stack.push_async_callback(release_cluster_slot, await acquire_cluster_slot())
+            yield
+
+# Governors of the event loops, asyncio futures can't be shared between loops
+_governors = weakref.WeakKeyDictionary()
+
+def get_governor() -> ConcurrencyGovernor:
+    """
+    Get the concurrency governor of the running event loop, shared by every search the loop runs.
+
+    :return: ConcurrencyGovernor
+    """
+    loop = asyncio.get_running_loop()
+    governor = _governors.get(loop)
+    if governor is None:
+        governor = _governors[loop] = ConcurrencyGovernor()
+    return governor
+
+async def acquire_cluster_slot() -> str:
+    """
+    Waits for one of the CLUSTER_MAX_CONCURRENT_REQUESTS slots shared by every worker.
+
+    :return: ID of the lease, release it with release_cluster_slot
+    """
+    lease = uuid.uuid4().hex
+    # Leases outlive the longest request, so slots of crashed processes are freed
+    ttl = Config.SOURCE_REQUEST_DEADLINE + 30
+    client = get_async_redis()
+    while True:
+        now = time.time()
+        if await client.eval(_CLUSTER_ACQUIRE_SCRIPT, 1, CLUSTER_KEY, now, Config.CLUSTER_MAX_CONCURRENT_REQUESTS, now + ttl, lease, int(ttl)):
+            return lease
+        await asyncio.sleep(CLUSTER_POLL_INTERVAL)
+
+async def release_cluster_slot(lease: str) -> None:
+    """
+    Frees a cluster-wide slot.
+
+    :param lease: ID of the lease
+    """
+    await get_async_redis().zrem(CLUSTER_KEY, lease)
+
+def count_cluster_requests() -> int:
+    """
+    Get the number of requests in flight across the cluster, counted only with CLUSTER_MAX_CONCURRENT_REQUESTS.
+
+    :return: Number of requests
+    """
+    return redis_client.zcount(CLUSTER_KEY, time.time(), "+inf")
@@ -0,0 +1,191 @@
+import csv
+from datetime import datetime, timedelta, timezone
+import io
+import json
+
+from app.config import Config
+from app.utils.bulk_jobs import iter_job_tasks
+from app.utils.indicator_type import get_indicator_type
+
+# Export formats and their content type and file extension
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+# Formats written with pyarrow, only offered if it is installed
+COLUMNAR_FORMATS = ("parquet", "arrow")
+# Columns of the exported rows, one row per indicator and source
+COLUMNS = ("task_id", "indicator", "indicator_type", "state", "source", "verdict", "summary", "url", "error", "cached", "fetched_at", "finished_at")
+
+def available_formats() -> list[str]:
+    """
+    Get the export formats available, the columnar formats require pyarrow.
+
+    :return: List of format names
+    """
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return [name for name in EXPORT_FORMATS if name not in COLUMNAR_FORMATS]
+    return list(EXPORT_FORMATS)
+
+def _parse_time(value: str | None) -> datetime | None:
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+
+def task_rows(task_id: str, indicator: str, meta: dict | None) -> list[dict]:
+    """
+    Flattens a search task's result to one row per source.
+
+    :param task_id: ID of the task
+    :param indicator: Searched indicator
+    :param meta: Task's meta from the result backend, None while the task hasn't finished
+
+    :return: List of rows, a single row without source for tasks that didn't succeed
+    """
+    state = meta["status"] if meta else "PENDING"
+    finished_at = _parse_time(meta.get("date_done")) if meta else None
+    row = dict.fromkeys(COLUMNS)
+    row.update({"task_id": task_id, "indicator": indicator, "state": state, "finished_at": finished_at})
+    if state != "SUCCESS":
+        row["indicator_type"] = get_indicator_type(indicator).name
+        if state == "FAILURE":
+            row["error"] = str(meta["result"])
+        elif state == "DEFERRED":
+            row["error"] = meta["result"].get("message")
+            # Deferred tasks haven't finished, date_done is when they were deferred
+            row["finished_at"] = None
+        return [row]
+
+    result = json.loads(meta["result"]) if isinstance(meta["result"], str) else meta["result"]
+    row["indicator_type"] = result.get("type") or get_indicator_type(indicator).name
+    # Results served from the cache were fetched age seconds before the task finished
+    cache = result.get("cache")
+    row["cached"] = cache is not None
+    row["fetched_at"] = finished_at - timedelta(seconds=cache["age"]) if cache and finished_at else finished_at
+    rows = []
+    for source, source_result in result.get("sources", {}).items():
+        source_result = source_result or {}
+        error = source_result.get("data", {}).get("message") if source_result.get("summary") == "error" else None
+        rows.append({**row, "source": source, "verdict": source_result.get("verdict"), "summary": source_result.get("summary"),
+                     "url": source_result.get("url"), "error": error})
+    return rows or [row]
+
+def iter_job_rows(job_id: str, backend, chunk_size: int=Config.EXPORT_CHUNK_SIZE):
+    """
+    Iterates the rows of the bulk job's results, reading chunk_size tasks' results at a time with one MGET,
+    so exports of any size take constant memory.
+
+    :param job_id: ID of the job
+    :param backend: Celery result backend of the search tasks
+    :param chunk_size: Number of tasks read at a time
+
+    :return: Generator of lists of rows
+    """
+    for tasks in iter_job_tasks(job_id, chunk_size):
+        values = backend.mget([backend.get_key_for_task(task_id) for task_id, _ in tasks])
+        rows = []
+        for (task_id, indicator), value in zip(tasks, values):
+            rows.extend(task_rows(task_id, indicator, backend.decode_result(value) if value is not None else None))
+        yield rows
+
+def _format_time(value: datetime | None) -> str | None:
+    return value.isoformat() if value else None
+
+def stream_ndjson(chunks):
+    """ Writes the rows as newline delimited JSON, a chunk at a time. """
+    for rows in chunks:
+        yield "".join(json.dumps({**row, "fetched_at": _format_time(row["fetched_at"]), "finished_at": _format_time(row["finished_at"])}) + "\n"
+                      for row in rows).encode()
+
+def stream_csv(chunks):
+    """ Writes the rows as CSV with a header, a chunk at a time. """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(COLUMNS)
+    for rows in chunks:
+        for row in rows:
+            writer.writerow([_format_time(row[column]) if column in ("fetched_at", "finished_at") else row[column] for column in COLUMNS])
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+class _ChunkSink(io.RawIOBase):
+    """ Write-only file collecting what pyarrow writes, taken out after every batch so it is streamed instead of kept. """
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self.position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+def stream_columnar(chunks, file_format: str):
+    """
+    Writes the rows as Parquet or as an Arrow IPC stream with pyarrow. Each chunk of rows is converted to a record batch
+    right away, and batches are written once they hold EXPORT_BATCH_ROWS rows, as a Parquet row group or Arrow record batches,
+    and streamed.
+
+    :param chunks: Iterable of lists of rows
+    :param file_format: parquet or arrow
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    timestamp = pa.timestamp("us", tz="UTC")
+    schema = pa.schema([(column, timestamp if column in ("fetched_at", "finished_at") else pa.bool_() if column == "cached" else pa.string())
+                        for column in COLUMNS])
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema) if file_format == "parquet" else pa.ipc.new_stream(sink, schema)
+
+    # Columnar batches take a fraction of the memory of the rows they were made of
+    batches, batched_rows = [], 0
+    for rows in chunks:
+        if rows:
+            batches.append(pa.RecordBatch.from_pylist(rows, schema=schema))
+            batched_rows += len(rows)
+        if batched_rows >= Config.EXPORT_BATCH_ROWS:
+            writer.write_table(pa.Table.from_batches(batches, schema=schema))
+            batches, batched_rows = [], 0
+            yield sink.take()
+    if batches:
+        writer.write_table(pa.Table.from_batches(batches, schema=schema))
+    # Parquet's footer is written on close, every format needs at least the schema
+    writer.close()
+    yield sink.take()
+
+def stream_export(job_id: str, backend, file_format: str):
+    """
+    Streams the bulk job's results in the format.
+
+    :param job_id: ID of the job
+    :param backend: Celery result backend of the search tasks
+    :param file_format: One of EXPORT_FORMATS
+
+    :return: Generator of bytes
+    """
+    chunks = iter_job_rows(job_id, backend)
+    if file_format == "ndjson":
+        return stream_ndjson(chunks)
+    if file_format == "csv":
+        return stream_csv(chunks)
+    return stream_columnar(chunks, file_format)
@@ -0,0 +1,184 @@
+import json
+import os
+from urllib.parse import urlencode
+
+from app.config import Config
+from app.utils.indicator_type import get_indicator_type
+from app.utils.logger import setup_logger
+
+import aiohttp
+from multidict import CIMultiDict, CIMultiDictProxy
+from yarl import URL
+
+logger = setup_logger(__name__)
+
+class MissingFixtureError(aiohttp.ClientError):
+    """ Raised when a request is replayed that has no recorded response. """
+    def __init__(self, source: str, key: str):
+        self.source = source
+        self.key = key
+        super().__init__(f"No recorded response of {source} for {key}")
+
+class FixtureBody:
+    """ Serves a recorded body in chunks, like the StreamReader of a response. """
+    def __init__(self, body: bytes):
+        self.body = body
+        self.position = 0
+
+    async def read(self, size: int=-1) -> bytes:
+        end = len(self.body) if size < 0 else self.position + size
+        chunk = self.body[self.position:end]
+        self.position += len(chunk)
+        return chunk
+
+class FixtureResponse:
+    """
+    Recorded response, with the parts of aiohttp.ClientResponse BaseSource reads, so it is parsed like a response
+    of the provider would be.
+
+    :param url: URL of the request
+    :param method: HTTP method of the request
+    :param status: HTTP status code
+    :param content_type: Content-Type header, with the charset if any
+    :param body: Body
+    :param reason: HTTP reason phrase
+    """
+    def __init__(self, url: str, method: str, status: int, content_type: str, body: bytes, reason: str=""):
+        self.url = url
+        self.method = method
+        self.status = status
+        self.reason = reason
+        self.headers = CIMultiDictProxy(CIMultiDict({"Content-Type": content_type, "Content-Length": str(len(body))}))
+        self.charset = content_type.partition("charset=")[2].strip() or None
+        self.content_length = len(body)
+        self.content = FixtureBody(body)
+
+    def raise_for_status(self) -> None:
+        """ Raises aiohttp.ClientResponseError for error statuses, as aiohttp does. """
+        if self.status >= 400:
+            request_info = aiohttp.RequestInfo(URL(self.url), self.method, CIMultiDictProxy(CIMultiDict()))
+            raise aiohttp.ClientResponseError(request_info, (), status=self.status, message=self.reason, headers=self.headers)
+
+def fixture_key(base_url: str, url: str, method: str="GET", params: dict=None) -> str:
+    """
+    Get the key a request's response is recorded under. The key is relative to the source's base URL,
+    so responses recorded from mock providers or another base URL are replayed with any base URL.
+
+    :param base_url: Source's base URL, formatted URLs up to their first placeholder
+    :param url: URL of the request
+    :param method: HTTP method of the request
+    :param params: Query parameters of the request
+
+    :return: Key, e.g. GET ip_addresses/8.8.8.8
+    """
+    base_url = base_url.split("{", 1)[0]
+    path = url[len(base_url):] if url.startswith(base_url) else url
+    query = urlencode(sorted((params or {}).items()))
+    return f"{method} {path}?{query}" if query else f"{method} {path}"
+
+class FixtureStore:
+    """
+    Recorded responses of the sources, a JSON file per source in SOURCE_FIXTURES_DIR.
+    Each file has the source's responses keyed by fixture_key, with the indicator that was searched, status, content type and body.
+    Bodies of JSON responses are stored as JSON, others as text.
+
+    :param directory: Directory of the fixture files
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.sources: dict[str, dict] = {}
+
+    def path(self, source: str) -> str:
+        return os.path.join(self.directory, f"{source}.json")
+
+    def responses(self, source: str) -> dict[str, dict]:
+        """
+        Get the recorded responses of a source, read once per process.
+
+        :param source: Class name of the source
+
+        :return: Dict of keys and recorded responses, empty if none were recorded
+        """
+        if source not in self.sources:
+            try:
+                with open(self.path(source), encoding="utf-8") as f:
+                    self.sources[source] = json.load(f)["responses"]
+            except FileNotFoundError:
+                self.sources[source] = {}
+        return self.sources[source]
+
+    def replay(self, source: str, key: str, url: str) -> FixtureResponse:
+        """
+        Get the recorded response of a request.
+
+        :param source: Class name of the source
+        :param key: Key of the request, see fixture_key
+        :param url: URL of the request
+
+        :return: FixtureResponse
+        :raises MissingFixtureError: If no response was recorded for the request
+        """
+        recorded = self.responses(source).get(key)
+        if recorded is None:
+            raise MissingFixtureError(source, key)
+        return to_response(recorded, url, key.split(" ", 1)[0])
+
+    def record(self, source: str, key: str, indicator: str, status: int, reason: str, content_type: str, body: bytes) -> None:
+        """
+        Stores a response of a source, replacing any earlier one of the same request.
+
+        :param source: Class name of the source
+        :param key: Key of the request, see fixture_key
+        :param indicator: Searched indicator, empty if unknown
+        :param status: HTTP status code
+        :param reason: HTTP reason phrase
+        :param content_type: Content-Type header
+        :param body: Body
+        """
+        text = body.decode("utf-8", errors="replace")
+        recorded = {
+            "indicator": indicator,
+            "indicator_type": get_indicator_type(indicator).name if indicator else None,
+            "status": status,
+            "reason": reason,
+            "content_type": content_type,
+        }
+        if "application/json" in content_type:
+            try:
+                recorded["json"] = json.loads(text)
+            except ValueError:
+                recorded["text"] = text
+        else:
+            recorded["text"] = text
+        responses = self.responses(source)
+        responses[key] = recorded
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.path(source), "w", encoding="utf-8") as f:
+            json.dump({"source": source, "responses": dict(sorted(responses.items()))}, f, indent=2)
+        logger.debug("Recorded response of %s for %s", source, key)
+
+def to_response(recorded: dict, url: str="", method: str="GET") -> FixtureResponse:
+    """
+    Builds the response of a recorded one.
+
+    :param recorded: Recorded response, see FixtureStore
+    :param url: URL of the request
+    :param method: HTTP method of the request
+
+    :return: FixtureResponse
+    """
+    body = json.dumps(recorded["json"]) if "json" in recorded else recorded.get("text", "")
+    return FixtureResponse(url, method, recorded["status"], recorded["content_type"], body.encode("utf-8"), recorded.get("reason", ""))
+
+_store: FixtureStore | None = None
+
+def get_fixture_store() -> FixtureStore:
+    """
+    Get the fixture store of SOURCE_FIXTURES_DIR, shared by the sources of the process.
+
+    :return: FixtureStore
+    """
+    global _store
+    if _store is None or _store.directory != Config.SOURCE_FIXTURES_DIR:
+        _store = FixtureStore(Config.SOURCE_FIXTURES_DIR)
+    return _store
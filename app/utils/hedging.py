@@ -0,0 +1,157 @@
+import asyncio
+from collections import deque
+import math
+import time
+from typing import Awaitable, Callable, TypeVar
+
+from app.config import Config
+from app.utils.logger import setup_logger
+from app.utils.metrics import SOURCE_HEDGED_REQUESTS
+
+logger = setup_logger(__name__)
+
+T = TypeVar("T")
+
+class LatencyTracker:
+    """
+    Latencies of a source's most recent requests, the hedging delay is their HEDGE_PERCENTILE.
+
+    :param window: Number of requests kept
+    :param min_samples: Requests needed before a percentile is reported
+    """
+    def __init__(self, window: int, min_samples: int):
+        self.samples = deque(maxlen=window)
+        self.min_samples = min_samples
+        self._percentiles = {}
+        # Percentiles are recomputed after a tenth of the window was replaced, not for every request
+        self._refresh_every = max(1, window // 10)
+        self._observed = 0
+
+    def observe(self, seconds: float) -> None:
+        """
+        Adds the latency of a request.
+
+        :param seconds: Latency in seconds, for cancelled requests the time until they were cancelled
+        """
+        self.samples.append(seconds)
+        self._observed += 1
+        if self._observed >= self._refresh_every:
+            self._observed = 0
+            self._percentiles.clear()
+
+    def percentile(self, percent: float) -> float | None:
+        """
+        Get a percentile of the recent latencies.
+
+        :param percent: Percentile, between 0 and 100
+
+        :return: Latency in seconds, None until min_samples requests were observed
+        """
+        if len(self.samples) < self.min_samples:
+            return None
+        value = self._percentiles.get(percent)
+        if value is None:
+            ordered = sorted(self.samples)
+            value = self._percentiles[percent] = ordered[min(len(ordered) - 1, math.ceil(len(ordered) * percent / 100) - 1)]
+        return value
+
+class HedgeBudget:
+    """
+    Token bucket capping hedged requests to a share of the requests of hedged sources.
+    Every request adds ratio tokens, up to burst, and every hedged request takes one.
+
+    :param ratio: Hedged requests allowed per request, e.g. 0.05 for at most 5% extra requests
+    :param burst: Most tokens saved up, hedged requests allowed at once after a calm period
+    """
+    def __init__(self, ratio: float, burst: float):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst if ratio > 0 else 0
+
+    def earn(self) -> None:
+        """ Adds the tokens of a request. """
+        self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def spend(self) -> bool:
+        """
+        Takes the token of a hedged request.
+
+        :return: Whether a token was left
+        """
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+# Budget of the process, shared by every hedged source
+budget = HedgeBudget(Config.HEDGE_BUDGET_RATIO, Config.HEDGE_BUDGET_BURST)
+
+def hedge_delay(latency: LatencyTracker) -> float | None:
+    """
+    Get the time to wait for a response before sending a hedged request.
+
+    :param latency: LatencyTracker of the source
+
+    :return: Delay in seconds, None while too few requests were observed
+    """
+    observed = latency.percentile(Config.HEDGE_PERCENTILE)
+    if observed is None:
+        return None
+    return max(observed, Config.HEDGE_MIN_DELAY_MS / 1000)
+
+async def _timed(send: Callable[[], Awaitable[T]], latency: LatencyTracker) -> T:
+    start = time.perf_counter()
+    try:
+        result = await send()
+    except asyncio.CancelledError:
+        # Cancelled requests never completed, the time they took so far would pull the percentile down
+        raise
+    except Exception:
+        latency.observe(time.perf_counter() - start)
+        raise
+    latency.observe(time.perf_counter() - start)
+    return result
+
+async def hedged_request(source: str, send: Callable[[], Awaitable[T]], latency: LatencyTracker) -> T:
+    """
+    Sends a request, and an identical second one if no response arrived within the source's recent
+    HEDGE_PERCENTILE latency and the budget allows. The first successful response wins, the other request is cancelled.
+    Only for sources without quotas, the hedged request is sent to the provider too.
+
+    :param source: Name of the source
+    :param send: Callable creating the request's coroutine, called once per request
+    :param latency: LatencyTracker of the source
+
+    :return: Result of the first successful request
+    :raises Exception: Error of the first request if both failed
+    """
+    budget.earn()
+    delay = hedge_delay(latency)
+    if delay is None:
+        return await _timed(send, latency)
+
+    primary = asyncio.ensure_future(_timed(send, latency))
+    tasks = [primary]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if done:
+            return primary.result()
+        if not budget.spend():
+            SOURCE_HEDGED_REQUESTS.labels(source, "budget_exhausted").inc()
+            return await primary
+
+        logger.debug("No response from %s within %.3f seconds, sending a hedged request", source, delay)
+        tasks.append(asyncio.ensure_future(_timed(send, latency)))
+        pending, errors = set(tasks), {}
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    SOURCE_HEDGED_REQUESTS.labels(source, "won" if task is not primary else "lost").inc()
+                    return task.result()
+                errors[task] = task.exception()
+        SOURCE_HEDGED_REQUESTS.labels(source, "failed").inc()
+        raise errors[primary]
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,161 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from app.models import db, EnrichmentResult
+from app.utils.enums import IndicatorType
+from app.utils.indicator_type import canonicalize_indicator
+from app.utils.logger import setup_logger
+from app.utils.metrics import record_cache_operation
+
+from flask import current_app
+
+logger = setup_logger(__name__)
+
+def utcnow() -> datetime:
+    """ Current UTC time without timezone, as stored in the database. """
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+def load_fresh_results(indicator: str, indicator_type: IndicatorType, schema_versions: dict[str, int], max_age: int) -> dict[str, dict]:
+    """
+    Get the latest stored results of the sources fetched within max_age seconds.
+    Results parsed with another schema_version than the source's current one are ignored.
+
+    :param indicator: Searched indicator
+    :param indicator_type: IndicatorType of the indicator
+    :param schema_versions: Dict of source's name and its current schema_version
+    :param max_age: Maximum age of the results in seconds
+
+    :return: Dict of source's name and its latest result, sources without a fresh result are left out
+    """
+    if not schema_versions or max_age <= 0:
+        return {}
+    try:
+        rows = (
+            EnrichmentResult.query
+            .filter(
+                EnrichmentResult.indicator == canonicalize_indicator(indicator, indicator_type),
+                EnrichmentResult.source_name.in_(schema_versions),
+                EnrichmentResult.fetched_at >= utcnow() - timedelta(seconds=max_age),
+            )
+            .order_by(EnrichmentResult.fetched_at.desc())
+            .all()
+        )
+    except Exception as e:
+        # The database tier is a best effort, the sources are queried when it can't be read
+        db.session.rollback()
+        logger.error(f"Error loading results of {indicator} from the database: {e}")
+        return {}
+    results = {}
+    for row in rows:
+        if row.schema_version == schema_versions[row.source_name]:
+            results.setdefault(row.source_name, row.result)
+    record_cache_operation("hit", tier="database", count=len(results))
+    record_cache_operation("miss", tier="database", count=len(schema_versions) - len(results))
+    return results
+
+def store_results(indicator: str, indicator_type: IndicatorType, results: dict[str, dict], schema_versions: dict[str, int]) -> None:
+    """
+    Stores results fetched from sources. Errors are not stored.
+
+    :param indicator: Searched indicator
+    :param indicator_type: IndicatorType of the indicator
+    :param results: Dict of source's name and its result
+    :param schema_versions: Dict of source's name and the schema_version its result was parsed with
+    """
+    canonical = canonicalize_indicator(indicator, indicator_type)
+    fetched_at = utcnow()
+    rows = [
+        EnrichmentResult(
+            indicator=canonical,
+            indicator_type=indicator_type.name,
+            source_name=source_name,
+            verdict=result.get("verdict", "NONE"),
+            result=result,
+            schema_version=schema_versions[source_name],
+            fetched_at=fetched_at,
+        )
+        for source_name, result in results.items()
+        if result and result.get("summary") != "error"
+    ]
+    if not rows:
+        return
+    try:
+        db.session.add_all(rows)
+        db.session.commit()
+        record_cache_operation("set", tier="database", count=len(rows))
+    except Exception as e:
+        # History is a best effort, failing to store it must not fail the search
+        db.session.rollback()
+        logger.error(f"Error storing results of {indicator} to the database: {e}")
+
+async def run_in_thread(function, *args):
+    """
+    Runs a database function in a thread with its own app context and session, so queries and commits don't block the event loop
+    the searches' requests share.
+    
+    :param function: Function to run, e.g. load_fresh_results or store_results
+    :param args: Arguments of the function
+    
+    :return: Result of the function
+    """
+    app = current_app._get_current_object()
+
+    def run():
+        with app.app_context():
+            return function(*args)
+    return await asyncio.to_thread(run)
+
+def query_history(indicator: str, source_name: str=None, since: datetime=None, until: datetime=None, limit: int=100) -> list[EnrichmentResult]:
+    """
+    Get stored results of the indicator, newest first.
+
+    :param indicator: Indicator to get the history of
+    :param source_name: Only results of this source, all sources if None
+    :param since: Only results fetched at or after this time
+    :param until: Only results fetched before this time
+    :param limit: Maximum number of results
+
+    :return: List of stored results
+    """
+    query = EnrichmentResult.query.filter(EnrichmentResult.indicator == canonicalize_indicator(indicator))
+    if source_name:
+        query = query.filter(EnrichmentResult.source_name == source_name)
+    if since:
+        query = query.filter(EnrichmentResult.fetched_at >= since)
+    if until:
+        query = query.filter(EnrichmentResult.fetched_at < until)
+    return query.order_by(EnrichmentResult.fetched_at.desc()).limit(limit).all()
+
+def discard_fresh_results(max_age: int, source_name: str=None, indicator_type: IndicatorType=None) -> int:
+    """
+    Deletes stored results fetched within max_age seconds, so the next searches query the sources instead of
+    being served them again.
+
+    :param max_age: Maximum age of the deleted results in seconds, see load_fresh_results
+    :param source_name: Only results of this source, all sources if None
+    :param indicator_type: Only results of this IndicatorType, all types if None
+
+    :return: Number of deleted results
+    """
+    if max_age <= 0:
+        return 0
+    query = EnrichmentResult.query.filter(EnrichmentResult.fetched_at >= utcnow() - timedelta(seconds=max_age))
+    if source_name:
+        query = query.filter(EnrichmentResult.source_name == source_name)
+    if indicator_type:
+        query = query.filter(EnrichmentResult.indicator_type == indicator_type.name)
+    deleted = query.delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+def prune_history(retention_days: int) -> int:
+    """
+    Deletes stored results older than the retention period.
+
+    :param retention_days: Days results are kept
+
+    :return: Number of deleted results
+    """
+    deleted = EnrichmentResult.query.filter(EnrichmentResult.fetched_at < utcnow() - timedelta(days=retention_days)).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
@@ -4,6 +4,12 @@ from app.utils.enums import IndicatorType
 
 import ipaddress
 
+# Compiled once, the validators run for every indicator of bulk jobs and ingested files
+DOMAIN_PATTERN = re.compile(r'^[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
+URL_PATTERN = re.compile(r"^https?://")
+HASH_LENGTHS = frozenset((32, 40, 64))
+HEX_DIGITS = frozenset("0123456789abcdefABCDEF")
+
 def validate_ip(ip_string: str) -> IndicatorType:
     """
     Validates if the string is a valid IPv4/IPv6 address.
@@ -29,9 +35,7 @@ def validate_domain(domain: str) -> IndicatorType:
     
     :return: Boolean if the string is a valid domain
     """
-    # Regular expression for validating a domain
-    domain_pattern = re.compile(r'^[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$')
-    if domain_pattern.match(domain):
+    if DOMAIN_PATTERN.match(domain):
         return True
     else:
         return False
@@ -44,8 +48,7 @@ def validate_url(url: str) -> IndicatorType:
     
     :return: Boolean if the string is a valid url
     """
-    url_pattern = re.compile(r"^https?://")
-    if url_pattern.match(url):
+    if URL_PATTERN.match(url):
         return True
     else:
         return False
@@ -58,7 +61,7 @@ def validate_hash(hash: str) -> IndicatorType:
     
     :return: Boolean if the string is a valid hash
     """
-    if len(hash) in {32, 40, 64} and all(c in "0123456789abcdefABCDEF" for c in hash):
+    if len(hash) in HASH_LENGTHS and HEX_DIGITS.issuperset(hash):
         return True
     else:
         return False
@@ -91,4 +94,27 @@ def is_valid_indicator(ioc: str) -> bool:
     """
     if get_indicator_type(ioc) == IndicatorType.UNKNOWN:
         return False
-    return True
\ No newline at end of file
+    return True
+
+def canonicalize_indicator(ioc: str, indicator_type: IndicatorType=None) -> str:
+    """
+    Normalizes the IOC, so different notations of the same IOC are stored and looked up the same way.
+    IP addresses are compressed, domains and hashes lowercased and the scheme and host of URLs lowercased.
+    
+    :param ioc: String to be normalized
+    :param indicator_type: IndicatorType of the IOC, detected if not given
+    
+    :return: Canonical form of the IOC
+    """
+    ioc = ioc.strip()
+    if indicator_type is None:
+        indicator_type = get_indicator_type(ioc)
+    if indicator_type in (IndicatorType.IPv4, IndicatorType.IPv6):
+        return str(ipaddress.ip_address(ioc))
+    elif indicator_type in (IndicatorType.DOMAIN, IndicatorType.HASH):
+        return ioc.lower()
+    elif indicator_type == IndicatorType.URL:
+        scheme, _, rest = ioc.partition("://")
+        host, slash, path = rest.partition("/")
+        return f"{scheme.lower()}://{host.lower()}{slash}{path}"
+    return ioc
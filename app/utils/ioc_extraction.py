@@ -0,0 +1,152 @@
+import hashlib
+import math
+import re
+from typing import BinaryIO, Iterator
+
+from app.utils.enums import IndicatorType
+from app.utils.indicator_type import canonicalize_indicator, validate_domain, validate_hash, validate_ip, validate_url
+
+# Bytes read from the file at a time
+CHUNK_SIZE = 1024 * 1024
+# Longest token carried over to the next chunk, longer ones are scanned split at the chunk boundary
+MAX_TOKEN_LENGTH = 4096
+# Longest URL kept, like the indicator column of the enrichment history
+MAX_URL_LENGTH = 2048
+# Candidates remembered exactly, repeated ones are skipped before hashing them for the Bloom filter
+RECENT_CANDIDATES = 100000
+
+_DOT = rb"(?:\.|\[\.\])"
+_HEX = rb"[0-9a-fA-F]"
+# Candidates are found with one scan of the bytes and then validated like get_indicator_type does.
+# Every candidate starts at a word boundary, the other positions are skipped with one check.
+# URLs come first so the domains and IPs inside them aren't extracted on their own.
+# Defanged notations used in reports, hxxp:// and [.], are matched too.
+CANDIDATE_PATTERN = re.compile(
+    rb"\b(?:(?P<url>[hH][tTxX][tTxX][pP][sS]?(?:://|\[://\])[^\s\"'<>`\x00-\x1f]+)"
+    rb"|(?<![.])(?P<ipv4>(?:\d{1,3}" + _DOT + rb"){3}\d{1,3})(?!\w|" + _DOT + rb"\w)"
+    rb"|(?<![:])(?P<ipv6>(?:" + _HEX + rb"{0,4}:){2,7}" + _HEX + rb"{0,4})(?![\w:])"
+    rb"|(?P<hash>" + _HEX + rb"{32}(?:" + _HEX + rb"{8}(?:" + _HEX + rb"{24})?)?)(?![\w-])"
+    # Labels are matched possessively, backtracking into them can't make a domain match
+    rb"|(?<![.-])(?P<domain>(?:[a-zA-Z0-9-]++" + _DOT + rb")+[a-zA-Z]{2,63})(?![\w-]|" + _DOT + rb"\w))"
+)
+_REFANG_PATTERN = re.compile(rb"\[\.\]|\[://\]|^hxxp", re.IGNORECASE)
+_REFANG = {b"[.]": b".", b"[://]": b"://"}
+# Punctuation closing sentences or brackets around URLs in text
+_URL_TRAILING = b".,;:!?)]}'\""
+# Validators of the candidates of each group, IPs are validated with validate_ip
+_GROUP_VALIDATORS = {
+    "url": (IndicatorType.URL, validate_url),
+    "hash": (IndicatorType.HASH, validate_hash),
+    "domain": (IndicatorType.DOMAIN, validate_domain),
+}
+
+class BloomFilter:
+    """
+    Compact set of seen items, using about 1.2 bytes per item at a 0.01% error rate.
+    Items are never reported as new twice, but with the error rate a new item is reported as seen.
+
+    :param capacity: Number of items the error rate holds for
+    :param error_rate: Share of new items reported as seen, once capacity items were added
+    """
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def add(self, item: bytes) -> bool:
+        """
+        Adds the item.
+
+        :param item: Item
+
+        :return: Whether the item wasn't seen before
+        """
+        digest = hashlib.blake2b(item, digest_size=16).digest()
+        # Double hashing, the positions are derived from two halves of one digest
+        first = int.from_bytes(digest[:8], "little")
+        step = int.from_bytes(digest[8:], "little") | 1
+        new = False
+        for i in range(self.hash_count):
+            position = (first + i * step) % self.size
+            mask = 1 << (position & 7)
+            if not self.bits[position >> 3] & mask:
+                self.bits[position >> 3] |= mask
+                new = True
+        return new
+
+def _refang(value: bytes) -> bytes:
+    return _REFANG_PATTERN.sub(lambda match: _REFANG.get(match.group().lower(), b"http"), value)
+
+def _validate(group: str, value: str) -> IndicatorType:
+    if group in ("ipv4", "ipv6"):
+        return validate_ip(value)
+    indicator_type, validator = _GROUP_VALIDATORS[group]
+    return indicator_type if validator(value) else IndicatorType.UNKNOWN
+
+def iter_chunks(stream: BinaryIO, chunk_size: int=CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Reads the stream in chunks ending at whitespace, so no indicator is split between two chunks.
+    Only one chunk and the token carried over from the previous one are held in memory.
+
+    :param stream: Binary file object
+    :param chunk_size: Bytes read at a time
+
+    :return: Generator of chunks
+    """
+    carry = b""
+    while chunk := stream.read(chunk_size):
+        chunk = carry + chunk
+        end = max(chunk.rfind(b"\n"), chunk.rfind(b" "), chunk.rfind(b"\t"))
+        if end < 0 or len(chunk) - end > MAX_TOKEN_LENGTH:
+            end = len(chunk) - 1
+        carry = chunk[end + 1:]
+        yield chunk[:end + 1]
+    if carry:
+        yield carry
+
+def extract_indicators(stream: BinaryIO, seen: BloomFilter=None, types: set[IndicatorType]=None, chunk_size: int=CHUNK_SIZE) -> Iterator[tuple[str, IndicatorType]]:
+    """
+    Extracts the indicators of a text file, like a proxy log or the text of a report, reading it in chunks.
+    With a Bloom filter duplicates are dropped while the file is read, candidates seen before are skipped
+    before they are validated, so repeated indicators cost a set lookup.
+
+    :param stream: Binary file object
+    :param seen: Bloom filter of the indicators seen so far, duplicates are kept if not given
+    :param types: IndicatorTypes to extract, all if not given
+    :param chunk_size: Bytes read at a time
+
+    :return: Generator of tuples of the canonical indicator and its IndicatorType, in the order they appear
+    """
+    recent = set()
+    for chunk in iter_chunks(stream, chunk_size):
+        for match in CANDIDATE_PATTERN.finditer(chunk):
+            candidate = match.group()
+            if seen is not None:
+                if candidate in recent:
+                    continue
+                if len(recent) >= RECENT_CANDIDATES:
+                    recent.clear()
+                recent.add(candidate)
+                if not seen.add(candidate):
+                    continue
+
+            value = candidate
+            group = match.lastgroup
+            if group == "url":
+                value = _refang(value.rstrip(_URL_TRAILING))
+                if len(value) > MAX_URL_LENGTH:
+                    continue
+                scheme, separator, rest = value.partition(b"://")
+                value = scheme.lower() + separator + rest
+            elif b"[" in value:
+                value = _refang(value)
+            value = value.decode("ascii", "ignore")
+            indicator_type = _validate(group, value)
+            if indicator_type == IndicatorType.UNKNOWN or (types and indicator_type not in types):
+                continue
+
+            indicator = canonicalize_indicator(value, indicator_type)
+            # Other notations of the indicator were added as candidates, e.g. uppercase hashes
+            if seen is not None and indicator.encode("utf-8") != candidate and not seen.add(indicator.encode("utf-8")):
+                continue
+            yield indicator, indicator_type
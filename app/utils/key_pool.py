@@ -0,0 +1,117 @@
+from app.config import Config
+from app.utils.cache import get_async_redis, make_key, redis_client
+from app.utils.logger import setup_logger
+from app.utils.metrics import API_KEY_REQUESTS
+from app.utils.quotas import acquire_quota
+
+logger = setup_logger(__name__)
+
+# Status codes taking a key out of rotation and the seconds it is left out
+COOLDOWN_STATUSES = {
+    429: Config.API_KEY_COOLDOWN_RATE_LIMITED,
+    401: Config.API_KEY_COOLDOWN_UNAUTHORIZED,
+}
+
+def quota_subject(source: str, key_id: int=None) -> str:
+    """
+    Get the name quotas are counted under. Each API key has its own quota at the provider.
+
+    :param source: Registry key of the source
+    :param key_id: ID of the API key, None for sources without keys
+
+    :return: Name of the quota counters
+    """
+    return source if key_id is None else f"{source}:{key_id}"
+
+def _cooldown_key(source: str, key_id: int) -> str:
+    return make_key("api_key_cooldown", source, key_id)
+
+async def acquire_api_key(source: str, key_ids: list[int], quotas: dict[str, int], priority: str="interactive") -> tuple[int | None, tuple[str, float] | None]:
+    """
+    Picks the source's next API key in round-robin order, skipping keys cooling down or whose quota is used up,
+    and counts the request against the picked key's quota.
+
+    :param source: Registry key of the source
+    :param key_ids: IDs of the source's API keys
+    :param quotas: Dict of window name and requests allowed per window for each key
+    :param priority: Priority class of the search sending the request
+
+    :return: Tuple of the picked key's ID and None, or None and tuple of the reason no key is available and seconds until one is
+    """
+    if not key_ids:
+        return None, None
+    pipeline = get_async_redis().pipeline(transaction=False)
+    pipeline.incr(make_key("api_key_rotation", source))
+    for key_id in key_ids:
+        pipeline.pttl(_cooldown_key(source, key_id))
+    rotation, *cooldowns = await pipeline.execute()
+
+    start = rotation % len(key_ids)
+    denied = []
+    for key_id, cooldown in zip(key_ids[start:] + key_ids[:start], cooldowns[start:] + cooldowns[:start]):
+        if cooldown > 0:
+            denied.append(("cooldown", cooldown / 1000))
+            continue
+        exhausted = await acquire_quota(quota_subject(source, key_id), quotas, priority)
+        if not exhausted:
+            return key_id, None
+        denied.append(exhausted)
+    return None, min(denied, key=lambda reason: reason[1])
+
+async def record_key_result(source: str, key_id: int, status_code: int=None) -> None:
+    """
+    Records the result of a request sent with an API key. Keys answered with one of the COOLDOWN_STATUSES
+    are taken out of rotation for the status' cooldown.
+
+    :param source: Registry key of the source
+    :param key_id: ID of the API key
+    :param status_code: HTTP status code of a failed request, 0 if it failed without one, None if the request succeeded
+    """
+    pipeline = get_async_redis().pipeline(transaction=False)
+    if status_code in COOLDOWN_STATUSES:
+        cooldown = COOLDOWN_STATUSES[status_code]
+        logger.warning(f"API key {key_id} of {source} answered {status_code}, taking it out of rotation for {cooldown} seconds")
+        pipeline.set(_cooldown_key(source, key_id), status_code, ex=cooldown)
+        result = "rate_limited" if status_code == 429 else "unauthorized"
+    else:
+        result = "ok" if status_code is None else "error"
+    API_KEY_REQUESTS.labels(source, key_id, result).inc()
+    pipeline.hincrby(make_key("api_key_usage", source), f"{key_id}:{result}")
+    await pipeline.execute()
+
+def get_key_usage(source: str, key_ids: list[int]) -> dict[int, dict]:
+    """
+    Get the requests sent with each of the source's API keys and their remaining cooldown.
+
+    :param source: Registry key of the source
+    :param key_ids: IDs of the source's API keys
+
+    :return: Dict of key's ID and dict of its requests by result and seconds of cooldown left
+    """
+    pipeline = redis_client.pipeline(transaction=False)
+    pipeline.hgetall(make_key("api_key_usage", source))
+    for key_id in key_ids:
+        pipeline.ttl(_cooldown_key(source, key_id))
+    counts, *cooldowns = pipeline.execute()
+
+    usage = {key_id: {"requests": {}, "cooldown": max(cooldown, 0)} for key_id, cooldown in zip(key_ids, cooldowns)}
+    for field, count in counts.items():
+        key_id, _, result = field.partition(":")
+        if int(key_id) in usage:
+            usage[int(key_id)]["requests"][result] = int(count)
+    return usage
+
+def forget_key(source: str, key_id: int) -> None:
+    """
+    Removes the usage and cooldown of a deleted API key.
+
+    :param source: Registry key of the source
+    :param key_id: ID of the API key
+    """
+    usage_key = make_key("api_key_usage", source)
+    fields = [field for field in redis_client.hkeys(usage_key) if field.partition(":")[0] == str(key_id)]
+    pipeline = redis_client.pipeline(transaction=False)
+    if fields:
+        pipeline.hdel(usage_key, *fields)
+    pipeline.delete(_cooldown_key(source, key_id))
+    pipeline.execute()
@@ -1,34 +1,164 @@
+import atexit
+import json
 import logging
+from logging.handlers import QueueHandler, QueueListener
+import os
+import queue
+import random
 import sys
 
-def setup_logger(name: str, level=logging.INFO) -> logging.Logger:
+from app.config import Config
+from app.utils.metrics import LOG_RECORDS_DROPPED
+
+TEXT_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+# Attributes every LogRecord has, anything else was passed with extra and is added to JSON logs
+_RECORD_ATTRIBUTES = frozenset(logging.makeLogRecord({}).__dict__) | {"message", "asctime"}
+
+class JsonFormatter(logging.Formatter):
+    """ Formats records as one JSON object per line, including fields passed with extra. """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "timestamp": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update((key, value) for key, value in record.__dict__.items() if key not in _RECORD_ATTRIBUTES)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        elif record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class _LoggingQueueHandler(QueueHandler):
     """
-    Function to set up a logger. Logs are streamed to stdout. 
-    
-    :param name: Name used to differentiate logs
-    :param level: Logging level used for the logger
+    Puts records on the logging queue without formatting them, the listener thread formats and writes them.
+    Records logged while the queue is full are dropped and counted, logging never blocks the caller.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Arguments are merged now, they could change before the listener gets to the record.
+        # The record isn't copied, the queue handler is the only handler of the app's loggers.
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
 
-    :return: Logger instance used to create logs entries
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+class _LoggingQueueListener(QueueListener):
+    """ Listener waiting for room on a full queue when stopped, so the records queued before are still written. """
+    def enqueue_sentinel(self) -> None:
+        self.queue.put(self._sentinel)
+
+class SampledLogger(logging.LoggerAdapter):
     """
+    Logger logging only a share of the DEBUG and INFO messages, for messages logged for every indicator.
+    Warnings and errors are always logged. Skipped messages cost a random number, their arguments are never formatted.
 
-    # Create a logger
-    logger = logging.getLogger(name)
-    logger.setLevel(level)
+    :param logger: Logger the sampled messages are logged to
+    :param rate: Share of messages logged, between 0 and 1
+    """
+    def __init__(self, logger: logging.Logger, rate: float):
+        super().__init__(logger, {"sampled": rate})
+        self.rate = rate
+
+    def log(self, level: int, msg, *args, **kwargs) -> None:
+        if level <= logging.INFO and self.rate < 1 and random.random() >= self.rate:
+            return
+        if self.isEnabledFor(level):
+            kwargs.setdefault("extra", self.extra)
+            self.logger.log(level, msg, *args, **kwargs)
+
+    def debug(self, msg, *args, **kwargs) -> None:
+        self.log(logging.DEBUG, msg, *args, **kwargs)
+
+    def info(self, msg, *args, **kwargs) -> None:
+        self.log(logging.INFO, msg, *args, **kwargs)
+
+def _create_handler() -> logging.Handler:
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JsonFormatter() if Config.LOG_FORMAT == "json" else logging.Formatter(TEXT_FORMAT))
+    return handler
+
+def _start_listener() -> None:
+    """ Starts the thread writing queued records, with a new queue. """
+    global _listener
+    _queue_handler.queue = queue.Queue(Config.LOG_QUEUE_SIZE)
+    _listener = _LoggingQueueListener(_queue_handler.queue, _output_handler)
+    _listener.start()
+
+def stop_logging() -> None:
+    """ Writes the records left on the queue and stops the listener thread, called when the process exits. """
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+def flush_logs() -> None:
+    """ Waits until every queued record is written. """
+    stop_logging()
+    _start_listener()
 
-    # Create a console handler to print logs to the console
-    console_handler = logging.StreamHandler(sys.stdout)
-    console_handler.setLevel(level)
+_output_handler = _create_handler()
+_queue_handler = _LoggingQueueHandler(queue.Queue(Config.LOG_QUEUE_SIZE))
+_listener = None
+_start_listener()
+atexit.register(stop_logging)
+# Threads don't survive a fork, forked processes like Celery's workers start their own listener
+os.register_at_fork(after_in_child=_start_listener)
 
-    # Create a formatter and add it to the handlers
-    formatter = logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s")
-    console_handler.setFormatter(formatter)
+def get_log_level(name: str) -> str:
+    """
+    Get the configured level of a logger. Levels in LOG_LEVELS apply to the named logger and the loggers below it,
+    e.g. app.sources applies to app.sources.base_source, the most specific one wins.
+
+    :param name: Name of the logger
 
-    # Add the handlers to the logger
-    logger.addHandler(console_handler)
+    :return: Name of the level, LOG_LEVEL if none is configured for the logger
+    """
+    parts = name.split(".")
+    for end in range(len(parts), 0, -1):
+        level = Config.LOG_LEVELS.get(".".join(parts[:end]))
+        if level:
+            return level.upper()
+    return Config.LOG_LEVEL.upper()
+
+def setup_logger(name: str, level=None) -> logging.Logger:
+    """
+    Function to set up a logger. Records are put on a queue and written to stdout by a background thread,
+    so logging doesn't block the caller on formatting and writing.
+
+    :param name: Name used to differentiate logs
+    :param level: Logging level used for the logger, defaults to the level configured with LOG_LEVEL and LOG_LEVELS
+
+    :return: Logger instance used to create logs entries
+    """
+    logger = logging.getLogger(name)
+    logger.setLevel(level if level is not None else get_log_level(name))
+
+    # Loggers are shared, the queue handler is only added once however often the logger is set up
+    if _queue_handler not in logger.handlers:
+        logger.addHandler(_queue_handler)
 
     logger.propagate = False
 
     return logger
 
+def sampled(logger: logging.Logger, rate: float=None) -> SampledLogger:
+    """
+    Get a logger logging only a share of the messages, for messages logged for every indicator.
+
+    :param logger: Logger the sampled messages are logged to
+    :param rate: Share of messages logged, defaults to LOG_SAMPLE_RATE
+
+    :return: Sampled logger
+    """
+    return SampledLogger(logger, Config.LOG_SAMPLE_RATE if rate is None else rate)
+
 # Create a default logger for the application
-app_logger = setup_logger("app_logger")
\ No newline at end of file
+app_logger = setup_logger("app_logger")
@@ -0,0 +1,215 @@
+import glob
+import os
+
+from app.config import Config
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import multiprocess
+
+# Latency buckets in seconds, upstream APIs usually answer within a few seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+TASK_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+# Metrics without labels write to their files when they are created below, before any startup hook could create the directory
+if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+    os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+SOURCE_REQUEST_LATENCY = Histogram(
+    "threat_lense_source_request_duration_seconds",
+    "Latency of HTTP requests sent to sources",
+    ["source"],
+    buckets=LATENCY_BUCKETS
+)
+SOURCE_RESPONSES = Counter(
+    "threat_lense_source_responses_total",
+    "HTTP responses received from sources by status code",
+    ["source", "status_code"]
+)
+SOURCE_RETRIES = Counter(
+    "threat_lense_source_retries_total",
+    "HTTP requests to sources retried after a server error",
+    ["source"]
+)
+SOURCE_ERRORS = Counter(
+    "threat_lense_source_errors_total",
+    "Failed HTTP requests to sources by error type",
+    ["source", "error"]
+)
+SOURCE_HEDGED_REQUESTS = Counter(
+    "threat_lense_source_hedged_requests_total",
+    "Hedged requests sent to sources after a slow response, by which request answered first, or skipped for lack of budget",
+    ["source", "outcome"]
+)
+SOURCE_TIMEOUT = Gauge(
+    "threat_lense_source_timeout_seconds",
+    "Current connect and read timeouts of sources, derived from their observed latencies",
+    ["source", "phase"],
+    multiprocess_mode="mostrecent"
+)
+SOURCE_REQUESTS_IN_FLIGHT = Gauge(
+    "threat_lense_source_requests_in_flight",
+    "Requests to sources in flight, per process limit and per host",
+    ["scope"],
+    multiprocess_mode="livesum"
+)
+SOURCE_REQUESTS_QUEUED = Gauge(
+    "threat_lense_source_requests_queued",
+    "Requests to sources waiting for a slot of the concurrency governor, per process limit and per host",
+    ["scope"],
+    multiprocess_mode="livesum"
+)
+SOURCE_QUOTA_REMAINING = Gauge(
+    "threat_lense_source_quota_remaining",
+    "Remaining upstream quota reported by the source's rate-limit headers",
+    ["source"],
+    multiprocess_mode="mostrecent"
+)
+SOURCE_QUOTA_LIMIT = Gauge(
+    "threat_lense_source_quota_limit",
+    "Upstream quota limit reported by the source's rate-limit headers",
+    ["source"],
+    multiprocess_mode="mostrecent"
+)
+SOURCE_QUOTA_EXHAUSTED = Counter(
+    "threat_lense_source_quota_exhausted_total",
+    "Requests to sources not sent because a quota window was used up",
+    ["source", "window", "priority"]
+)
+API_KEY_REQUESTS = Counter(
+    "threat_lense_api_key_requests_total",
+    "Requests sent to sources by API key and result",
+    ["source", "key", "result"]
+)
+CACHE_OPERATIONS = Counter(
+    "threat_lense_cache_operations_total",
+    "Cache lookups and writes by tier and result",
+    ["tier", "operation"]
+)
+TASK_QUEUE_WAIT = Histogram(
+    "threat_lense_task_queue_wait_seconds",
+    "Time tasks spent in the broker queue before a worker started them",
+    ["task", "queue"],
+    buckets=TASK_BUCKETS
+)
+TASK_RUN_TIME = Histogram(
+    "threat_lense_task_run_seconds",
+    "Time spent running tasks",
+    ["task", "state"],
+    buckets=TASK_BUCKETS
+)
+QUEUE_DEPTH = Gauge(
+    "threat_lense_queue_depth",
+    "Tasks waiting in the broker queue of each priority class",
+    ["priority"],
+    multiprocess_mode="mostrecent"
+)
+WORKER_SATURATION = Gauge(
+    "threat_lense_worker_saturation",
+    "Busy share of the worker processes, from the workers' heartbeats",
+    multiprocess_mode="mostrecent"
+)
+ADMISSION_REJECTIONS = Counter(
+    "threat_lense_admission_rejections_total",
+    "Searches, bulk jobs and uploads refused by admission control, by priority class and reason",
+    ["priority", "reason"]
+)
+PREWARM_LOOKUPS = Counter(
+    "threat_lense_prewarm_lookups_total",
+    "Frequently looked up searches considered for pre-warming by outcome",
+    ["outcome"]
+)
+LOG_RECORDS_DROPPED = Counter(
+    "threat_lense_log_records_dropped_total",
+    "Log records dropped because the logging queue was full"
+)
+WEBHOOK_DELIVERIES = Counter(
+    "threat_lense_webhook_deliveries_total",
+    "Callback delivery attempts by event and outcome",
+    ["event", "outcome"]
+)
+
+# Common rate-limit headers, first match is used
+QUOTA_REMAINING_HEADERS = ("X-RateLimit-Remaining", "RateLimit-Remaining", "X-Ratelimit-Remaining")
+QUOTA_LIMIT_HEADERS = ("X-RateLimit-Limit", "RateLimit-Limit", "X-Ratelimit-Limit")
+
+def record_quota_headers(source: str, headers) -> None:
+    """
+    Records upstream quota use from the response's rate-limit headers, if the source sends them.
+
+    :param source: Name of the source
+    :param headers: Response headers
+    """
+    for header in QUOTA_REMAINING_HEADERS:
+        value = headers.get(header)
+        if value is not None and value.isdigit():
+            SOURCE_QUOTA_REMAINING.labels(source).set(int(value))
+            break
+    for header in QUOTA_LIMIT_HEADERS:
+        value = headers.get(header)
+        if value is not None and value.isdigit():
+            SOURCE_QUOTA_LIMIT.labels(source).set(int(value))
+            break
+
+def record_cache_operation(operation: str, tier: str="redis", count: int=1) -> None:
+    """
+    Counts a cache operation.
+
+    :param operation: Operation, either hit, stale_hit, miss, set or delete
+    :param tier: Cache tier where the operation happened
+    :param count: Number of operations
+    """
+    if count:
+        CACHE_OPERATIONS.labels(tier, operation).inc(count)
+
+class SharedMultiProcessCollector:
+    """
+    Collects metrics written by every process sharing the metrics directory.
+    Each service (gunicorn, Celery) writes to its own subdirectory, so they can be cleaned independently on start.
+    """
+    def __init__(self, path: str, registry: CollectorRegistry):
+        self.path = path
+        registry.register(self)
+
+    def collect(self):
+        files = glob.glob(os.path.join(self.path, "*.db")) + glob.glob(os.path.join(self.path, "*", "*.db"))
+        return multiprocess.MultiProcessCollector.merge(files, accumulate=True)
+
+def render_metrics() -> tuple[bytes, str]:
+    """
+    Renders metrics in Prometheus text format.
+    In multiprocess mode, metrics of all processes sharing the metrics directory are aggregated.
+
+    :return: Tuple of rendered metrics and content type
+    """
+    if Config.METRICS_SHARED_DIR or os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        SharedMultiProcessCollector(Config.METRICS_SHARED_DIR or os.environ["PROMETHEUS_MULTIPROC_DIR"], registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+def reset_multiprocess_dir() -> None:
+    """
+    Removes metric files left behind by previous runs of this service.
+    The files of the calling process are kept, its metrics were created when this module was imported.
+    """
+    path = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    if not path:
+        return
+    own_suffix = f"_{os.getpid()}.db"
+    for file in glob.glob(os.path.join(path, "*.db")):
+        if not file.endswith(own_suffix):
+            try:
+                os.remove(file)
+            except FileNotFoundError:
+                pass
+    os.makedirs(path, exist_ok=True)
+
+def mark_process_dead(pid: int) -> None:
+    """
+    Cleans up live gauges of an exited process.
+
+    :param pid: Process id of the exited process
+    """
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid)
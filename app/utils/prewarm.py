@@ -0,0 +1,85 @@
+from datetime import datetime, timezone
+import json
+import time
+
+from app.config import Config
+from app.utils.cache import get_async_redis, make_key, redis_client
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Sorted set of searches and their decaying lookup counts
+FREQUENCY_KEY = make_key("lookup_frequency", "searches")
+DECAYED_AT_KEY = make_key("lookup_frequency", "decayed_at")
+# Scores decayed below this are dropped, they were looked up about once more than 4 half-lives ago
+MIN_SCORE = 0.05
+
+def _member(indicator: str, sources: list[str]=None, exclude_sources: list[str]=None) -> str:
+    return json.dumps([indicator, sources, exclude_sources])
+
+async def record_lookup(indicator: str, sources: list[str]=None, exclude_sources: list[str]=None) -> None:
+    """
+    Counts a lookup of the search.
+
+    :param indicator: Searched indicator
+    :param sources: Registry keys of sources the search was limited to
+    :param exclude_sources: Registry keys of sources left out of the search
+    """
+    await get_async_redis().zincrby(FREQUENCY_KEY, 1, _member(indicator, sources, exclude_sources))
+
+def decay_frequencies() -> None:
+    """
+    Decays the lookup counts by the time elapsed since the previous decay, so past popularity fades out.
+    Rarely looked up searches are dropped and at most LOOKUP_FREQUENCY_MAX_TRACKED searches are kept.
+    """
+    now = time.time()
+    decayed_at = redis_client.getset(DECAYED_AT_KEY, now)
+    if decayed_at is None:
+        return
+    factor = 0.5 ** (max(now - float(decayed_at), 0) / Config.LOOKUP_FREQUENCY_HALF_LIFE)
+    pipeline = redis_client.pipeline()
+    pipeline.zunionstore(FREQUENCY_KEY, {FREQUENCY_KEY: factor})
+    pipeline.zremrangebyscore(FREQUENCY_KEY, "-inf", f"({MIN_SCORE}")
+    pipeline.zremrangebyrank(FREQUENCY_KEY, 0, -Config.LOOKUP_FREQUENCY_MAX_TRACKED - 1)
+    pipeline.execute()
+
+def get_hot_lookups(count: int) -> list[tuple[str, list[str], list[str], float]]:
+    """
+    Get the most frequently looked up searches.
+
+    :param count: Number of searches
+
+    :return: List of tuples of indicator, source filters and score, most frequent first
+    """
+    hot = redis_client.zrevrange(FREQUENCY_KEY, 0, count - 1, withscores=True)
+    return [(*json.loads(member), score) for member, score in hot]
+
+def _budget_key(source: str) -> str:
+    return make_key("prewarm_spent", source, datetime.now(timezone.utc).date())
+
+def get_remaining_budgets(quotas: dict[str, int]) -> dict[str, float]:
+    """
+    Get how many requests pre-warming may still send to each source today, PREWARM_QUOTA_SHARE of the source's daily quota.
+
+    :param quotas: Dict of source's registry key and daily quota
+
+    :return: Dict of source's registry key and remaining requests
+    """
+    pipeline = redis_client.pipeline(transaction=False)
+    for source in quotas:
+        pipeline.get(_budget_key(source))
+    spent = pipeline.execute()
+    return {source: quota * Config.PREWARM_QUOTA_SHARE - int(used or 0) for (source, quota), used in zip(quotas.items(), spent)}
+
+def spend_budget(sources: list[str]) -> None:
+    """
+    Counts a pre-warming request to each of the sources against today's budget.
+
+    :param sources: Registry keys of the sources
+    """
+    pipeline = redis_client.pipeline(transaction=False)
+    for source in sources:
+        key = _budget_key(source)
+        pipeline.incr(key)
+        pipeline.expire(key, 2 * 86400)
+    pipeline.execute()
@@ -0,0 +1,76 @@
+import json
+import time
+
+from app.config import Config
+from app.utils.cache import make_key, redis_client
+
+# Priority classes accepted by the search APIs and the queues they are routed to
+PRIORITY_QUEUES = {
+    "interactive": Config.QUEUE_INTERACTIVE,
+    "bulk": Config.QUEUE_BULK,
+    "refresh": Config.QUEUE_REFRESH,
+}
+
+def queue_for_priority(priority: str) -> str:
+    """
+    Get the queue tasks of the priority class are routed to.
+    
+    :param priority: Priority class, either interactive, bulk or refresh
+    
+    :return: Name of the queue
+    :raises ValueError: If the priority class is unknown
+    """
+    queue = PRIORITY_QUEUES.get(priority)
+    if not queue:
+        raise ValueError(f"Invalid priority: {priority}, expected one of {', '.join(PRIORITY_QUEUES)}")
+    return queue
+
+def get_queue_depths() -> dict[str, int]:
+    """
+    Get the number of tasks waiting in each priority class' queue.
+    The Redis broker keeps every queue in a list named after the queue.
+    
+    :return: Dict of priority class and number of waiting tasks
+    """
+    pipeline = redis_client.pipeline(transaction=False)
+    for queue in PRIORITY_QUEUES.values():
+        pipeline.llen(queue)
+    return dict(zip(PRIORITY_QUEUES, pipeline.execute()))
+
+def _deferred_key() -> str:
+    return make_key("deferred_tasks")
+
+def defer_task(task_name: str, task_id: str, args: list, kwargs: dict, queue: str, countdown: float) -> None:
+    """
+    Puts a task on the delayed queue, it is sent to its queue again once the countdown passed.
+    Deferred tasks wait in Redis instead of the worker, so long delays don't hold worker slots or outlive the broker's visibility timeout.
+    
+    :param task_name: Name of the task
+    :param task_id: ID the task is sent with again, so its result and bulk job entry stay valid
+    :param args: Positional arguments of the task
+    :param kwargs: Keyword arguments of the task
+    :param queue: Queue the task is sent to
+    :param countdown: Seconds until the task is sent
+    """
+    entry = json.dumps({"task": task_name, "id": task_id, "args": args, "kwargs": kwargs, "queue": queue})
+    redis_client.zadd(_deferred_key(), {entry: time.time() + countdown})
+
+def pop_due_tasks(limit: int=1000) -> list[dict]:
+    """
+    Takes the deferred tasks whose countdown passed off the delayed queue.
+    A task removed by another process meanwhile is left out, so each task is only sent once.
+    
+    :param limit: Maximum number of tasks taken
+    
+    :return: List of dicts with the task's name, id, args, kwargs and queue
+    """
+    key = _deferred_key()
+    due = []
+    for entry in redis_client.zrangebyscore(key, "-inf", time.time(), start=0, num=limit):
+        if redis_client.zrem(key, entry):
+            due.append(json.loads(entry))
+    return due
+
+def count_deferred_tasks() -> int:
+    """ Get the number of tasks waiting on the delayed queue. """
+    return redis_client.zcard(_deferred_key())
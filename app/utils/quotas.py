@@ -0,0 +1,162 @@
+import calendar
+from datetime import datetime, timezone
+import math
+import time
+
+from app.config import Config
+from app.utils.cache import get_async_redis, make_key, redis_client
+from app.utils.logger import setup_logger
+from app.utils.metrics import SOURCE_QUOTA_EXHAUSTED
+
+logger = setup_logger(__name__)
+
+# Quota windows and their length in seconds, monthly windows follow the calendar month
+QUOTA_WINDOWS = {"minute": 60, "hour": 3600, "day": 86400, "month": None}
+# Seconds counters are kept after their window ended, so usage of the previous window is still visible
+COUNTER_GRACE = 60
+
+# Counts a request against every window only if none of them is used up, so a request rejected by one window
+# doesn't spend the others. Returns the 1-based index of the first exhausted window, 0 if the request was counted.
+_ACQUIRE_SCRIPT = """
+local n = #KEYS
+for i = 1, n do
+    if tonumber(redis.call('GET', KEYS[i]) or '0') >= tonumber(ARGV[i]) then
+        return i
+    end
+end
+for i = 1, n do
+    redis.call('INCR', KEYS[i])
+    redis.call('EXPIRE', KEYS[i], ARGV[n + i])
+end
+return 0
+"""
+
+# Gives back a request counted with the acquire script, counters never drop below zero
+_RELEASE_SCRIPT = """
+for i = 1, #KEYS do
+    if tonumber(redis.call('GET', KEYS[i]) or '0') > 0 then
+        redis.call('DECR', KEYS[i])
+    end
+end
+return 0
+"""
+
+class QuotaExhausted(Exception):
+    """ Raised when a search is deferred because a source's quota is used up. """
+    def __init__(self, sources: list[str], retry_after: float):
+        self.sources = sources
+        self.retry_after = retry_after
+        super().__init__(f"Quota exhausted for {', '.join(sources)}, retry after {math.ceil(retry_after)} seconds")
+
+def validate_quotas(quotas: dict[str, int]) -> dict[str, int]:
+    """
+    Validates quota windows and allowances.
+
+    :param quotas: Dict of window name and requests allowed per window
+
+    :return: The quotas
+    :raises ValueError: If a window is unknown or an allowance is not a non-negative integer
+    """
+    for window, allowance in quotas.items():
+        if window not in QUOTA_WINDOWS:
+            raise ValueError(f"Invalid quota window: {window}, expected one of {', '.join(QUOTA_WINDOWS)}")
+        if not isinstance(allowance, int) or allowance < 0:
+            raise ValueError(f"Invalid allowance for the {window} window: {allowance}")
+    return quotas
+
+def window_bounds(window: str, now: float) -> tuple[str, float]:
+    """
+    Get the window containing the moment. Windows are aligned to UTC, e.g. daily windows start at midnight UTC.
+
+    :param window: Name of the window
+    :param now: Moment as a timestamp
+
+    :return: Tuple of the window's identifier and the timestamp it ends
+    """
+    if window == "month":
+        moment = datetime.fromtimestamp(now, timezone.utc)
+        year, month = (moment.year + 1, 1) if moment.month == 12 else (moment.year, moment.month + 1)
+        return f"{moment.year}-{moment.month:02d}", calendar.timegm((year, month, 1, 0, 0, 0))
+    length = QUOTA_WINDOWS[window]
+    start = int(now // length)
+    return str(start), (start + 1) * length
+
+def allowance_for(allowance: int, priority: str) -> int:
+    """
+    Get the share of the allowance available to the priority class.
+    QUOTA_INTERACTIVE_RESERVE of every allowance is reserved for interactive searches.
+
+    :param allowance: Requests allowed per window
+    :param priority: Priority class, either interactive, bulk or refresh
+
+    :return: Requests the priority class may send per window
+    """
+    if priority == "interactive":
+        return allowance
+    return math.floor(allowance * (1 - Config.QUOTA_INTERACTIVE_RESERVE))
+
+def _counter_keys(source: str, quotas: dict[str, int], now: float) -> list[tuple[str, str, float]]:
+    """ Tuples of window name, counter key and the window's end for each of the quota's windows. """
+    keys = []
+    for window in quotas:
+        window_id, ends_at = window_bounds(window, now)
+        keys.append((window, make_key("quota", source, window, window_id), ends_at))
+    return keys
+
+async def acquire_quota(source: str, quotas: dict[str, int], priority: str="interactive") -> tuple[str, float] | None:
+    """
+    Counts a request to the source against each of its quota windows, unless one of them is used up.
+
+    :param source: Registry key of the source
+    :param quotas: Dict of window name and requests allowed per window, no limits if empty
+    :param priority: Priority class of the search sending the request
+
+    :return: None if the request may be sent, otherwise tuple of the exhausted window and seconds until it resets
+    """
+    if not quotas:
+        return None
+    now = time.time()
+    windows = _counter_keys(source, quotas, now)
+    limits = [allowance_for(quotas[window], priority) for window, _, _ in windows]
+    expirations = [math.ceil(ends_at - now) + COUNTER_GRACE for _, _, ends_at in windows]
+    exhausted = await get_async_redis().register_script(_ACQUIRE_SCRIPT)(keys=[key for _, key, _ in windows], args=limits + expirations)
+    if not exhausted:
+        return None
+    window, _, ends_at = windows[exhausted - 1]
+    SOURCE_QUOTA_EXHAUSTED.labels(source, window, priority).inc()
+    logger.warning(f"Quota of {source} exhausted for the {window} window and priority {priority}")
+    return window, max(ends_at - now, 0)
+
+async def release_quota(source: str, quotas: dict[str, int]) -> None:
+    """
+    Gives back a request counted with acquire_quota that was not sent.
+
+    :param source: Registry key of the source
+    :param quotas: Dict of window name and requests allowed per window
+    """
+    if quotas:
+        await get_async_redis().register_script(_RELEASE_SCRIPT)(keys=[key for _, key, _ in _counter_keys(source, quotas, time.time())])
+
+def get_quota_usage(sources: dict[str, dict[str, int]]) -> dict[str, dict[str, dict]]:
+    """
+    Get how much of each source's quota windows is used.
+
+    :param sources: Dict of source's registry key and quotas
+
+    :return: Dict of source's registry key and dict of window name and its allowance, used requests and seconds until it resets
+    """
+    now = time.time()
+    windows = [(source, window, key, ends_at) for source, quotas in sources.items() for window, key, ends_at in _counter_keys(source, quotas, now)]
+    pipeline = redis_client.pipeline(transaction=False)
+    for _, _, key, _ in windows:
+        pipeline.get(key)
+    usage = {source: {} for source in sources}
+    for (source, window, _, ends_at), used in zip(windows, pipeline.execute()):
+        allowance = sources[source][window]
+        usage[source][window] = {
+            "allowance": allowance,
+            "reserved_interactive": allowance - allowance_for(allowance, "bulk"),
+            "used": int(used or 0),
+            "resets_in": math.ceil(ends_at - now),
+        }
+    return usage
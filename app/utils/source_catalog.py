@@ -0,0 +1,99 @@
+import uuid
+
+from app.models import APIKey, Source, db
+from app.utils.cache import make_key, redis_client
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Version of the catalog, replaced on every write so the snapshots of all processes are rebuilt
+VERSION_KEY = make_key("catalog", "version")
+
+class CatalogSource:
+    """ Snapshot of a source's database row and the IDs of its API keys. """
+    __slots__ = ("id", "name", "requires_api_key", "key_ids")
+
+    def __init__(self, id: int, name: str, requires_api_key: bool, key_ids: list[int]):
+        self.id = id
+        self.name = name
+        self.requires_api_key = requires_api_key
+        self.key_ids = key_ids
+
+    @property
+    def is_api_key_configured(self) -> bool:
+        return bool(self.key_ids)
+
+    @property
+    def api_key_count(self) -> int:
+        return len(self.key_ids)
+
+class SourceCatalog:
+    """
+    Read-mostly snapshot of the sources and their API keys, held in memory by each process.
+    The snapshot is built with one joined query and rebuilt when the catalog's version in Redis changed.
+    Writes to sources or API keys must call invalidate after committing.
+    """
+    # Tuple of the version, sources by name and sources by ID, replaced at once so readers never see a partial snapshot
+    _snapshot: tuple[str | None, dict[str, CatalogSource], dict[int, CatalogSource]] = (None, {}, {})
+
+    @classmethod
+    def load(cls) -> tuple[dict[str, CatalogSource], dict[int, CatalogSource]]:
+        """
+        Get the current snapshot, rebuilding it if the catalog changed since it was built.
+
+        :return: Tuple of dicts of sources by name and by ID
+        """
+        version = redis_client.get(VERSION_KEY) or ""
+        snapshot_version, by_name, by_id = cls._snapshot
+        if snapshot_version != version:
+            by_name, by_id = cls.build()
+            cls._snapshot = (version, by_name, by_id)
+        return by_name, by_id
+
+    @classmethod
+    def build(cls) -> tuple[dict[str, CatalogSource], dict[int, CatalogSource]]:
+        """ Builds the snapshot from the database with one query joining the sources and their API keys. """
+        logger.debug("Building source catalog")
+        rows = (
+            db.session.query(Source.id, Source.name, Source.requires_api_key, APIKey.id)
+            .outerjoin(APIKey, APIKey.source_name == Source.name)
+            .order_by(Source.id, APIKey.id)
+            .all()
+        )
+        by_name = {}
+        for source_id, name, requires_api_key, key_id in rows:
+            if name not in by_name:
+                by_name[name] = CatalogSource(source_id, name, bool(requires_api_key), [])
+            if key_id is not None:
+                by_name[name].key_ids.append(key_id)
+        return by_name, {source.id: source for source in by_name.values()}
+
+    @classmethod
+    def get_sources(cls) -> list[CatalogSource]:
+        """
+        Get every source.
+
+        :return: List of sources ordered by ID
+        """
+        return list(cls.load()[0].values())
+
+    @classmethod
+    def find(cls, source_id) -> CatalogSource | None:
+        """
+        Get a source by its name or ID.
+
+        :param source_id: Name or ID of the source
+
+        :return: Source, None if not found
+        """
+        by_name, by_id = cls.load()
+        source = by_name.get(source_id)
+        if source is None and str(source_id).isdigit():
+            source = by_id.get(int(source_id))
+        return source
+
+    @classmethod
+    def invalidate(cls) -> None:
+        """ Drops the snapshots of every process, call after committing changes to sources or API keys. """
+        cls._snapshot = (None, {}, {})
+        redis_client.set(VERSION_KEY, uuid.uuid4().hex)
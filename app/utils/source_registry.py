@@ -3,17 +3,20 @@ import importlib
 import inspect
 
 from app.sources.base_source import BaseSource
+from app.utils.enums import IndicatorType
 from app.utils.logger import setup_logger
 
 logger = setup_logger(__name__)
 
 class SourceRegistry:
     """
-    Registry of all the sources. 
+    Registry of all the sources.
     Instantiate all classes that implement BaseSource and creates a dict of them.
+    Sources are also indexed by the indicator types they support, so only applicable sources are scheduled.
     """
     _instances: dict[str, BaseSource] = {}
-    
+    _dispatch: dict[IndicatorType, dict[str, BaseSource]] = {}
+
     @classmethod
     def get_instance(cls) -> dict[str, BaseSource]:
         """
@@ -40,3 +43,57 @@ class SourceRegistry:
                     if inspect.isclass(obj) and issubclass(obj, BaseSource) and obj is not BaseSource:
                         instance = obj() # Instantiate
                         cls._instances[obj.__name__] = instance # Store instatiated sources
+        cls.build_dispatch_table()
+
+    @classmethod
+    def build_dispatch_table(cls):
+        """ Precomputes the sources supporting each indicator type. """
+        logger.debug("Building source dispatch table")
+        cls._dispatch = {
+            indicator_type: {key: source for key, source in cls._instances.items() if source.supports(indicator_type)}
+            for indicator_type in IndicatorType
+        }
+
+    @classmethod
+    def resolve_source_names(cls, names: list[str]) -> set[str]:
+        """
+        Resolves source names given by the user to registry keys.
+        Both the class name and the source's display name are accepted, case-insensitively.
+
+        :param names: List of source names
+
+        :return: Set of registry keys
+        :raises ValueError: If a name does not match any source
+        """
+        lookup = {}
+        for key, source in cls.get_instance().items():
+            lookup[key.lower()] = key
+            lookup[source.get_name().lower()] = key
+
+        resolved = set()
+        for name in names:
+            key = lookup.get(str(name).strip().lower())
+            if not key:
+                raise ValueError(f"Unknown source: {name}")
+            resolved.add(key)
+        return resolved
+
+    @classmethod
+    def get_sources_for(cls, indicator_type: IndicatorType, include: set[str]=None, exclude: set[str]=None) -> dict[str, BaseSource]:
+        """
+        Get sources that support the indicator type, optionally filtered by registry keys.
+
+        :param indicator_type: IndicatorType of the IOC
+        :param include: Registry keys of sources to limit the search to, all sources if None
+        :param exclude: Registry keys of sources to leave out of the search
+
+        :return: Dict of source's name and the class
+        """
+        cls.get_instance()
+        sources = cls._dispatch.get(indicator_type, {})
+        if include is None and not exclude:
+            return sources
+        return {
+            key: source for key, source in sources.items()
+            if (include is None or key in include) and not (exclude and key in exclude)
+        }
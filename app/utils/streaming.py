@@ -0,0 +1,102 @@
+import json
+
+from app.utils.logger import setup_logger
+
+import aiohttp
+import ijson
+
+logger = setup_logger(__name__)
+
+# Bytes read from the response at a time
+CHUNK_SIZE = 64 * 1024
+
+class ResponseTooLargeError(aiohttp.ClientPayloadError):
+    """ Raised when a response body exceeds the source's maximum response size. """
+    def __init__(self, limit: int):
+        self.limit = limit
+        super().__init__(f"Response body exceeds the maximum size of {limit} bytes")
+
+class LimitedReader:
+    """
+    Reads a response body in chunks, failing once more than limit bytes were read,
+    so a single response can't use more memory than the limit however large the body is.
+
+    :param stream: aiohttp StreamReader of the response body
+    :param limit: Maximum body size in bytes
+    """
+    def __init__(self, stream: aiohttp.StreamReader, limit: int):
+        self.stream = stream
+        self.limit = limit
+        self.read_bytes = 0
+
+    async def read(self, size: int=CHUNK_SIZE) -> bytes:
+        # ijson probes the type of the stream by reading nothing
+        if size == 0:
+            return b""
+        chunk = await self.stream.read(size if size > 0 else CHUNK_SIZE)
+        self.read_bytes += len(chunk)
+        if self.read_bytes > self.limit:
+            raise ResponseTooLargeError(self.limit)
+        return chunk
+
+def check_content_length(response: aiohttp.ClientResponse, limit: int) -> None:
+    """
+    Fails before reading the body if the response announces a body larger than the limit.
+
+    :param response: Response
+    :param limit: Maximum body size in bytes
+    :raises ResponseTooLargeError: If Content-Length exceeds the limit
+    """
+    if response.content_length is not None and response.content_length > limit:
+        raise ResponseTooLargeError(limit)
+
+async def read_body(response: aiohttp.ClientResponse, limit: int) -> bytes:
+    """
+    Reads the whole response body, at most limit bytes.
+
+    :param response: Response
+    :param limit: Maximum body size in bytes
+
+    :return: Body
+    :raises ResponseTooLargeError: If the body exceeds the limit
+    """
+    check_content_length(response, limit)
+    reader = LimitedReader(response.content, limit)
+    chunks = []
+    while chunk := await reader.read():
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+async def read_json(response: aiohttp.ClientResponse, limit: int, excluded_fields: tuple[str, ...]=()) -> dict | list:
+    """
+    Parses a JSON response body, at most limit bytes.
+    Without excluded fields the body is read and parsed at once. With excluded fields it is parsed incrementally
+    while it is read, and the excluded fields are skipped without being built, so large parts of the body that
+    aren't needed never take memory.
+
+    :param response: Response
+    :param limit: Maximum body size in bytes
+    :param excluded_fields: Dotted paths of fields to leave out, list items are named item, e.g. data.attributes.results or pulses.item.indicators
+
+    :return: Parsed body
+    :raises ResponseTooLargeError: If the body exceeds the limit
+    """
+    if not excluded_fields:
+        return json.loads(await read_body(response, limit))
+
+    check_content_length(response, limit)
+    excluded = frozenset(excluded_fields)
+    builder = ijson.ObjectBuilder()
+    skipping = None
+    async for prefix, event, value in ijson.parse_async(LimitedReader(response.content, limit), use_float=True):
+        if skipping is not None:
+            if prefix == skipping or prefix.startswith(skipping + "."):
+                continue
+            skipping = None
+        if event == "map_key":
+            path = f"{prefix}.{value}" if prefix else value
+            if path in excluded:
+                skipping = path
+                continue
+        builder.event(event, value)
+    return builder.value
@@ -0,0 +1,196 @@
+import bisect
+from collections import Counter
+import math
+import time
+
+from app.config import Config
+from app.utils.cache import get_async_redis, make_key, redis_client
+from app.utils.logger import setup_logger
+from app.utils.metrics import SOURCE_TIMEOUT
+
+from redis.exceptions import RedisError
+
+logger = setup_logger(__name__)
+
+# Upper bounds of the latency histogram's buckets in seconds, 25% apart from 5 ms to about 70 s
+LATENCY_BOUNDS = tuple(0.005 * 1.25 ** i for i in range(43))
+# Seconds covered by each Redis hash of the rolling histogram
+SLOT_SECONDS = 60
+# Phases of a request measured separately, connecting and everything after it until the body was read
+PHASES = ("connect", "read")
+
+def bucket_index(seconds: float) -> int:
+    """
+    Get the histogram bucket of a latency.
+
+    :param seconds: Latency in seconds
+
+    :return: Index of the bucket, latencies above the last bound are counted in the last bucket
+    """
+    return min(bisect.bisect_left(LATENCY_BOUNDS, seconds), len(LATENCY_BOUNDS) - 1)
+
+def histogram_percentile(counts: list[int], percent: float) -> float | None:
+    """
+    Get a percentile of a latency histogram, as the upper bound of the bucket it falls in.
+
+    :param counts: Count of each bucket of LATENCY_BOUNDS
+    :param percent: Percentile, between 0 and 100
+
+    :return: Latency in seconds, None if the histogram is empty
+    """
+    total = sum(counts)
+    if not total:
+        return None
+    rank = math.ceil(total * percent / 100)
+    seen = 0
+    for index, count in enumerate(counts):
+        seen += count
+        if seen >= rank:
+            return LATENCY_BOUNDS[index]
+    return LATENCY_BOUNDS[-1]
+
+def slot_keys(source: str, now: float) -> list[str]:
+    """
+    Get the keys of the rolling histogram's slots within TIMEOUT_WINDOW_SECONDS, current slot first.
+
+    :param source: Name of the source
+    :param now: Current timestamp
+
+    :return: List of keys
+    """
+    slot = int(now // SLOT_SECONDS)
+    slots = max(1, math.ceil(Config.TIMEOUT_WINDOW_SECONDS / SLOT_SECONDS))
+    return [make_key("latency", source, slot - i) for i in range(slots)]
+
+def _clamp(value: float, low: float, high: float) -> float:
+    return min(max(value, low), high)
+
+def derive_timeouts(histogram: dict[str, int], default: float) -> dict:
+    """
+    Derives a source's connect and read timeouts from its latency histogram, TIMEOUT_PERCENTILE
+    of each phase times TIMEOUT_FACTOR, within the configured floor and ceiling.
+
+    :param histogram: Counts by field, <phase>:<bucket index>
+    :param default: Timeout used until TIMEOUT_MIN_SAMPLES requests were observed
+
+    :return: Dict of the connect and read timeouts in seconds, the TIMEOUT_PERCENTILE of each phase, the number of
+             requests observed and whether the timeouts were derived from them
+    """
+    counts = {phase: [0] * len(LATENCY_BOUNDS) for phase in PHASES}
+    for field, count in histogram.items():
+        phase, _, index = field.partition(":")
+        if phase in counts and index.isdigit() and int(index) < len(LATENCY_BOUNDS):
+            counts[phase][int(index)] += int(count)
+
+    percentiles = {phase: histogram_percentile(counts[phase], Config.TIMEOUT_PERCENTILE) for phase in PHASES}
+    result = {
+        "adaptive": False,
+        "samples": sum(counts["read"]),
+        "connect": min(default, Config.CONNECT_TIMEOUT_MAX),
+        "read": default,
+        "percentiles": percentiles,
+    }
+    if not Config.ADAPTIVE_TIMEOUTS or result["samples"] < Config.TIMEOUT_MIN_SAMPLES:
+        return result
+
+    result["adaptive"] = True
+    result["read"] = _clamp(percentiles["read"] * Config.TIMEOUT_FACTOR, Config.READ_TIMEOUT_MIN, Config.READ_TIMEOUT_MAX)
+    # Reused connections aren't measured, without enough connects the ceiling is used
+    if sum(counts["connect"]) >= Config.TIMEOUT_MIN_SAMPLES:
+        result["connect"] = _clamp(percentiles["connect"] * Config.TIMEOUT_FACTOR, Config.CONNECT_TIMEOUT_MIN, Config.CONNECT_TIMEOUT_MAX)
+    else:
+        result["connect"] = Config.CONNECT_TIMEOUT_MAX
+    return result
+
+class AdaptiveTimeouts:
+    """
+    Connect and read timeouts of a source, learned from the latencies of its requests.
+    Latencies are counted in a rolling histogram in Redis shared by every process. Each process adds its
+    observations and reloads the histogram every TIMEOUT_REFRESH_INTERVAL seconds, not for every request.
+
+    :param source: Name of the source
+    :param default: Read timeout in seconds used until enough requests were observed
+    """
+    def __init__(self, source: str, default: float):
+        self.source = source
+        self.default = default
+        self.pending = Counter()
+        self.values = derive_timeouts({}, default)
+        self.refreshed_at = 0.0
+
+    def observe(self, phase: str, seconds: float) -> None:
+        """
+        Counts the latency of a request's phase, added to the shared histogram with the next refresh.
+
+        :param phase: connect or read
+        :param seconds: Latency in seconds, for timed out requests the time until they timed out
+        """
+        self.pending[f"{phase}:{bucket_index(seconds)}"] += 1
+
+    async def get(self) -> tuple[float, float]:
+        """
+        Get the current timeouts, refreshed from the shared histogram if they are older than TIMEOUT_REFRESH_INTERVAL.
+
+        :return: Tuple of connect and read timeout in seconds
+        """
+        if time.monotonic() - self.refreshed_at >= Config.TIMEOUT_REFRESH_INTERVAL:
+            await self.refresh()
+        return self.values["connect"], self.values["read"]
+
+    async def refresh(self) -> None:
+        """ Adds the pending observations to the shared histogram and derives the timeouts from it. """
+        # Claimed before awaiting, so concurrent requests of the process don't refresh too
+        self.refreshed_at = time.monotonic()
+        pending, self.pending = self.pending, Counter()
+        keys = slot_keys(self.source, time.time())
+        pipeline = get_async_redis().pipeline(transaction=False)
+        for field, count in pending.items():
+            pipeline.hincrby(keys[0], field, count)
+        if pending:
+            pipeline.expire(keys[0], Config.TIMEOUT_WINDOW_SECONDS + SLOT_SECONDS)
+        for key in keys:
+            pipeline.hgetall(key)
+        try:
+            results = await pipeline.execute()
+        except RedisError as e:
+            # Timeouts are kept until the next refresh, a Redis outage shouldn't fail requests to the sources
+            logger.warning(f"Could not refresh the timeouts of {self.source}: {e}")
+            self.pending.update(pending)
+            return
+        self.values = derive_timeouts(merge_histograms(results[-len(keys):]), self.default)
+        for phase in PHASES:
+            SOURCE_TIMEOUT.labels(self.source, phase).set(self.values[phase])
+
+def merge_histograms(histograms: list[dict]) -> Counter:
+    """
+    Adds up the histograms of several slots.
+
+    :param histograms: List of dicts of field and count
+
+    :return: Counter of field and count
+    """
+    merged = Counter()
+    for histogram in histograms:
+        for field, count in histogram.items():
+            merged[field] += int(count)
+    return merged
+
+def get_source_timeouts(sources: dict[str, float]) -> dict[str, dict]:
+    """
+    Get the current timeouts of sources from the shared histograms, with one round trip.
+
+    :param sources: Dict of source name and its default read timeout
+
+    :return: Dict of source name and timeouts, see derive_timeouts
+    """
+    now = time.time()
+    keys = {source: slot_keys(source, now) for source in sources}
+    pipeline = redis_client.pipeline(transaction=False)
+    for source_keys in keys.values():
+        for key in source_keys:
+            pipeline.hgetall(key)
+    results = iter(pipeline.execute())
+    return {
+        source: derive_timeouts(merge_histograms([next(results) for _ in source_keys]), sources[source])
+        for source, source_keys in keys.items()
+    }
@@ -0,0 +1,157 @@
+from contextlib import nullcontext
+import json
+
+from app.config import Config
+from app.utils.logger import setup_logger
+
+logger = setup_logger(__name__)
+
+# Shared no-op context manager returned when tracing is disabled, keeps the disabled path allocation free
+_NOOP_SPAN = nullcontext()
+
+_tracer = None
+_memory_exporter = None
+
+def setup_tracing(service_name: str=None) -> None:
+    """
+    Configures OpenTelemetry tracing if enabled. Does nothing when tracing is disabled or OpenTelemetry is not installed.
+
+    :param service_name: Name of the service reported in spans, defaults to TRACING_SERVICE_NAME
+    """
+    global _tracer
+    if not Config.TRACING_ENABLED or _tracer is not None:
+        return
+
+    try:
+        from opentelemetry import trace
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+    except ImportError:
+        logger.warning("Tracing enabled but OpenTelemetry SDK is not installed, continuing without tracing")
+        return
+
+    provider = TracerProvider(
+        resource=Resource.create({"service.name": service_name or Config.TRACING_SERVICE_NAME}),
+        sampler=ParentBased(TraceIdRatioBased(Config.TRACING_SAMPLE_RATIO))
+    )
+    try:
+        provider.add_span_processor(create_span_processor(Config.TRACING_EXPORTER))
+    except ImportError as e:
+        logger.warning(f"Tracing exporter {Config.TRACING_EXPORTER} is not available, continuing without tracing: {e}")
+        return
+    trace.set_tracer_provider(provider)
+    _tracer = trace.get_tracer("threat-lense")
+    logger.info(f"Tracing enabled with {Config.TRACING_EXPORTER} exporter")
+
+def create_span_processor(exporter_name: str):
+    """
+    Creates a span processor for the configured exporter.
+
+    :param exporter_name: Exporter, either console, memory, file or otlp
+
+    :return: Span processor
+    :raises ValueError: If the exporter is not supported
+    """
+    global _memory_exporter
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter, SimpleSpanProcessor
+
+    if exporter_name == "memory":
+        from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+        _memory_exporter = InMemorySpanExporter()
+        return SimpleSpanProcessor(_memory_exporter)
+    elif exporter_name == "file":
+        return BatchSpanProcessor(JsonFileSpanExporter(Config.TRACING_FILE_PATH))
+    elif exporter_name == "console":
+        return BatchSpanProcessor(ConsoleSpanExporter())
+    elif exporter_name == "otlp":
+        # Endpoint and headers are configured with the standard OTEL_EXPORTER_OTLP_* variables
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        return BatchSpanProcessor(OTLPSpanExporter())
+    raise ValueError(f"Unsupported tracing exporter: {exporter_name}")
+
+def get_memory_exporter():
+    """
+    Get the in-memory exporter for inspecting finished spans locally.
+
+    :return: InMemorySpanExporter, None if the memory exporter is not in use
+    """
+    return _memory_exporter
+
+def is_tracing_enabled() -> bool:
+    """ Check if tracing has been set up. """
+    return _tracer is not None
+
+def start_span(name: str, attributes: dict=None, context=None):
+    """
+    Starts a span as the current span. Returns a shared no-op context manager when tracing is disabled.
+
+    :param name: Name of the span
+    :param attributes: Attributes added to the span
+    :param context: Parent context, defaults to the current context
+
+    :return: Context manager of the span
+    """
+    if _tracer is None:
+        return _NOOP_SPAN
+    return _tracer.start_as_current_span(name, context=context, attributes=attributes)
+
+def inject_context(carrier: dict) -> None:
+    """
+    Injects the current trace context to a carrier, such as message or HTTP headers.
+
+    :param carrier: Dict the context is written to
+    """
+    if _tracer is None:
+        return
+    from opentelemetry.propagate import inject
+    inject(carrier)
+
+def extract_context(carrier):
+    """
+    Extracts trace context from a carrier, such as message or HTTP headers.
+
+    :param carrier: Mapping the context is read from
+
+    :return: Extracted context, None when tracing is disabled
+    """
+    if _tracer is None or carrier is None:
+        return None
+    from opentelemetry.propagate import extract
+    return extract(carrier)
+
+def set_span_attribute(key: str, value) -> None:
+    """
+    Sets an attribute on the current span.
+
+    :param key: Attribute's name
+    :param value: Attribute's value
+    """
+    if _tracer is None:
+        return
+    from opentelemetry import trace
+    trace.get_current_span().set_attribute(key, value)
+
+class JsonFileSpanExporter:
+    """
+    Writes finished spans to a file as JSON lines. Meant for local testing without a collector.
+    """
+    def __init__(self, path: str):
+        self.path = path
+
+    def export(self, spans) -> "SpanExportResult":
+        from opentelemetry.sdk.trace.export import SpanExportResult
+        try:
+            with open(self.path, "a", encoding="utf-8") as f:
+                for span in spans:
+                    f.write(json.dumps(json.loads(span.to_json())) + "\n")
+        except OSError as e:
+            logger.error(f"Failed to write spans to {self.path}: {e}")
+            return SpanExportResult.FAILURE
+        return SpanExportResult.SUCCESS
+
+    def shutdown(self) -> None:
+        pass
+
+    def force_flush(self, timeout_millis: int=30000) -> bool:
+        return True
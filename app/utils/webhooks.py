@@ -0,0 +1,232 @@
+import asyncio
+from datetime import datetime, timezone
+import hashlib
+import hmac
+import ipaddress
+import json
+import socket
+import time
+from urllib.parse import urlsplit
+import weakref
+
+from app.config import Config
+from app.utils.cache import make_key, redis_client
+from app.utils.logger import setup_logger
+from app.utils.metrics import WEBHOOK_DELIVERIES
+
+import aiohttp
+from aiohttp.abc import AbstractResolver
+
+logger = setup_logger(__name__)
+
+SIGNATURE_HEADER = "X-Threat-Lense-Signature"
+EVENT_HEADER = "X-Threat-Lense-Event"
+DELIVERY_HEADER = "X-Threat-Lense-Delivery"
+# Deliveries that failed every attempt, newest first
+DEAD_LETTER_KEY = make_key("webhook", "dead_letter")
+# Responses worth retrying, other client errors won't change with another attempt
+RETRY_STATUSES = frozenset((408, 425, 429))
+
+class BlockedAddressError(aiohttp.ClientError):
+    """ Raised when a callback host is, or resolves to, an address callbacks may not be sent to. """
+    def __init__(self, host: str, address: str):
+        self.host = host
+        self.address = address
+        super().__init__(f"Callback host {host} resolves to a non-public address {address}")
+
+class WebhookDeliveryError(Exception):
+    """
+    Raised when a callback could not be delivered.
+
+    :param message: Reason the delivery failed
+    :param retryable: Whether another attempt could succeed
+    """
+    def __init__(self, message: str, retryable: bool=True):
+        self.retryable = retryable
+        super().__init__(message)
+
+def validate_callback_url(url) -> str:
+    """
+    Validates a callback URL given with a search.
+
+    :param url: Callback URL
+
+    :return: Callback URL
+    :raises ValueError: If the URL is not an http(s) URL or its host is not in WEBHOOK_ALLOWED_HOSTS,
+        or without an allowlist, if its host is a non-public IP address
+    """
+    if not isinstance(url, str):
+        raise ValueError("Callback URL must be a string")
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        raise ValueError(f"Invalid callback URL: {url}")
+    if Config.WEBHOOK_ALLOWED_HOSTS:
+        if parts.hostname.lower() not in Config.WEBHOOK_ALLOWED_HOSTS:
+            raise ValueError(f"Callback host not allowed: {parts.hostname}")
+    elif not is_public_address(parts.hostname, default=True):
+        raise ValueError(f"Callback host not allowed: {parts.hostname}")
+    return url
+
+def is_public_address(address: str, default: bool=False) -> bool:
+    """
+    Checks whether an IP address is publicly routable, so callbacks can't reach the services next to the app.
+    Loopback, private, link-local, reserved, multicast and unspecified addresses aren't.
+
+    :param address: IP address
+    :param default: Result if address is not an IP address, e.g. a hostname
+
+    :return: True if the address is public
+    """
+    try:
+        ip = ipaddress.ip_address(address.split("%", 1)[0])
+    except ValueError:
+        return default
+    if ip.version == 6 and ip.ipv4_mapped:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+class PublicAddressResolver(AbstractResolver):
+    """
+    Resolver refusing hosts that resolve to a non-public address, checked at connection time so hosts can't
+    be pointed at internal services after the callback URL was validated.
+    """
+    def __init__(self):
+        self.resolver = aiohttp.DefaultResolver()
+
+    async def resolve(self, host: str, port: int=0, family: socket.AddressFamily=socket.AF_INET) -> list[dict]:
+        addresses = await self.resolver.resolve(host, port, family)
+        for address in addresses:
+            if not is_public_address(address["host"]):
+                raise BlockedAddressError(host, address["host"])
+        return addresses
+
+    async def close(self) -> None:
+        await self.resolver.close()
+
+def sign_payload(body: bytes, timestamp: int, secret: str) -> str:
+    """
+    Signs a callback body with HMAC-SHA256. The timestamp is signed too, so receivers can reject replayed deliveries.
+
+    :param body: Body of the callback
+    :param timestamp: Unix time of the delivery attempt
+    :param secret: Shared secret, WEBHOOK_SECRET
+
+    :return: Value of the signature header, t=<timestamp>,v1=<hex digest of "<timestamp>.<body>">
+    """
+    digest = hmac.new(secret.encode("utf-8"), str(timestamp).encode("ascii") + b"." + body, hashlib.sha256).hexdigest()
+    return f"t={timestamp},v1={digest}"
+
+# HTTP sessions of the event loops, sessions can't be shared between loops
+_sessions = weakref.WeakKeyDictionary()
+
+def get_http_session() -> aiohttp.ClientSession:
+    """
+    Get the HTTP session of the running event loop, so callbacks reuse pooled connections to the receivers.
+
+    :return: Session
+    """
+    loop = asyncio.get_running_loop()
+    session = _sessions.get(loop)
+    if session is None or session.closed:
+        # Without an allowlist any host is accepted, as long as it resolves to public addresses
+        resolver = PublicAddressResolver() if not Config.WEBHOOK_ALLOWED_HOSTS else None
+        session = _sessions[loop] = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=Config.WEBHOOK_MAX_CONNECTIONS, resolver=resolver),
+            timeout=aiohttp.ClientTimeout(total=Config.WEBHOOK_TIMEOUT),
+        )
+    return session
+
+async def close_http_session() -> None:
+    """ Closes the HTTP session of the running event loop and its pooled connections. """
+    session = _sessions.pop(asyncio.get_running_loop(), None)
+    if session is not None:
+        await session.close()
+
+async def deliver_webhook(url: str, event: str, body: str, delivery_id: str) -> None:
+    """
+    POSTs a callback once, signed with WEBHOOK_SECRET if one is configured.
+
+    :param url: Callback URL
+    :param event: Event name, e.g. search.completed
+    :param body: JSON body
+    :param delivery_id: ID of the delivery, the same for every attempt so receivers can drop duplicates
+
+    :raises WebhookDeliveryError: If the request failed or wasn't answered with a 2xx status
+    """
+    data = body.encode("utf-8")
+    headers = {"Content-Type": "application/json", EVENT_HEADER: event, DELIVERY_HEADER: delivery_id}
+    if Config.WEBHOOK_SECRET:
+        headers[SIGNATURE_HEADER] = sign_payload(data, int(time.time()), Config.WEBHOOK_SECRET)
+    try:
+        validate_callback_url(url)
+    except ValueError as e:
+        raise WebhookDeliveryError(str(e), retryable=False)
+    try:
+        # Redirects aren't followed, they could lead to hosts the URL was not validated for
+        async with get_http_session().post(url, data=data, headers=headers, allow_redirects=False) as response:
+            if response.status >= 300:
+                raise WebhookDeliveryError(f"Callback answered with status {response.status}",
+                                           retryable=response.status >= 500 or response.status in RETRY_STATUSES)
+    except BlockedAddressError as e:
+        raise WebhookDeliveryError(str(e), retryable=False)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise WebhookDeliveryError(f"Callback request failed: {type(e).__name__} {e}")
+    WEBHOOK_DELIVERIES.labels(event=event, outcome="delivered").inc()
+
+def retry_delay(attempt: int) -> float:
+    """
+    Get the delay before retrying a failed delivery, doubling with every attempt.
+
+    :param attempt: Number of the failed attempt, starting at 1
+
+    :return: Delay in seconds
+    """
+    return Config.WEBHOOK_RETRY_BACKOFF * 2 ** (attempt - 1)
+
+def dead_letter(url: str, event: str, body: str, delivery_id: str, attempts: int, error: str) -> None:
+    """
+    Keeps a delivery that failed every attempt, the newest WEBHOOK_DEAD_LETTER_SIZE are kept.
+
+    :param url: Callback URL
+    :param event: Event name
+    :param body: JSON body
+    :param delivery_id: ID of the delivery
+    :param attempts: Number of attempts made
+    :param error: Error of the last attempt
+    """
+    logger.warning(f"Giving up on callback {delivery_id} to {url} after {attempts} attempts: {error}")
+    WEBHOOK_DELIVERIES.labels(event=event, outcome="dead_lettered").inc()
+    entry = json.dumps({
+        "delivery_id": delivery_id,
+        "url": url,
+        "event": event,
+        "body": body,
+        "attempts": attempts,
+        "error": error,
+        "failed_at": str(datetime.now(timezone.utc)),
+    })
+    pipeline = redis_client.pipeline()
+    pipeline.lpush(DEAD_LETTER_KEY, entry)
+    pipeline.ltrim(DEAD_LETTER_KEY, 0, Config.WEBHOOK_DEAD_LETTER_SIZE - 1)
+    pipeline.execute()
+
+def get_dead_letters(offset: int=0, limit: int=100) -> list[dict]:
+    """
+    Get a page of the failed deliveries, newest first.
+
+    :param offset: Index of the first delivery
+    :param limit: Maximum number of deliveries
+
+    :return: List of failed deliveries
+    """
+    return [json.loads(entry) for entry in redis_client.lrange(DEAD_LETTER_KEY, offset, offset + limit - 1)]
+
+def pop_dead_letters(count: int) -> list[dict]:
+    """
+    Removes the oldest failed deliveries, to deliver them again.
+
+    :param count: Maximum number of deliveries
+
+    :return: List of failed deliveries, oldest first
+    """
+    return [json.loads(entry) for entry in redis_client.rpop(DEAD_LETTER_KEY, count) or []]
@@ -0,0 +1,116 @@
+"""
+Benchmark of the concurrency governor with a bulk job and interactive lookups sharing a worker process.
+
+Runs many bulk searches at once while interactive searches are made one after another, querying every
+applicable source like main_task does, first with limits too high to apply and then with the configured
+limits. Reports the interactive searches' latency, bulk throughput and the most requests the stand-ins
+answered at once, i.e. the sockets the worker held open.
+
+Examples:
+    python -m benchmarks.bench_concurrency
+    python -m benchmarks.bench_concurrency --bulk 3000 --bulk-concurrency 1000 --max-concurrent 100 --per-host 25 --latency-ms 200
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from benchmarks.common import generate_indicators, prepare_environment, summarize_latencies, write_report
+from benchmarks.mock_providers import MockProviders, MockProviderServer, add_behaviour_arguments, behaviours_from_args, source_base_urls
+
+async def search(indicator: str, priority: str) -> None:
+    """ Queries every source supporting the indicator at once, as main_task does. """
+    from app.utils.concurrency import set_request_flow
+    from app.utils.indicator_type import get_indicator_type
+    from app.utils.source_registry import SourceRegistry
+
+    set_request_flow(indicator, priority)
+    indicator_type = get_indicator_type(indicator)
+    sources = SourceRegistry.get_sources_for(indicator_type, None, None).values()
+    await asyncio.gather(*(source.fetch_intel(indicator, indicator_type, "benchmark-key") for source in sources))
+
+async def run_workload(bulk: list[str], bulk_concurrency: int, interactive: list[str], interval: float) -> tuple[float, list[float]]:
+    """
+    Runs the bulk searches bulk_concurrency at a time, and the interactive searches one after another while they run.
+
+    :return: Tuple of the bulk searches' duration and the interactive searches' latencies
+    """
+    queue = asyncio.Queue()
+    for indicator in bulk:
+        queue.put_nowait(indicator)
+    latencies = []
+
+    async def bulk_worker():
+        while not queue.empty():
+            # Each search runs in its own task, like the search tasks of a bulk job
+            await asyncio.create_task(search(queue.get_nowait(), "bulk"))
+
+    async def interactive_worker():
+        # Starts once the bulk searches fill the limits
+        await asyncio.sleep(interval)
+        for indicator in interactive:
+            start = time.perf_counter()
+            await asyncio.create_task(search(indicator, "interactive"))
+            latencies.append(time.perf_counter() - start)
+            await asyncio.sleep(interval)
+
+    start = time.perf_counter()
+    interactive_task = asyncio.create_task(interactive_worker())
+    await asyncio.gather(*(bulk_worker() for _ in range(bulk_concurrency)))
+    duration = time.perf_counter() - start
+    await interactive_task
+    return duration, latencies
+
+def run_mode(governed: bool, args, providers: MockProviders) -> dict:
+    """ Runs the workload with the configured limits, or with limits too high to apply. """
+    from app.config import Config
+
+    unlimited = 10 ** 6
+    Config.MAX_CONCURRENT_REQUESTS = args.max_concurrent if governed else unlimited
+    Config.MAX_CONCURRENT_REQUESTS_PER_HOST = args.per_host if governed else unlimited
+    providers.reset_stats()
+    bulk = generate_indicators(args.bulk, ("ipv4", "domain", "hash"))
+    interactive = generate_indicators(args.interactive, ("ipv4", "domain", "hash"))
+    # A new event loop per mode, so the governor is created with the mode's limits
+    duration, latencies = asyncio.run(run_workload(bulk, args.bulk_concurrency, interactive, args.interval_ms / 1000))
+    stats = providers.get_stats()
+    return {
+        "limits": {"process": Config.MAX_CONCURRENT_REQUESTS, "per_host": Config.MAX_CONCURRENT_REQUESTS_PER_HOST} if governed else None,
+        "bulk_searches_per_s": round(args.bulk / duration, 1),
+        "interactive_latency_ms": summarize_latencies(latencies),
+        "upstream_requests": stats["total_requests"],
+        "peak_upstream_in_flight": stats["peak_in_flight"],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare interactive latency and open requests with and without the concurrency governor")
+    parser.add_argument("--bulk", type=int, default=2000, help="Bulk searches")
+    parser.add_argument("--bulk-concurrency", type=int, default=500, help="Bulk searches running at once")
+    parser.add_argument("--interactive", type=int, default=30, help="Interactive searches made while the bulk searches run")
+    parser.add_argument("--interval-ms", type=float, default=100, help="Pause between interactive searches in milliseconds")
+    parser.add_argument("--max-concurrent", type=int, default=100, help="Requests in flight per process, MAX_CONCURRENT_REQUESTS")
+    parser.add_argument("--per-host", type=int, default=25, help="Requests in flight per host, MAX_CONCURRENT_REQUESTS_PER_HOST. "
+                                                                 "The stand-ins share one host, the process limit applies first with the default.")
+    parser.add_argument("--output", help="Write the report to a JSON file")
+    add_behaviour_arguments(parser)
+    args = parser.parse_args()
+
+    default, behaviours = behaviours_from_args(args)
+    providers = MockProviders(behaviours, default)
+    server = MockProviderServer(providers).start()
+    # Hedging would add requests in the ungoverned run only, when the bulk searches slow every provider down
+    os.environ.setdefault("HEDGE_BUDGET_RATIO", "0")
+    os.environ.setdefault("LOG_LEVEL", "CRITICAL")
+    prepare_environment(source_base_urls(server.base_url), fake_redis=True)
+    try:
+        report = {
+            "config": {key: value for key, value in vars(args).items() if key not in ("output", "provider_behaviour")},
+            "ungoverned": run_mode(False, args, providers),
+            "governed": run_mode(True, args, providers),
+        }
+    finally:
+        server.stop()
+    write_report(report, args.output)
+
+if __name__ == "__main__":
+    main()
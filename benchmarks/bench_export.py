@@ -0,0 +1,101 @@
+"""
+Benchmark of streaming bulk job exports.
+
+Stores finished search results of bulk jobs of several sizes in an in-process fake Redis, streams each job's export
+in every available format through the web app and reports the throughput, output size and peak memory
+allocated while exporting. The peak should stay flat as the jobs grow.
+
+Examples:
+    python -m benchmarks.bench_export
+    python -m benchmarks.bench_export --sizes 10000,100000 --sources 8 --formats ndjson,parquet --output export.json
+"""
+import argparse
+import time
+import tracemalloc
+import uuid
+
+from benchmarks.common import generate_indicators, prepare_environment, write_report
+
+VERDICTS = ("BENIGN", "SUSPICIOUS", "MALICIOUS", "NONE")
+
+def create_job(size: int, sources: int) -> str:
+    """ Creates a bulk job with a stored result of every source for each indicator. """
+    from app.tasks import search_task
+    from app.utils.bulk_jobs import CHUNK_SIZE, add_job_tasks, create_bulk_job
+
+    indicators = generate_indicators(size, seed=size)
+    job_id = create_bulk_job(indicators, "bulk")
+    backend = search_task.backend
+    for start in range(0, size, CHUNK_SIZE):
+        task_ids = []
+        for i, indicator in enumerate(indicators[start:start + CHUNK_SIZE], start):
+            task_id = str(uuid.uuid4())
+            result = {
+                "indicator": indicator,
+                "type": "IPv4",
+                "sources": {
+                    f"Source {n}": {"summary": f"{n}/90 detections", "verdict": VERDICTS[(i + n) % len(VERDICTS)], "url": f"https://example.com/{i}/{n}", "data": {}}
+                    for n in range(sources)
+                },
+            }
+            if i % 2:
+                result["cache"] = {"stale": False, "age": 60}
+            backend.store_result(task_id, result, "SUCCESS")
+            task_ids.append(task_id)
+        add_job_tasks(job_id, task_ids)
+    return job_id
+
+def export(client, job_id: str, file_format: str, traced: bool=False) -> tuple[float, int, float | None]:
+    """
+    Streams the job's export, reading the response chunk by chunk like a client would.
+
+    :param traced: Trace the memory allocated, which slows the export down
+
+    :return: Tuple of seconds, bytes and peak memory allocated in megabytes if traced
+    """
+    if traced:
+        tracemalloc.start()
+    start = time.perf_counter()
+    response = client.get(f"/search/bulk/{job_id}/export?format={file_format}", buffered=False)
+    size = sum(len(chunk) for chunk in response.response)
+    duration = time.perf_counter() - start
+    response.close()
+    if not traced:
+        return duration, size, None
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return duration, size, peak / (1024 * 1024)
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure throughput and memory of streaming bulk job exports")
+    parser.add_argument("--sizes", default="5000,20000", help="Comma separated numbers of indicators of the exported jobs")
+    parser.add_argument("--sources", type=int, default=8, help="Sources with a result per indicator")
+    parser.add_argument("--formats", help="Comma separated formats, every available format by default")
+    parser.add_argument("--output", help="Write the report to a JSON file")
+    args = parser.parse_args()
+
+    prepare_environment(fake_redis=True)
+    from app import create_app
+    from app.utils.export import available_formats
+
+    client = create_app().test_client()
+    formats = args.formats.split(",") if args.formats else available_formats()
+    report = {"config": {"sources": args.sources, "formats": formats}, "jobs": {}}
+    for size in map(int, args.sizes.split(",")):
+        job_id = create_job(size, args.sources)
+        rows = size * args.sources
+        results = {}
+        for file_format in formats:
+            duration, output_bytes, _ = export(client, job_id, file_format)
+            _, _, peak = export(client, job_id, file_format, traced=True)
+            results[file_format] = {
+                "seconds": round(duration, 3),
+                "rows_per_s": round(rows / duration),
+                "output_mb": round(output_bytes / (1024 * 1024), 2),
+                "peak_memory_mb": round(peak, 2),
+            }
+        report["jobs"][size] = {"rows": rows, "formats": results}
+    write_report(report, args.output)
+
+if __name__ == "__main__":
+    main()
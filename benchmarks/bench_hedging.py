@@ -0,0 +1,97 @@
+"""
+Benchmark of hedged requests to the free sources without quotas (Tranco, ThreatMiner and StopForumSpam).
+
+Looks indicators up with each source's fetch_intel against stand-ins where a share of the requests is slow,
+first without and then with hedging, and reports the latency percentiles per source and the extra upstream
+requests hedging sent.
+
+Examples:
+    python -m benchmarks.bench_hedging
+    python -m benchmarks.bench_hedging --lookups 2000 --slow-rate 0.02 --slow-ms 2000 --budget-ratio 0.05 --output hedging.json
+"""
+import argparse
+import asyncio
+import time
+
+from benchmarks.common import prepare_environment, generate_indicators, summarize_latencies, write_report
+from benchmarks.mock_providers import MockProviders, MockProviderServer, add_behaviour_arguments, behaviours_from_args, source_base_urls
+
+# Hedged sources, their stand-in and an indicator type they support
+SOURCES = {
+    "TrancoListSource": ("tranco", "domain"),
+    "ThreatMinerSource": ("threatminer", "ipv4"),
+    "StopForumSpamSource": ("stopforumspam", "ipv4"),
+}
+
+async def run_lookups(source, indicators: list[str], concurrency: int) -> list[float]:
+    """ Looks the indicators up with the source, concurrency at a time, and returns their latencies. """
+    from app.utils.indicator_type import get_indicator_type
+
+    queue = asyncio.Queue()
+    for indicator in indicators:
+        queue.put_nowait(indicator)
+    latencies = []
+
+    async def worker():
+        while not queue.empty():
+            indicator = queue.get_nowait()
+            start = time.perf_counter()
+            await source.fetch_intel(indicator, get_indicator_type(indicator))
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies
+
+def run_mode(hedged: bool, providers: MockProviders, lookups: int, concurrency: int, budget_ratio: float) -> dict:
+    """ Runs the lookups of every hedged source, with or without hedging. """
+    from app.config import Config
+    from app.utils import hedging
+    from app.utils.hedging import HedgeBudget, LatencyTracker
+    from app.utils.source_registry import SourceRegistry
+
+    hedging.budget = HedgeBudget(budget_ratio if hedged else 0, Config.HEDGE_BUDGET_BURST)
+    report = {}
+    for name, (provider, indicator_type) in SOURCES.items():
+        source = SourceRegistry.get_instance()[name]
+        source.hedged = hedged
+        source.latency = LatencyTracker(Config.HEDGE_LATENCY_WINDOW, Config.HEDGE_MIN_SAMPLES)
+        providers.reset_stats()
+        latencies = asyncio.run(run_lookups(source, generate_indicators(lookups, (indicator_type,)), concurrency))
+        upstream = providers.get_stats()["requests"].get(provider, 0)
+        report[source.get_name()] = {
+            "latency_ms": summarize_latencies(latencies),
+            "upstream_requests": upstream,
+            "extra_requests": round(upstream / lookups - 1, 4),
+        }
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the tail latency of the free sources with and without hedged requests")
+    parser.add_argument("--lookups", type=int, default=1000, help="Lookups per source and mode")
+    parser.add_argument("--concurrency", type=int, default=10, help="Lookups in flight per source")
+    parser.add_argument("--budget-ratio", type=float, default=0.05, help="Hedged requests allowed per request, HEDGE_BUDGET_RATIO")
+    parser.add_argument("--output", help="Write the report to a JSON file")
+    add_behaviour_arguments(parser)
+    parser.set_defaults(slow_rate=0.03, slow_ms=1000)
+    args = parser.parse_args()
+
+    default, behaviours = behaviours_from_args(args)
+    providers = MockProviders(behaviours, default)
+    server = MockProviderServer(providers).start()
+    prepare_environment(source_base_urls(server.base_url), fake_redis=True)
+    try:
+        report = {
+            "config": {key: value for key, value in vars(args).items() if key not in ("output", "provider_behaviour")},
+            "unhedged": run_mode(False, providers, args.lookups, args.concurrency, args.budget_ratio),
+            "hedged": run_mode(True, providers, args.lookups, args.concurrency, args.budget_ratio),
+        }
+    finally:
+        server.stop()
+    report["p99_reduction"] = {
+        name: round(1 - report["hedged"][name]["latency_ms"]["p99"] / report["unhedged"][name]["latency_ms"]["p99"], 3)
+        for name in report["hedged"] if report["unhedged"][name]["latency_ms"].get("p99")
+    }
+    write_report(report, args.output)
+
+if __name__ == "__main__":
+    main()
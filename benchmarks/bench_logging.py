@@ -0,0 +1,168 @@
+"""
+Benchmark of the logging overhead per lookup.
+
+Replays the log calls a cache miss makes, from the request through the cache layer to every source, and measures
+the time the caller spends logging, which blocks the event loop in the workers. Writes can be slowed down with
+--write-latency-us, like stdout piped to a busy logging driver. Modes:
+- sync: the previous setup, a stdout handler per logger formatting and writing in the caller, f-string messages at INFO
+- queue: records put on the logging queue and written by the listener thread, hot path details at DEBUG
+- queue-sampled: queue, with per-indicator messages sampled at --sample-rate
+
+Examples:
+    python -m benchmarks.bench_logging
+    python -m benchmarks.bench_logging --lookups 50000 --sources 8 --sample-rate 0.01 --output logging.json
+    python -m benchmarks.bench_logging --write-latency-us 100
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+from benchmarks.common import percentile, write_report
+
+MODES = ("sync", "queue", "queue-sampled")
+
+class SlowStream:
+    """ Stream taking latency seconds for every write. """
+    def __init__(self, stream, latency: float):
+        self.stream = stream
+        self.latency = latency
+
+    def write(self, text: str) -> int:
+        if self.latency:
+            time.sleep(self.latency)
+        return self.stream.write(text)
+
+    def flush(self) -> None:
+        self.stream.flush()
+
+def sync_loggers(names: list[str], stream) -> dict[str, logging.Logger]:
+    """ Loggers set up like before the logging queue, each with its own handler writing in the caller. """
+    loggers = {}
+    for name in names:
+        logger = logging.getLogger(f"bench.sync.{name}")
+        logger.setLevel(logging.INFO)
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+        logger.addHandler(handler)
+        logger.propagate = False
+        loggers[name] = logger
+    return loggers
+
+def sync_lookup(loggers: dict, indicator: str, key: str, sources: list[str]) -> None:
+    """ Log calls of a cache miss before the logging queue. """
+    loggers["routes"].info("GET request for /search")
+    loggers["routes"].info(f"Received /search, with indicator: {indicator}")
+    loggers["tasks"].info(f"Starting search task for {indicator}")
+    loggers["cache"].info(f"Creating cache key for {indicator}")
+    loggers["cache"].info(f"Fetching results from Redis for key: {key}")
+    loggers["tasks"].info(f"No cached result found for {indicator}, proceeding to searching")
+    loggers["tasks"].debug("Indicator type: IPv4")
+    loggers["tasks"].debug(f"Scheduling {len(sources)}/{len(sources)} applicable sources, 0 found from the database")
+    for source in sources:
+        loggers["sources"].debug(f"Fetching intel for {indicator}, for {source}")
+        loggers["sources"].debug(f"Sending request to https://{source}/{indicator}, attempt 1/3")
+    loggers["cache"].info(f"Caching data to redis with key: {key}")
+
+def queue_lookup(loggers: dict, indicator: str, key: str, sources: list[str]) -> None:
+    """ Log calls of a cache miss with the logging queue. """
+    loggers["requests"].info("%s request for %s", "GET", "/search")
+    loggers["requests"].info("Received /search, with indicator: %s", indicator)
+    loggers["indicators"].info("Starting search task for %s", indicator)
+    loggers["cache"].debug("Creating cache key for %s", indicator)
+    loggers["cache"].debug("Fetching results from Redis for key: %s", key)
+    loggers["indicators"].info("No cached result found for %s, proceeding to searching", indicator)
+    loggers["tasks"].debug("Indicator type: %s", "IPv4")
+    loggers["tasks"].debug("Scheduling %d/%d applicable sources, %d found from the database", len(sources), len(sources), 0)
+    for source in sources:
+        loggers["sources"].debug("Fetching intel for %s, for %s", indicator, source)
+        loggers["sources"].debug("Sending request to %s, attempt %d/%d", f"https://{source}/{indicator}", 1, 3)
+    loggers["cache"].debug("Caching data to redis with key: %s", key)
+
+def run(mode: str, args, stream) -> dict:
+    """
+    Runs the lookups of one mode.
+
+    :return: Dict of caller time per lookup and the time until every record was written
+    """
+    from app.utils import logger as app_logging
+    from app.utils.metrics import LOG_RECORDS_DROPPED
+
+    sources = [f"source{i}" for i in range(args.sources)]
+    if mode == "sync":
+        loggers = sync_loggers(["routes", "tasks", "cache", "sources"], stream)
+        lookup = sync_lookup
+    else:
+        tasks_logger = app_logging.setup_logger(f"bench.{mode}.tasks", logging.INFO)
+        routes_logger = app_logging.setup_logger(f"bench.{mode}.routes", logging.INFO)
+        rate = args.sample_rate if mode == "queue-sampled" else 1.0
+        loggers = {
+            "requests": app_logging.sampled(routes_logger, rate),
+            "indicators": app_logging.sampled(tasks_logger, rate),
+            "tasks": tasks_logger,
+            "cache": app_logging.setup_logger(f"bench.{mode}.cache", logging.INFO),
+            "sources": app_logging.setup_logger(f"bench.{mode}.sources", logging.INFO),
+        }
+        lookup = queue_lookup
+
+    dropped_before = LOG_RECORDS_DROPPED._value.get()
+    durations = []
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    for i in range(args.lookups):
+        indicator = f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"
+        key = f"tl:search:v1:IPv4:{i:032x}"
+        call_start = time.perf_counter()
+        lookup(loggers, indicator, key, sources)
+        durations.append(time.perf_counter() - call_start)
+    caller_time = time.perf_counter() - start
+    # Waits until the listener wrote everything
+    if mode != "sync":
+        app_logging.flush_logs()
+    stream.flush()
+    total_time = time.perf_counter() - start
+    cpu_time = time.process_time() - cpu_start
+
+    return {
+        "caller_us_per_lookup": round(caller_time / args.lookups * 1e6, 2),
+        "caller_p99_us": round(percentile(durations, 99) * 1e6, 2),
+        "caller_max_us": round(max(durations) * 1e6, 2),
+        "cpu_us_per_lookup": round(cpu_time / args.lookups * 1e6, 2),
+        "drained_s": round(total_time, 3),
+        "dropped_records": int(LOG_RECORDS_DROPPED._value.get() - dropped_before),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the logging overhead per lookup")
+    parser.add_argument("--lookups", type=int, default=20000, help="Lookups replayed per mode")
+    parser.add_argument("--sources", type=int, default=8, help="Sources queried per lookup")
+    parser.add_argument("--sample-rate", type=float, default=0.01, help="Share of per-indicator messages written in queue-sampled mode, LOG_SAMPLE_RATE")
+    parser.add_argument("--log-file", default=os.devnull, help="File the logs are written to, stdout of the services")
+    parser.add_argument("--write-latency-us", type=float, default=0, help="Microseconds every write to the log file takes")
+    parser.add_argument("--modes", default=",".join(MODES), help=f"Comma separated modes: {', '.join(MODES)}")
+    parser.add_argument("--output", help="Write the report to a JSON file")
+    args = parser.parse_args()
+
+    modes = [name.strip() for name in args.modes.split(",") if name.strip()]
+    for name in modes:
+        if name not in MODES:
+            parser.error(f"Unknown mode: {name}")
+
+    # The app's log handler writes to the stdout it finds on import
+    stdout = sys.stdout
+    with open(args.log_file, "w", encoding="utf-8") as log_file:
+        sys.stdout = stream = SlowStream(log_file, args.write_latency_us / 1e6)
+        try:
+            results = {name: run(name, args, stream) for name in modes}
+        finally:
+            sys.stdout = stdout
+
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "modes")},
+        "modes": results,
+    }
+    write_report(report, args.output)
+
+if __name__ == "__main__":
+    main()
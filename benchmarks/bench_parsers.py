@@ -0,0 +1,183 @@
+"""
+Micro-benchmark of the sources' parsers on the recorded responses of benchmarks/fixtures.
+
+Every recorded response is replayed through each phase of a lookup after the request, without any network:
+    fetch: the whole lookup with SOURCE_FIXTURES_MODE=replay, fetch_intel down to http_request answered by the fixture
+    decode: reading and parsing the body, skipping the source's excluded fields
+    parse: the source's parse_intel, including format_response
+    serialize: JSON encoding of the result, as it is cached and returned
+Reports calls per second of every phase and the peak memory allocated per lookup for each source, and its slowest response,
+so parser regressions and pathological large payloads show up. Parsers failing on a recorded response fail the run.
+
+Examples:
+    python -m benchmarks.bench_parsers
+    python -m benchmarks.bench_parsers --sources VirusTotalSource,MaltiverseSource --min-time 1 --output parsers.json
+
+    # Fail if any phase of a source got more than 20 % slower, or its peak memory 20 % larger, than in a saved report
+    python -m benchmarks.bench_parsers --output current.json --baseline baseline.json --max-regression 0.2
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+import tracemalloc
+
+from benchmarks.common import prepare_environment, write_report
+
+PHASES = ("fetch", "decode", "parse", "serialize")
+
+async def run_phases(source, key: str, recorded: dict) -> dict:
+    """
+    Runs every phase once on a recorded response.
+
+    :return: Dict of phases and their results, phases after a failed request are left out
+    """
+    from app.utils.enums import IndicatorType
+    from app.utils.fixtures import to_response
+
+    results = {"fetch": await source.fetch_intel(recorded["indicator"], IndicatorType[recorded["indicator_type"]], "benchmark-key")}
+    # Error responses are handled by the sources' fetch methods, only successful ones are parsed
+    if recorded["status"] < 400:
+        results["decode"] = await source.read_response(to_response(recorded, method=key.split(" ", 1)[0]))
+        results["parse"] = source.parse_intel(results["decode"])
+        results["serialize"] = json.dumps(results["parse"])
+    return results
+
+async def time_phase(source, key: str, recorded: dict, phase: str, min_time: float) -> tuple[int, float]:
+    """
+    Repeats a phase on a recorded response for at least min_time seconds.
+
+    :return: Tuple of calls and seconds they took
+    """
+    from app.utils.enums import IndicatorType
+    from app.utils.fixtures import to_response
+
+    method = key.split(" ", 1)[0]
+    indicator_type = IndicatorType[recorded["indicator_type"]]
+    data = await source.read_response(to_response(recorded, method=method)) if phase in ("parse", "serialize") else None
+    result = source.parse_intel(data) if phase == "serialize" else None
+    calls, elapsed = 0, 0.0
+    while elapsed < min_time:
+        start = time.perf_counter()
+        for _ in range(10):
+            if phase == "fetch":
+                await source.fetch_intel(recorded["indicator"], indicator_type, "benchmark-key")
+            elif phase == "decode":
+                # The response is built outside of the parsers too, from the recorded body
+                await source.read_response(to_response(recorded, method=method))
+            elif phase == "parse":
+                source.parse_intel(data)
+            else:
+                json.dumps(result)
+        elapsed += time.perf_counter() - start
+        calls += 10
+    return calls, elapsed
+
+async def trace_lookup(source, key: str, recorded: dict) -> float:
+    """ Peak memory in kilobytes allocated while a recorded response is decoded, parsed and serialized. """
+    tracemalloc.start()
+    try:
+        await run_phases(source, key, recorded)
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+async def bench_source(source, responses: dict[str, dict], min_time: float) -> dict:
+    """ Measures every phase on each of the source's recorded responses. """
+    totals = {phase: [0, 0.0] for phase in PHASES}
+    errors = []
+    slowest = None
+    peak_kb = 0.0
+    body_bytes = 0
+    for key, recorded in responses.items():
+        try:
+            phases = await run_phases(source, key, recorded)
+        except Exception as e:
+            errors.append({"key": key, "error": f"{type(e).__name__}: {e}"})
+            continue
+        # fetch_intel logs and drops exceptions of the parsers
+        if recorded["status"] < 400 and (not phases["fetch"] or phases["fetch"].get("summary") == "error"):
+            errors.append({"key": key, "error": phases["fetch"]["data"]["message"] if phases["fetch"] else "No result"})
+            continue
+        size = len(json.dumps(recorded["json"]) if "json" in recorded else recorded.get("text", ""))
+        body_bytes += size
+        fixture = {"key": key, "bytes": size}
+        for phase in phases:
+            calls, elapsed = await time_phase(source, key, recorded, phase, min_time)
+            totals[phase][0] += calls
+            totals[phase][1] += elapsed
+            fixture[f"{phase}_us"] = round(elapsed / calls * 1_000_000, 1)
+        fixture["peak_kb"] = round(await trace_lookup(source, key, recorded), 1)
+        peak_kb = max(peak_kb, fixture["peak_kb"])
+        if slowest is None or fixture["fetch_us"] > slowest["fetch_us"]:
+            slowest = fixture
+    return {
+        "responses": len(responses),
+        "body_bytes": body_bytes,
+        **{f"{phase}_per_s": round(calls / elapsed) if elapsed else None for phase, (calls, elapsed) in totals.items()},
+        "peak_kb": round(peak_kb, 1),
+        "slowest": slowest,
+        "errors": errors,
+    }
+
+def compare_parsers(report: dict, baseline_path: str, max_regression: float) -> list[str]:
+    """
+    Compares each source's calls per second of every phase and peak memory to a previously written report.
+
+    :return: List of regressions, empty if none
+    """
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    regressions = []
+    for name, current in report["sources"].items():
+        previous = baseline.get("sources", {}).get(name)
+        if not previous:
+            continue
+        for phase in PHASES:
+            now, before = current.get(f"{phase}_per_s"), previous.get(f"{phase}_per_s")
+            if now and before and now < before * (1 - max_regression):
+                regressions.append(f"{name} {phase} {now}/s, baseline {before}/s")
+        if previous.get("peak_kb") and current["peak_kb"] > previous["peak_kb"] * (1 + max_regression):
+            regressions.append(f"{name} peak memory {current['peak_kb']} KB, baseline {previous['peak_kb']} KB")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the sources' parsers on recorded responses")
+    parser.add_argument("--fixtures", default="benchmarks/fixtures", help="Directory of the recorded responses, see benchmarks.record_fixtures")
+    parser.add_argument("--sources", help="Comma separated source class names, every source with recorded responses by default")
+    parser.add_argument("--min-time", type=float, default=0.1, help="Seconds each phase is repeated per recorded response")
+    parser.add_argument("--output", help="Write the report to a JSON file")
+    parser.add_argument("--baseline", help="Report to compare to, regressions fail the run")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed relative regression compared to the baseline")
+    args = parser.parse_args()
+
+    os.environ["SOURCE_FIXTURES_MODE"] = "replay"
+    os.environ["SOURCE_FIXTURES_DIR"] = args.fixtures
+    # Failed lookups are reported, not logged
+    os.environ.setdefault("LOG_LEVEL", "CRITICAL")
+    prepare_environment(fake_redis=True)
+    from app.utils.fixtures import get_fixture_store
+    from app.utils.source_registry import SourceRegistry
+
+    store = get_fixture_store()
+    sources = SourceRegistry.get_instance()
+    names = args.sources.split(",") if args.sources else [name for name in sources if store.responses(name)]
+    report = {"config": {"fixtures": args.fixtures, "min_time": args.min_time}, "sources": {}}
+    for name in names:
+        report["sources"][name] = asyncio.run(bench_source(sources[name], store.responses(name), args.min_time))
+    write_report(report, args.output)
+
+    failures = [f"{name} {error['key']}: {error['error']}" for name, result in report["sources"].items() for error in result["errors"]]
+    if failures:
+        print("Parsers failed on recorded responses:\n  " + "\n  ".join(failures))
+        raise SystemExit(1)
+    if args.baseline:
+        regressions = compare_parsers(report, args.baseline, args.max_regression)
+        if regressions:
+            print("Regressions compared to baseline:\n  " + "\n  ".join(regressions))
+            raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Benchmark of the enrichment pipeline against local stand-ins of the upstream providers.
+
+Drives main_task directly, without the web tier or Celery, and reports throughput, latency percentiles,
+upstream traffic, memory use and how long the event loop was blocked.
+
+Examples:
+    # Interactive lookups, one at a time, cold cache
+    python -m benchmarks.bench_pipeline --fake-redis --workload lookup --lookups 200
+
+    # Bulk workload with 429s from a rate limited provider
+    python -m benchmarks.bench_pipeline --fake-redis --workload bulk --lookups 2000 \\
+        --provider-behaviour '{"virustotal": {"rate_limit": 50}}'
+
+    # Fail if throughput or latency regressed more than 20 % from a saved report
+    python -m benchmarks.bench_pipeline --fake-redis --output current.json --baseline baseline.json
+
+    # Memory of many concurrent lookups with large responses, against mock providers in their own process
+    python -m benchmarks.mock_providers --port 8081 --payload-scale 50 &
+    python -m benchmarks.bench_pipeline --fake-redis --workload bulk --concurrency 300 --lookups 1500 --providers-url http://127.0.0.1:8081
+"""
+import argparse
+import asyncio
+import json
+import time
+import tracemalloc
+import urllib.request
+
+from benchmarks.common import INDICATOR_TYPES, compare_to_baseline, generate_indicators, peak_rss_mb, prepare_environment, summarize_latencies, write_report
+from benchmarks.mock_providers import MockProviders, MockProviderServer, add_behaviour_arguments, behaviours_from_args, source_base_urls
+
+WORKLOAD_CONCURRENCY = {"lookup": 1, "bulk": 100}
+
+def count_errors(result) -> int:
+    """ Number of sources that returned an error in a main_task result. """
+    if not isinstance(result, dict):
+        return 0
+    return sum(1 for value in result.get("sources", {}).values() if value and value.get("summary") == "error")
+
+LOOP_LAG_INTERVAL = 0.01
+
+async def measure_loop_lag(lags: list[float], stop: asyncio.Event) -> None:
+    """ Measures how late the event loop wakes up a sleeping coroutine, i.e. how long other coroutines blocked it. """
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        lags.append(max(time.perf_counter() - start - LOOP_LAG_INTERVAL, 0))
+
+async def run_workload(indicators: list[str], concurrency: int) -> tuple[list[float], int, float, list[float]]:
+    """
+    Runs main_task for every indicator with the given number of lookups in flight.
+
+    :return: Tuple of per-lookup latencies in seconds, number of source errors, total duration in seconds and event loop lags in seconds
+    """
+    from app.tasks import main_task
+
+    latencies = []
+    errors = 0
+    queue = asyncio.Queue()
+    for indicator in indicators:
+        queue.put_nowait(indicator)
+
+    async def worker():
+        nonlocal errors
+        while not queue.empty():
+            indicator = queue.get_nowait()
+            start = time.perf_counter()
+            result = await main_task(indicator)
+            latencies.append(time.perf_counter() - start)
+            errors += count_errors(result)
+
+    lags = []
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(measure_loop_lag(lags, stop))
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, len(indicators)))))
+    duration = time.perf_counter() - start
+    stop.set()
+    await monitor
+    return latencies, errors, duration, lags
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the enrichment pipeline against local mock providers")
+    parser.add_argument("--workload", choices=WORKLOAD_CONCURRENCY, default="lookup", help="lookup runs one lookup at a time, bulk many concurrently")
+    parser.add_argument("--lookups", type=int, default=200, help="Number of distinct indicators looked up")
+    parser.add_argument("--concurrency", type=int, help="Lookups in flight, defaults to the workload's concurrency")
+    parser.add_argument("--repeat", type=int, default=1, help="Times the indicators are looked up, repeats are served from the cache")
+    parser.add_argument("--types", default=",".join(INDICATOR_TYPES), help="Comma separated indicator types to generate")
+    parser.add_argument("--seed", type=int, help="Seed for generated indicators, random by default so the cache is cold")
+    parser.add_argument("--fake-redis", action="store_true", help="Use an in-process fake Redis instead of REDIS_HOST")
+    parser.add_argument("--trace-memory", action="store_true", help="Measure Python allocations with tracemalloc, slows the benchmark down")
+    parser.add_argument("--output", help="Write the report to a JSON file")
+    parser.add_argument("--baseline", help="Report to compare against, exits with 1 on regressions")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed relative regression compared to the baseline")
+    parser.add_argument("--providers-url", help="Use mock providers already running at this URL instead of starting them in-process, "
+                                                "so their memory isn't counted. Their behaviour is set when starting them.")
+    add_behaviour_arguments(parser)
+    args = parser.parse_args()
+
+    if args.providers_url:
+        providers = server = None
+        base_url = args.providers_url
+    else:
+        default, behaviours = behaviours_from_args(args)
+        providers = MockProviders(behaviours, default)
+        server = MockProviderServer(providers).start()
+        base_url = server.base_url
+    prepare_environment(source_base_urls(base_url), fake_redis=args.fake_redis)
+
+    from benchmarks.common import create_bench_app
+    app = create_bench_app()
+
+    indicators = generate_indicators(args.lookups, tuple(args.types.split(",")), args.seed) * args.repeat
+    concurrency = args.concurrency or WORKLOAD_CONCURRENCY[args.workload]
+
+    if args.trace_memory:
+        tracemalloc.start()
+    with app.app_context():
+        latencies, errors, duration, lags = asyncio.run(run_workload(indicators, concurrency))
+    traced_peak = None
+    if args.trace_memory:
+        traced_peak = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)
+        tracemalloc.stop()
+    if server:
+        upstream = providers.get_stats()
+        server.stop()
+    else:
+        # Counted since the providers were started
+        with urllib.request.urlopen(f"{base_url.rstrip('/')}/stats") as response:
+            upstream = json.load(response)
+
+    report = {
+        "workload": args.workload,
+        "lookups": len(indicators),
+        "concurrency": concurrency,
+        "duration_s": round(duration, 3),
+        "throughput_per_s": round(len(indicators) / duration, 2) if duration else 0,
+        "latency_ms": summarize_latencies(latencies),
+        "source_errors": errors,
+        "loop_lag_ms": summarize_latencies(lags),
+        "loop_blocked_s": round(sum(lags), 3),
+        "upstream": upstream,
+        "peak_rss_mb": peak_rss_mb(),
+        "tracemalloc_peak_mb": traced_peak,
+    }
+    write_report(report, args.output)
+
+    if args.baseline:
+        regressions = compare_to_baseline(report, args.baseline, args.max_regression)
+        if regressions:
+            print("Regressions compared to baseline:\n  " + "\n  ".join(regressions))
+            raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
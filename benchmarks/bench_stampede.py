@@ -0,0 +1,124 @@
+"""
+Simulation of cache expiry bursts, comparing fixed TTLs to jittered TTLs and probabilistic early refreshes (XFetch).
+
+Entries are cached by a bulk import within a short window and then looked up with Zipf-distributed popularity.
+The simulation replays the cache layer's decisions (jittered_expiration and should_refresh_early from app.utils.cache)
+over simulated time, without Redis or upstream calls, and reports how upstream refreshes are spread over time.
+
+Examples:
+    python -m benchmarks.bench_stampede
+    python -m benchmarks.bench_stampede --entries 20000 --ttl 3600 --hours 6 --jitter 0.2 --beta 2 --output stampede.json
+"""
+import argparse
+from collections import Counter
+import heapq
+import math
+import random
+
+from benchmarks.common import percentile, write_report
+
+POLICIES = ("fixed", "jitter", "xfetch", "jitter+xfetch")
+
+def lookup_times(rng: random.Random, rate: float, start: float, end: float):
+    """ Poisson arrivals of lookups between start and end. """
+    t = start
+    while True:
+        t += rng.expovariate(rate)
+        if t >= end:
+            return
+        yield t
+
+def simulate(policy: str, args, seed: int) -> dict:
+    """
+    Simulates one policy.
+
+    :return: Dict of refresh burst and hit ratio statistics
+    """
+    from app.utils.cache import jittered_expiration, should_refresh_early
+
+    rng = random.Random(seed)
+    jitter = args.jitter if "jitter" in policy else 0
+    beta = args.beta if "xfetch" in policy else 0
+    horizon = args.hours * 3600
+
+    # Entry state: time it turns stale, compute time and the time a running refresh finishes
+    fresh_until = []
+    compute_times = []
+    refresh_done = []
+    lookups = []
+    for entry in range(args.entries):
+        cached_at = rng.uniform(0, args.import_window)
+        compute_time = rng.lognormvariate(math.log(args.compute_time), 0.5)
+        fresh_until.append(cached_at + jittered_expiration(args.ttl, jitter, rng))
+        compute_times.append(compute_time)
+        refresh_done.append(None)
+        # Zipf popularity, the most popular entry is looked up args.max_rate times per second
+        rate = args.max_rate / (entry + 1) ** args.zipf
+        for t in lookup_times(rng, rate, cached_at, horizon):
+            lookups.append((t, entry))
+    heapq.heapify(lookups)
+
+    refreshes = Counter()
+    fresh_hits = stale_hits = early = 0
+    while lookups:
+        now, entry = heapq.heappop(lookups)
+        done = refresh_done[entry]
+        if done is not None and done <= now:
+            fresh_until[entry] = done + jittered_expiration(args.ttl, jitter, rng)
+            refresh_done[entry] = done = None
+
+        stale = now >= fresh_until[entry]
+        if stale:
+            stale_hits += 1
+        else:
+            fresh_hits += 1
+        if done is not None:
+            continue
+        if stale or should_refresh_early(now, fresh_until[entry], compute_times[entry], beta, rng):
+            early += not stale
+            refresh_done[entry] = now + compute_times[entry]
+            refreshes[int(now)] += 1
+
+    per_second = [refreshes.get(second, 0) for second in range(int(args.import_window), int(horizon))]
+    per_minute = [sum(per_second[i:i + 60]) for i in range(0, len(per_second), 60)]
+    total = fresh_hits + stale_hits
+    return {
+        "refreshes": sum(per_second),
+        "early_refreshes": early,
+        "peak_refreshes_per_s": max(per_second, default=0),
+        "p99_refreshes_per_s": percentile(per_second, 99),
+        "peak_refreshes_per_min": max(per_minute, default=0),
+        "lookups": total,
+        "fresh_hit_ratio": round(fresh_hits / total, 4) if total else 0,
+        "stale_hit_ratio": round(stale_hits / total, 4) if total else 0,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate cache expiry bursts with and without TTL jitter and early refreshes")
+    parser.add_argument("--entries", type=int, default=5000, help="Entries cached by the bulk import")
+    parser.add_argument("--import-window", type=float, default=60, help="Seconds the bulk import takes")
+    parser.add_argument("--ttl", type=int, default=3600, help="Seconds entries are fresh, CACHE_EXPIRATION")
+    parser.add_argument("--hours", type=float, default=4, help="Simulated hours")
+    parser.add_argument("--jitter", type=float, default=0.1, help="TTL jitter share, CACHE_TTL_JITTER")
+    parser.add_argument("--beta", type=float, default=1.0, help="Early refresh eagerness, CACHE_XFETCH_BETA")
+    parser.add_argument("--compute-time", type=float, default=2.0, help="Median seconds a refresh takes")
+    parser.add_argument("--max-rate", type=float, default=1.0, help="Lookups per second of the most popular entry")
+    parser.add_argument("--zipf", type=float, default=0.8, help="Zipf exponent of entry popularity")
+    parser.add_argument("--policies", default=",".join(POLICIES), help=f"Comma separated policies: {', '.join(POLICIES)}")
+    parser.add_argument("--seed", type=int, default=1, help="Seed, every policy sees the same lookups")
+    parser.add_argument("--output", help="Write the report to a JSON file")
+    args = parser.parse_args()
+
+    policies = [name.strip() for name in args.policies.split(",") if name.strip()]
+    for name in policies:
+        if name not in POLICIES:
+            parser.error(f"Unknown policy: {name}")
+
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key not in ("output", "policies")},
+        "policies": {name: simulate(name, args, args.seed) for name in policies},
+    }
+    write_report(report, args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+Benchmark and check of callback delivery against the local callback receiver.
+
+Sends the callbacks of finished searches and of a bulk job the way search tasks do, with Celery running tasks
+eagerly so retries run inline without their backoff. Reports the time a worker spends per callback, and checks
+on the receiver's side that every result arrived exactly once with a valid signature, also when a share of the
+callbacks is answered with errors. Exits with status 1 if a check fails.
+
+Examples:
+    python -m benchmarks.bench_webhooks
+    python -m benchmarks.bench_webhooks --searches 500 --bulk-results 5000 --batch-size 100 --error-rate 0.2
+    python -m benchmarks.bench_webhooks --error-rate 1 --max-attempts 2 --output webhooks.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from urllib.parse import urlsplit
+import uuid
+
+from benchmarks.callback_receiver import CallbackReceiver
+from benchmarks.common import generate_indicators, prepare_environment, summarize_latencies, write_report
+from benchmarks.mock_providers import MockProviderServer
+
+def sample_result(indicator: str, sources: int) -> dict:
+    """ Result shaped like the one of main_task. """
+    return {
+        "indicator": indicator,
+        "sources": {
+            f"Source{i}": {"summary": "benign", "verdict": 0, "data": {"reputation": i, "tags": ["scanner", "vpn"], "last_seen": "2024-01-01"}}
+            for i in range(sources)
+        },
+    }
+
+def run_searches(indicators: list[str], callback_url: str, sources: int) -> list[float]:
+    """ Sends the callback of every search, as search tasks without a bulk job do. """
+    from app.tasks import notify_search_finished
+
+    durations = []
+    for indicator in indicators:
+        entry = {"task_id": str(uuid.uuid4()), "indicator": indicator, "state": "SUCCESS", "result": sample_result(indicator, sources)}
+        start = time.perf_counter()
+        notify_search_finished(callback_url, entry)
+        durations.append(time.perf_counter() - start)
+    return durations
+
+def run_bulk_job(indicators: list[str], callback_url: str, sources: int) -> list[float]:
+    """ Finishes every search of a bulk job, as its search tasks do. """
+    from app.tasks import notify_search_finished
+    from app.utils.bulk_jobs import create_bulk_job, record_task_finished
+
+    job_id = create_bulk_job(indicators, "bulk", callback_url=callback_url)
+    durations = []
+    for indicator in indicators:
+        entry = {"task_id": str(uuid.uuid4()), "indicator": indicator, "state": "SUCCESS", "result": sample_result(indicator, sources)}
+        start = time.perf_counter()
+        notify_search_finished(callback_url, entry, job_id, record_task_finished(job_id))
+        durations.append(time.perf_counter() - start)
+    return durations
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure and check callback delivery against a local receiver")
+    parser.add_argument("--searches", type=int, default=200, help="Searches whose result is sent on its own")
+    parser.add_argument("--bulk-results", type=int, default=2000, help="Searches of the bulk job, sent in batches")
+    parser.add_argument("--batch-size", type=int, default=100, help="Results per bulk callback, WEBHOOK_BATCH_SIZE")
+    parser.add_argument("--sources", type=int, default=8, help="Sources in each result")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of callbacks the receiver answers with a 500 error")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Time the receiver takes to answer in milliseconds")
+    parser.add_argument("--max-attempts", type=int, default=5, help="Attempts per callback, WEBHOOK_MAX_ATTEMPTS")
+    parser.add_argument("--output", help="Write the report to a JSON file")
+    args = parser.parse_args()
+
+    secret = uuid.uuid4().hex
+    receiver = CallbackReceiver(secret, args.error_rate, args.latency_ms)
+    server = MockProviderServer(receiver).start()
+    callback_url = f"{server.base_url}/callback"
+
+    os.environ.update({
+        "WEBHOOK_SECRET": secret,
+        # The receiver listens on a loopback address, which is refused without an allowlist
+        "WEBHOOK_ALLOWED_HOSTS": urlsplit(server.base_url).hostname,
+        "WEBHOOK_BATCH_SIZE": str(args.batch_size),
+        "WEBHOOK_MAX_ATTEMPTS": str(args.max_attempts),
+        "WEBHOOK_RETRY_BACKOFF": "0",
+        "LOG_LEVEL": "ERROR",
+    })
+    prepare_environment(fake_redis=True)
+    from app.celery_worker import celery
+    from app.tasks import close_event_loop
+    from app.utils.webhooks import get_dead_letters
+    celery.conf.task_always_eager = True
+
+    try:
+        search_durations = run_searches(generate_indicators(args.searches, seed=1), callback_url, args.sources)
+        bulk_durations = run_bulk_job(generate_indicators(args.bulk_results, seed=2), callback_url, args.sources)
+    finally:
+        close_event_loop()
+        server.stop()
+
+    summary = receiver.summary()
+    dead_letters = get_dead_letters(0, args.searches + args.bulk_results)
+    dead_lettered_results = 0
+    for delivery in dead_letters:
+        body = json.loads(delivery["body"])
+        dead_lettered_results += len(body["results"]) if delivery["event"] == "bulk.results" else int(delivery["event"] == "search.completed")
+    received = sum(summary["results"].values())
+    expected_batches = -(-args.bulk_results // args.batch_size)
+    checks = {
+        "every_result_received_or_dead_lettered": received + dead_lettered_results == args.searches + args.bulk_results,
+        "no_duplicate_results": summary["duplicate_results"] == 0,
+        "valid_signatures": summary["invalid_signatures"] == 0,
+        "batched": args.error_rate > 0 or summary["events"].get("bulk.results") == expected_batches,
+        "completion_sent_once": summary["events"].get("bulk.completed", 0) <= 1,
+    }
+    report = {
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "searches": {
+            "callbacks_per_s": round(len(search_durations) / sum(search_durations), 1) if search_durations else 0,
+            "worker_time": summarize_latencies(search_durations),
+        },
+        "bulk": {
+            "results_per_s": round(len(bulk_durations) / sum(bulk_durations), 1) if bulk_durations else 0,
+            "worker_time": summarize_latencies(bulk_durations),
+        },
+        "receiver": summary,
+        "results_received": received,
+        "dead_letters": len(dead_letters),
+        "dead_lettered_results": dead_lettered_results,
+        "checks": checks,
+    }
+    write_report(report, args.output)
+    if not all(checks.values()):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+Local receiver for the callbacks of searches and bulk jobs.
+
+Verifies the signatures, counts deliveries, duplicates and results per event, and can answer a share of
+the callbacks with errors or slowly to exercise retries and dead-lettering. The counters are served on
+GET /deliveries.
+
+Run standalone with:
+    python -m benchmarks.callback_receiver --port 8090 --secret "$WEBHOOK_SECRET"
+and search with "callback_url": "http://127.0.0.1:8090/callback".
+"""
+import argparse
+import asyncio
+from collections import Counter
+import hashlib
+import hmac
+import json
+import random
+import time
+
+from aiohttp import web
+
+SIGNATURE_HEADER = "X-Threat-Lense-Signature"
+EVENT_HEADER = "X-Threat-Lense-Event"
+DELIVERY_HEADER = "X-Threat-Lense-Delivery"
+
+def verify_signature(body: bytes, header: str, secret: str, tolerance: int=300) -> bool:
+    """
+    Verifies the signature header of a callback, like receivers should.
+
+    :param body: Received body
+    :param header: Value of the signature header, t=<timestamp>,v1=<hex HMAC-SHA256 of "<timestamp>.<body>">
+    :param secret: Shared secret, WEBHOOK_SECRET
+    :param tolerance: Maximum age of the delivery in seconds, older ones may be replayed
+
+    :return: Whether the signature is valid and recent
+    """
+    try:
+        fields = dict(field.split("=", 1) for field in header.split(","))
+        timestamp = int(fields["t"])
+    except (KeyError, ValueError):
+        return False
+    if abs(time.time() - timestamp) > tolerance:
+        return False
+    expected = hmac.new(secret.encode("utf-8"), f"{timestamp}.".encode("ascii") + body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, fields.get("v1", ""))
+
+class CallbackReceiver:
+    """
+    Receiver of callbacks, serve it with MockProviderServer or create_app.
+
+    :param secret: WEBHOOK_SECRET the signatures are verified with, signatures aren't checked if empty
+    :param error_rate: Share of callbacks answered with a 500 error, between 0 and 1
+    :param latency_ms: Time taken to answer each callback in milliseconds
+    """
+    def __init__(self, secret: str="", error_rate: float=0.0, latency_ms: float=0):
+        self.secret = secret
+        self.error_rate = error_rate
+        self.latency_ms = latency_ms
+        self.events = Counter()
+        self.results = Counter()
+        self.rejected = 0
+        self.invalid_signatures = 0
+        self.duplicates = 0
+        self.delivery_ids = set()
+        self.task_ids = set()
+        self.duplicate_results = 0
+        self.received_at = []
+
+    async def handle_callback(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000)
+        if self.secret:
+            if not verify_signature(body, request.headers.get(SIGNATURE_HEADER, ""), self.secret):
+                self.invalid_signatures += 1
+                return web.Response(status=401)
+        if self.error_rate and random.random() < self.error_rate:
+            self.rejected += 1
+            return web.Response(status=500)
+
+        # Retried deliveries keep their ID, receivers drop the duplicates
+        delivery_id = request.headers.get(DELIVERY_HEADER)
+        if delivery_id in self.delivery_ids:
+            self.duplicates += 1
+            return web.Response(status=200)
+        self.delivery_ids.add(delivery_id)
+
+        payload = json.loads(body)
+        event = request.headers.get(EVENT_HEADER, payload.get("event"))
+        self.events[event] += 1
+        self.received_at.append(time.perf_counter())
+        entries = payload["results"] if event == "bulk.results" else [payload] if event == "search.completed" else []
+        for entry in entries:
+            self.results[entry["state"]] += 1
+            if entry["task_id"] in self.task_ids:
+                self.duplicate_results += 1
+            self.task_ids.add(entry["task_id"])
+        return web.Response(status=200)
+
+    def summary(self) -> dict:
+        return {
+            "events": dict(self.events),
+            "results": dict(self.results),
+            "rejected": self.rejected,
+            "invalid_signatures": self.invalid_signatures,
+            "duplicate_deliveries": self.duplicates,
+            "duplicate_results": self.duplicate_results,
+        }
+
+    async def handle_deliveries(self, request: web.Request) -> web.Response:
+        return web.json_response(self.summary())
+
+    def create_app(self) -> web.Application:
+        app = web.Application(client_max_size=64 * 1024 ** 2)
+        app.router.add_get("/deliveries", self.handle_deliveries)
+        app.router.add_post("/{path:.*}", self.handle_callback)
+        return app
+
+def main():
+    parser = argparse.ArgumentParser(description="Receive and count the callbacks of searches and bulk jobs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--secret", default="", help="WEBHOOK_SECRET to verify the signatures with")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of callbacks answered with a 500 error")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Time taken to answer each callback in milliseconds")
+    args = parser.parse_args()
+
+    receiver = CallbackReceiver(args.secret, args.error_rate, args.latency_ms)
+    print(f"Callback URL: http://{args.host}:{args.port}/callback, counters at /deliveries", flush=True)
+    web.run_app(receiver.create_app(), host=args.host, port=args.port, access_log=None, print=None)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Helpers shared by the benchmarks: environment setup, indicator generation and reporting.
+
+The app reads its configuration on import, so prepare_environment() must be called before importing anything from app.
+"""
+import json
+import os
+import random
+import resource
+import statistics
+import sys
+import tempfile
+
+INDICATOR_TYPES = ("ipv4", "ipv6", "domain", "url", "hash")
+
+def prepare_environment(source_base_urls: dict[str, str]=None, fake_redis: bool=False, database_uri: str=None) -> None:
+    """
+    Configures the app for benchmarking. Must be called before importing app.
+
+    :param source_base_urls: SOURCE_BASE_URLS pointing the sources at the mock providers
+    :param fake_redis: Use an in-process fake Redis instead of REDIS_HOST, requires fakeredis
+    :param database_uri: Database used for API keys, defaults to a temporary SQLite file
+    """
+    if "app" in sys.modules:
+        raise RuntimeError("prepare_environment() must be called before importing app")
+    if source_base_urls:
+        os.environ["SOURCE_BASE_URLS"] = json.dumps(source_base_urls)
+    if not database_uri:
+        database_uri = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='threat-lense-bench-'), 'bench.db')}"
+    os.environ["SQLALCHEMY_DATABASE_URI"] = database_uri
+    if fake_redis:
+        use_fake_redis()
+
+def use_fake_redis() -> None:
+    """ Replaces the Redis clients with fakeredis clients sharing one in-process server. """
+    try:
+        import fakeredis
+    except ImportError:
+        raise SystemExit("--fake-redis requires fakeredis with Lua support, install it with: pip install 'fakeredis[lua]'")
+    import redis
+    import redis.asyncio
+
+    server = fakeredis.FakeServer()
+
+    class FakeRedis(fakeredis.FakeRedis):
+        def __init__(self, *args, decode_responses: bool=False, **kwargs):
+            super().__init__(server=server, decode_responses=decode_responses)
+
+    class FakeAsyncRedis(fakeredis.FakeAsyncRedis):
+        def __init__(self, *args, decode_responses: bool=False, connection_pool_class=redis.asyncio.ConnectionPool, **kwargs):
+            pool_kwargs = {key: kwargs[key] for key in ("max_connections",) if kwargs.get(key) is not None}
+            super().__init__(server=server, decode_responses=decode_responses, connection_pool_class=connection_pool_class, **pool_kwargs)
+
+        @classmethod
+        def from_pool(cls, connection_pool):
+            # A pool of the same class and size as the app's, so coroutines wait for a connection like they do with Redis
+            return cls(decode_responses=connection_pool.connection_kwargs.get("decode_responses", False),
+                       connection_pool_class=type(connection_pool), max_connections=connection_pool.max_connections)
+
+    redis.Redis = redis.StrictRedis = FakeRedis
+    redis.asyncio.Redis = redis.asyncio.StrictRedis = FakeAsyncRedis
+
+def create_bench_app(api_key: str="benchmark-key"):
+    """
+    Creates the Flask app with database tables, sources and an API key for every source requiring one.
+
+    :param api_key: API key stored for the sources
+
+    :return: Flask app
+    """
+    from app import create_app, seed_sources
+    from app.models import db, APIKey, Source
+
+    app = create_app(celery=True)
+    with app.app_context():
+        db.create_all()
+        seed_sources()
+        for source in Source.query.filter_by(requires_api_key=True).all():
+            if not APIKey.query.filter_by(source_name=source.name).first():
+                entry = APIKey(source_name=source.name)
+                entry.set_key(api_key)
+                db.session.add(entry)
+        db.session.commit()
+    return app
+
+def generate_indicators(count: int, types: tuple[str]=INDICATOR_TYPES, seed: int=None) -> list[str]:
+    """
+    Generates random, valid indicators.
+
+    :param count: Number of indicators
+    :param types: Indicator types to pick from
+    :param seed: Seed of the random generator, random if None
+
+    :return: List of indicators
+    """
+    rng = random.Random(seed)
+    indicators = []
+    for i in range(count):
+        indicator_type = types[i % len(types)]
+        if indicator_type == "ipv4":
+            indicators.append(f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}")
+        elif indicator_type == "ipv6":
+            indicators.append("2001:db8:" + ":".join(f"{rng.randint(0, 0xffff):x}" for _ in range(6)))
+        elif indicator_type == "domain":
+            indicators.append(f"{rng.getrandbits(40):x}.example-{rng.randint(0, 999)}.com")
+        elif indicator_type == "url":
+            indicators.append(f"https://{rng.getrandbits(32):x}.example.net/path/{rng.getrandbits(32):x}")
+        elif indicator_type == "hash":
+            indicators.append(f"{rng.getrandbits(256):064x}")
+        else:
+            raise ValueError(f"Unknown indicator type: {indicator_type}")
+    return indicators
+
+def percentile(values: list[float], percent: float) -> float:
+    """ Nearest-rank percentile of the values. """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(min(round(percent / 100 * len(ordered) + 0.5) - 1, len(ordered) - 1), 0)
+    return ordered[index]
+
+def summarize_latencies(latencies: list[float]) -> dict:
+    """
+    Summarizes latencies given in seconds.
+
+    :return: Dict of latency statistics in milliseconds
+    """
+    if not latencies:
+        return {"count": 0}
+    return {
+        "count": len(latencies),
+        "mean": round(statistics.fmean(latencies) * 1000, 2),
+        "p50": round(percentile(latencies, 50) * 1000, 2),
+        "p95": round(percentile(latencies, 95) * 1000, 2),
+        "p99": round(percentile(latencies, 99) * 1000, 2),
+        "max": round(max(latencies) * 1000, 2),
+    }
+
+def peak_rss_mb() -> float:
+    """ Peak resident set size of the process in megabytes. """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes elsewhere
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+def write_report(report: dict, output: str=None) -> None:
+    """ Prints the report and optionally writes it to a JSON file. """
+    print(json.dumps(report, indent=2))
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+def compare_to_baseline(report: dict, baseline_path: str, max_regression: float) -> list[str]:
+    """
+    Compares throughput and latency to a previously written report.
+
+    :param report: Current report
+    :param baseline_path: Path to the baseline report
+    :param max_regression: Allowed relative regression, e.g. 0.2 for 20 %
+
+    :return: List of regressions, empty if none
+    """
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+
+    regressions = []
+    if baseline.get("throughput_per_s") and report["throughput_per_s"] < baseline["throughput_per_s"] * (1 - max_regression):
+        regressions.append(f"throughput {report['throughput_per_s']}/s, baseline {baseline['throughput_per_s']}/s")
+    for key in ("p50", "p95", "p99"):
+        current = report.get("latency_ms", {}).get(key)
+        previous = baseline.get("latency_ms", {}).get(key)
+        if current and previous and current > previous * (1 + max_regression):
+            regressions.append(f"{key} latency {current} ms, baseline {previous} ms")
+    return regressions
@@ -0,0 +1,355 @@
+"""
+Load test of the full /search -> search_task -> /search/status flow, and of bulk jobs submitted to /search/bulk.
+
+Starts the mock providers, Redis (or an in-process fake Redis served over TCP), a Celery worker and the web
+server, then runs scripted scenarios at a set request rate. End-to-end latency is measured from submitting
+/search until /search/status reports the task finished. Broker queue depth per priority class is sampled during the run.
+
+Examples:
+    # Everything local, fake Redis, all scenarios
+    python -m benchmarks.load_test --fake-redis --rate 20 --duration 30 --output load.json
+
+    # Compare worker configurations
+    python -m benchmarks.load_test --fake-redis --scenarios cold-sweep --worker-concurrency 4 --output c4.json
+    python -m benchmarks.load_test --fake-redis --scenarios cold-sweep --worker-concurrency 16 --output c16.json
+
+    # Interactive latency while a large bulk job runs, with one worker process reserved for interactive lookups
+    python -m benchmarks.load_test --fake-redis --scenarios priority-mix --mix-bulk-indicators 2000 --interactive-concurrency 1
+"""
+import argparse
+import asyncio
+from collections import Counter
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+import aiohttp
+
+from benchmarks.common import INDICATOR_TYPES, generate_indicators, prepare_environment, summarize_latencies, write_report
+from benchmarks.mock_providers import MockProviders, MockProviderServer, add_behaviour_arguments, behaviours_from_args, source_base_urls
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS = ("hot-key", "cold-sweep", "mixed", "bulk", "priority-mix")
+BROKER_QUEUES = ("interactive", "bulk", "refresh")
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_fake_redis(port: int):
+    """ Serves an in-process fake Redis over TCP, so the worker and web processes can share it. """
+    try:
+        from fakeredis import TcpFakeServer
+    except ImportError:
+        raise SystemExit("--fake-redis requires fakeredis with Lua support, install it with: pip install 'fakeredis[lua]'")
+    server = TcpFakeServer(("127.0.0.1", port))
+    # Connection handler threads must not keep the load test alive once it finished
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-redis", daemon=True).start()
+    return server
+
+def scenario_plan(name: str, count: int, rng: random.Random) -> list[str]:
+    """
+    Indicators submitted by a scenario, in order.
+
+    hot-key: a handful of indicators requested over and over, mostly served from the cache
+    cold-sweep: every indicator unique, every request fans out to the sources
+    mixed: all indicator types, half repeated from a small pool and half unique
+    bulk: unique indicators submitted as bulk jobs
+    priority-mix: unique interactive lookups, while a large bulk job runs
+    """
+    if name == "hot-key":
+        hot = generate_indicators(5, seed=rng.random())
+        return [rng.choice(hot) for _ in range(count)]
+    elif name == "mixed":
+        pool = generate_indicators(50, seed=rng.random())
+        unique = iter(generate_indicators(count, seed=rng.random()))
+        return [rng.choice(pool) if rng.random() < 0.5 else next(unique) for _ in range(count)]
+    elif name in ("cold-sweep", "bulk", "priority-mix"):
+        return generate_indicators(count, INDICATOR_TYPES, seed=rng.random())
+    raise ValueError(f"Unknown scenario: {name}")
+
+class LoadTest:
+    """
+    Runs scenarios against a running web server and records the results.
+
+    :param base_url: Base URL of the web server
+    :param redis_client: Redis client used to sample the broker queue depth
+    :param args: Parsed command line arguments
+    """
+    def __init__(self, base_url: str, redis_client, args):
+        self.base_url = base_url
+        self.redis = redis_client
+        self.args = args
+
+    async def submit_and_wait(self, session: aiohttp.ClientSession, indicator: str, stats: dict) -> None:
+        """ Submits a search and polls its status until the task finishes. """
+        start = time.perf_counter()
+        try:
+            async with session.get(f"{self.base_url}/search", json={"indicator": indicator}) as response:
+                stats["submit_latencies"].append(time.perf_counter() - start)
+                stats["http_statuses"][response.status] += 1
+                if response.status == 200:
+                    # Served from the cache while admission control refuses new searches
+                    stats["task_states"]["SUCCESS"] += 1
+                    stats["latencies"].append(time.perf_counter() - start)
+                    return
+                if response.status != 202:
+                    return
+                status_url = (await response.json())["status_url"]
+
+            deadline = start + self.args.task_timeout
+            while time.perf_counter() < deadline:
+                await asyncio.sleep(self.args.poll_interval)
+                async with session.get(f"{self.base_url}{status_url}") as response:
+                    stats["polls"] += 1
+                    if response.status != 200:
+                        stats["http_statuses"][response.status] += 1
+                        continue
+                    state = (await response.json()).get("state")
+                if state in ("SUCCESS", "FAILURE"):
+                    stats["task_states"][state] += 1
+                    if state == "SUCCESS":
+                        stats["latencies"].append(time.perf_counter() - start)
+                    return
+            stats["task_states"]["TIMEOUT"] += 1
+        except aiohttp.ClientError as e:
+            stats["client_errors"][type(e).__name__] += 1
+
+    async def submit_bulk_and_wait(self, session: aiohttp.ClientSession, indicators: list[str], stats: dict) -> None:
+        """ Submits a bulk job and polls its status until every task finished. """
+        start = time.perf_counter()
+        try:
+            async with session.post(f"{self.base_url}/search/bulk", json={"indicators": indicators}) as response:
+                stats["submit_latencies"].append(time.perf_counter() - start)
+                stats["http_statuses"][response.status] += 1
+                if response.status != 202:
+                    return
+                status_url = (await response.json())["status_url"]
+
+            job = {}
+            deadline = start + self.args.task_timeout
+            while time.perf_counter() < deadline:
+                await asyncio.sleep(self.args.poll_interval)
+                async with session.get(f"{self.base_url}{status_url}") as response:
+                    stats["polls"] += 1
+                    if response.status != 200:
+                        stats["http_statuses"][response.status] += 1
+                        continue
+                    job = await response.json()
+                if job["state"] == "COMPLETED":
+                    stats["latencies"].append(time.perf_counter() - start)
+                    break
+            stats["task_states"]["SUCCESS"] += job.get("completed", 0)
+            stats["task_states"]["FAILURE"] += job.get("failed", 0)
+            stats["task_states"]["TIMEOUT"] += job.get("pending", len(indicators))
+        except aiohttp.ClientError as e:
+            stats["client_errors"][type(e).__name__] += 1
+
+    async def sample_queue_depth(self, start: float, samples: list, stop: asyncio.Event) -> None:
+        """ Samples the broker queue depth until stopped. """
+        while not stop.is_set():
+            depth = {queue: await asyncio.to_thread(self.redis.llen, queue) for queue in BROKER_QUEUES}
+            samples.append({"t": round(time.perf_counter() - start, 2), **depth})
+            try:
+                await asyncio.wait_for(stop.wait(), self.args.sample_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run_scenario(self, name: str, rng: random.Random) -> dict:
+        count = max(int(self.args.rate * self.args.duration), 1)
+        indicators = scenario_plan(name, count, rng)
+        stats = new_stats()
+        bulk_stats = new_stats()
+        samples = []
+        stop = asyncio.Event()
+
+        connector = aiohttp.TCPConnector(limit=self.args.max_connections)
+        async with aiohttp.ClientSession(connector=connector) as session:
+            start = time.perf_counter()
+            sampler = asyncio.create_task(self.sample_queue_depth(start, samples, stop))
+            requests = []
+
+            # A large bulk job competes with the interactive lookups for the workers
+            if name == "priority-mix":
+                bulk_indicators = generate_indicators(self.args.mix_bulk_indicators, seed=rng.random())
+                requests.append(asyncio.create_task(self.submit_bulk_and_wait(session, bulk_indicators, bulk_stats)))
+
+            # Open-loop arrivals at the set rate, bulk submits whole batches as one job
+            batch_size = self.args.bulk_size if name == "bulk" else 1
+            interval = batch_size / self.args.rate
+            for i in range(0, len(indicators), batch_size):
+                await asyncio.sleep(max(start + (i // batch_size) * interval - time.perf_counter(), 0))
+                if name == "bulk":
+                    requests.append(asyncio.create_task(self.submit_bulk_and_wait(session, indicators[i:i + batch_size], stats)))
+                else:
+                    requests.append(asyncio.create_task(self.submit_and_wait(session, indicators[i], stats)))
+            submitted_in = time.perf_counter() - start
+
+            await asyncio.gather(*requests)
+            duration = time.perf_counter() - start
+            stop.set()
+            await sampler
+
+        report = {
+            "requests": len(indicators),
+            "offered_rate_per_s": self.args.rate,
+            "achieved_submit_rate_per_s": round(len(indicators) / submitted_in, 2) if submitted_in else None,
+            "duration_s": round(duration, 2),
+            **summarize_stats(stats, len(indicators), duration),
+            "queue_depth": {
+                "max": {queue: max((s[queue] for s in samples), default=0) for queue in BROKER_QUEUES},
+                "samples": samples,
+            },
+        }
+        if name == "priority-mix":
+            report["bulk_job"] = summarize_stats(bulk_stats, self.args.mix_bulk_indicators, duration)
+        return report
+
+def new_stats() -> dict:
+    return {
+        "latencies": [], "submit_latencies": [], "polls": 0,
+        "http_statuses": Counter(), "task_states": Counter(), "client_errors": Counter(),
+    }
+
+def summarize_stats(stats: dict, requests: int, duration: float) -> dict:
+    """ Summarizes the stats of a scenario. Latencies of the bulk scenario are per job. """
+    completed = stats["task_states"]["SUCCESS"]
+    failed = sum(stats["task_states"].values()) - completed + sum(stats["client_errors"].values())
+    failed += sum(count for status, count in stats["http_statuses"].items() if status >= 400)
+    return {
+        "completed": completed,
+        "completion_rate_per_s": round(completed / duration, 2) if duration else 0,
+        "error_rate": round(failed / requests, 4) if requests else 0,
+        "end_to_end_latency_ms": summarize_latencies(stats["latencies"]),
+        "submit_latency_ms": summarize_latencies(stats["submit_latencies"]),
+        "status_polls": stats["polls"],
+        "http_statuses": {str(k): v for k, v in stats["http_statuses"].items()},
+        "task_states": dict(stats["task_states"]),
+        "client_errors": dict(stats["client_errors"]),
+    }
+
+def wait_for(check, timeout: float, description: str) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if check():
+                return
+        except Exception:
+            pass
+        time.sleep(0.5)
+    raise SystemExit(f"Timed out waiting for {description}")
+
+def start_processes(args, env: dict, web_port: int) -> list[subprocess.Popen]:
+    """ Starts the Celery workers and the web server. """
+    output = None if args.verbose else subprocess.DEVNULL
+    processes = []
+    # Same layout as docker-compose, an optional worker reserved for interactive lookups and one consuming every queue
+    workers = [("all", ",".join(BROKER_QUEUES), args.worker_concurrency)]
+    if args.interactive_concurrency:
+        workers.append(("interactive", "interactive", args.interactive_concurrency))
+    for name, queues, concurrency in workers:
+        processes.append(subprocess.Popen(
+            [sys.executable, "-m", "celery", "-A", "app.celery_worker.celery", "worker", "-l", "WARNING", "-Q", queues,
+             "--concurrency", str(concurrency), "--hostname", f"loadtest-{name}-{web_port}@%h"],
+            cwd=ROOT, env=env, stdout=output, stderr=output
+        ))
+    if shutil.which("gunicorn") and not args.werkzeug:
+        web_command = ["gunicorn", "-b", f"127.0.0.1:{web_port}", "-w", str(args.web_workers), "manage:app"]
+    else:
+        web_command = [sys.executable, "manage.py"]
+    processes.append(subprocess.Popen(web_command, cwd=ROOT, env={**env, "FLASK_PORT": str(web_port), "LISTEN_TO_HOSTS": "127.0.0.1"}, stdout=output, stderr=output))
+    return processes
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the web, Celery and Redis request path against local mock providers")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help=f"Comma separated scenarios to run: {', '.join(SCENARIOS)}")
+    parser.add_argument("--rate", type=float, default=10, help="Requests per second submitted")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds each scenario submits requests for")
+    parser.add_argument("--bulk-size", type=int, default=100, help="Indicators per bulk job in the bulk scenario")
+    parser.add_argument("--mix-bulk-indicators", type=int, default=1000, help="Indicators of the bulk job running during the priority-mix scenario")
+    parser.add_argument("--poll-interval", type=float, default=0.2, help="Seconds between status polls")
+    parser.add_argument("--task-timeout", type=float, default=120, help="Seconds to wait for a task before counting it as timed out")
+    parser.add_argument("--sample-interval", type=float, default=0.5, help="Seconds between queue depth samples")
+    parser.add_argument("--max-connections", type=int, default=200, help="Maximum concurrent HTTP connections to the web server")
+    parser.add_argument("--worker-concurrency", type=int, default=4, help="Processes of the Celery worker consuming every queue")
+    parser.add_argument("--interactive-concurrency", type=int, default=1, help="Processes of a Celery worker reserved for interactive lookups, 0 disables it")
+    parser.add_argument("--web-workers", type=int, default=2, help="gunicorn worker processes")
+    parser.add_argument("--werkzeug", action="store_true", help="Serve with the Flask development server instead of gunicorn")
+    parser.add_argument("--fake-redis", action="store_true", help="Serve an in-process fake Redis over TCP instead of using REDIS_HOST")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="Extra settings for the worker and web server, e.g. MAX_CONCURRENT_REQUESTS=50")
+    parser.add_argument("--seed", type=int, help="Seed for generated indicators")
+    parser.add_argument("--output", help="Write the report to a JSON file")
+    parser.add_argument("--verbose", action="store_true", help="Show worker and web server output")
+    add_behaviour_arguments(parser)
+    args = parser.parse_args()
+
+    scenarios = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    for name in scenarios:
+        if name not in SCENARIOS:
+            parser.error(f"Unknown scenario: {name}")
+
+    default, behaviours = behaviours_from_args(args)
+    providers = MockProviders(behaviours, default)
+    mock_server = MockProviderServer(providers).start()
+
+    if args.fake_redis:
+        redis_port = free_port()
+        start_fake_redis(redis_port)
+        os.environ["REDIS_HOST"] = "127.0.0.1"
+        os.environ["REDIS_PORT"] = str(redis_port)
+    for setting in args.env:
+        key, _, value = setting.partition("=")
+        os.environ[key] = value
+    prepare_environment(source_base_urls(mock_server.base_url))
+
+    from benchmarks.common import create_bench_app
+    from app.utils.cache import redis_client
+    create_bench_app()
+
+    web_port = free_port()
+    processes = start_processes(args, os.environ.copy(), web_port)
+    base_url = f"http://127.0.0.1:{web_port}"
+    try:
+        from app.celery_worker import celery
+        wait_for(lambda: celery.control.ping(timeout=1.0), 60, "the Celery worker")
+        wait_for(lambda: urllib.request.urlopen(f"{base_url}/health").status == 200, 60, "the web server")
+
+        load_test = LoadTest(base_url, redis_client, args)
+        rng = random.Random(args.seed)
+        results = {}
+        for name in scenarios:
+            print(f"Running scenario {name}", file=sys.stderr)
+            providers.reset_stats()
+            results[name] = asyncio.run(load_test.run_scenario(name, rng))
+            results[name]["upstream"] = providers.get_stats()
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        mock_server.stop()
+
+    report = {
+        "config": {
+            "rate": args.rate, "duration_s": args.duration, "worker_concurrency": args.worker_concurrency,
+            "interactive_concurrency": args.interactive_concurrency,
+            "web_workers": args.web_workers, "fake_redis": args.fake_redis, "env": args.env,
+            "upstream_latency_ms": args.latency_ms, "upstream_error_rate": args.error_rate, "upstream_rate_limit": args.rate_limit,
+        },
+        "scenarios": results,
+    }
+    write_report(report, args.output)
+
+if __name__ == "__main__":
+    main()
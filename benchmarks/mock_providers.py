@@ -0,0 +1,433 @@
+"""
+Local stand-ins for every upstream provider the sources talk to.
+
+Payloads mimic the real APIs closely enough for the sources' parsers, and each provider's latency,
+error rate and rate limit (answered with 429) can be configured. Sources are pointed at the stand-ins
+with the SOURCE_BASE_URLS setting, see source_base_urls().
+
+Run standalone with:
+    python -m benchmarks.mock_providers --port 8081 --latency-ms 50
+"""
+import argparse
+import asyncio
+from collections import Counter
+import hashlib
+import json
+import random
+import threading
+import time
+
+from aiohttp import web
+
+PROVIDERS = ("virustotal", "abuseipdb", "otx", "greynoise", "maltiverse", "threatminer", "stopforumspam", "tranco")
+
+AV_ENGINES = (
+    "Acronis", "ADMINUSLabs", "AICC (MONITORAPP)", "AlienVault", "alphaMountain.ai", "Antiy-AVL", "Artists Against 419",
+    "Avira", "benkow.cc", "Bfore.Ai PreCrime", "BitDefender", "Bkav", "BlockList", "Blueliv", "Certego", "Chong Lua Dao",
+    "CINS Army", "CMC Threat Intelligence", "CRDF", "Criminal IP", "CyRadar", "Cyan", "Cyble", "desenmascara.me",
+    "DNS8", "Dr.Web", "EmergingThreats", "Emsisoft", "ESET", "ESTsecurity", "Forcepoint ThreatSeeker", "Fortinet",
+    "G-Data", "Google Safebrowsing", "GreenSnow", "Gridinsoft", "Heimdal Security", "IPsum", "Juniper Networks",
+    "K7AntiVirus", "Kaspersky", "Lionic", "Lumu", "MalwarePatrol", "MalwareURL", "Malwared", "Netcraft", "OpenPhish",
+    "Phishing Database", "PhishFort", "PhishLabs", "Phishtank", "PREBYTES", "PrecisionSec", "Quick Heal", "Quttera",
+    "Rising", "SafeToOpen", "Sangfor", "Scantitan", "SCUMWARE.org", "Seclookup", "SecureBrain", "Segasec", "SOCRadar",
+    "Sophos", "Spam404", "StopForumSpam", "Sucuri SiteCheck", "ThreatHive", "Threatsourcing", "Trustwave", "URLhaus",
+    "URLQuery", "Viettel Threat Intelligence", "VIPRE", "ViriBack", "Webroot", "Xcitium Verdict Cloud", "Yandex Safebrowsing",
+    "ZeroCERT", "ZeroFox",
+)
+
+class ProviderBehaviour:
+    """
+    Behaviour of a single stand-in provider.
+
+    :param latency_ms: Mean response latency in milliseconds
+    :param jitter_ms: Maximum random deviation added to the latency in milliseconds
+    :param error_rate: Share of requests answered with a 500 error, between 0 and 1
+    :param rate_limit: Requests per second served before answering 429, 0 for unlimited
+    :param slow_rate: Share of requests delayed by slow_ms, used to simulate tail latency
+    :param slow_ms: Extra latency of slow requests in milliseconds
+    :param payload_scale: Multiplier of the bulky parts of payloads (VirusTotal engine results, OTX pulses), used to simulate large responses
+    """
+    def __init__(self, latency_ms: float=50, jitter_ms: float=10, error_rate: float=0.0, rate_limit: int=0, slow_rate: float=0.0, slow_ms: float=1000,
+                 payload_scale: int=1):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+        self.payload_scale = payload_scale
+        self._window = 0
+        self._window_count = 0
+
+    def allow(self) -> bool:
+        """ Counts the request in the current one second window, False if the rate limit is exceeded. """
+        if not self.rate_limit:
+            return True
+        window = int(time.monotonic())
+        if window != self._window:
+            self._window = window
+            self._window_count = 0
+        self._window_count += 1
+        return self._window_count <= self.rate_limit
+
+    def delay(self) -> float:
+        """ Randomized latency of a response in seconds. """
+        latency = self.latency_ms + random.uniform(-self.jitter_ms, self.jitter_ms)
+        if self.slow_rate and random.random() < self.slow_rate:
+            latency += self.slow_ms
+        return max(latency, 0) / 1000
+
+def seeded(indicator: str) -> random.Random:
+    """ Random generator seeded by the indicator, so an indicator always gets the same payload. """
+    return random.Random(int(hashlib.md5(indicator.encode()).hexdigest()[:8], 16))
+
+def virustotal_payload(kind: str, indicator: str, scale: int=1) -> dict:
+    rng = seeded(indicator)
+    malicious = rng.choice((0, 0, 0, 0, 1, 3, 8))
+    suspicious = rng.choice((0, 0, 0, 1))
+    harmless = rng.randint(50, 65)
+    undetected = len(AV_ENGINES) - malicious - suspicious - harmless
+    categories = ["malicious"] * malicious + ["suspicious"] * suspicious + ["harmless"] * harmless + ["undetected"] * max(undetected, 0)
+    results = {
+        engine: {"method": "blacklist", "engine_name": engine, "category": category, "result": "clean" if category == "harmless" else category}
+        for engine, category in zip(AV_ENGINES, categories)
+    }
+    # Scaled payloads add undetected results of further engines
+    for copy in range(1, scale):
+        results.update({f"{engine} {copy}": {"method": "blacklist", "engine_name": f"{engine} {copy}", "category": "undetected", "result": None} for engine in AV_ENGINES})
+    undetected += len(AV_ENGINES) * (scale - 1)
+    type_names = {"ip_addresses": "ip_address", "domains": "domain", "urls": "url", "files": "file"}
+    return {
+        "data": {
+            "id": indicator,
+            "type": type_names.get(kind, kind),
+            "links": {"self": f"https://www.virustotal.com/api/v3/{kind}/{indicator}"},
+            "attributes": {
+                "last_analysis_date": 1700000000 + rng.randint(0, 10000000),
+                "last_analysis_stats": {"malicious": malicious, "suspicious": suspicious, "undetected": max(undetected, 0), "harmless": harmless, "timeout": 0},
+                "last_analysis_results": results,
+                "reputation": rng.randint(-20, 5),
+                "total_votes": {"harmless": rng.randint(0, 10), "malicious": rng.randint(0, 10)},
+                "tags": [],
+                "whois": "NetRange: 0.0.0.0 - 255.255.255.255\nOrgName: Example\n" * 5,
+            },
+        }
+    }
+
+def abuseipdb_payload(indicator: str) -> dict:
+    rng = seeded(indicator)
+    score = rng.choice((0, 0, 0, 10, 35, 75, 100))
+    return {
+        "data": {
+            "ipAddress": indicator,
+            "isPublic": True,
+            "ipVersion": 6 if ":" in indicator else 4,
+            "isWhitelisted": False,
+            "abuseConfidenceScore": score,
+            "countryCode": rng.choice(("US", "DE", "FI", "CN", "RU", "NL")),
+            "usageType": "Data Center/Web Hosting/Transit",
+            "isp": "Example Hosting",
+            "domain": "example.net",
+            "hostnames": [],
+            "isTor": False,
+            "totalReports": score * rng.randint(0, 5),
+            "numDistinctUsers": rng.randint(0, 50),
+            "lastReportedAt": "2024-05-01T12:00:00+00:00" if score else None,
+        }
+    }
+
+def otx_payload(type: str, indicator: str, scale: int=1) -> dict:
+    rng = seeded(indicator)
+    count = rng.choice((0, 0, 1, 3, 12, 40)) * scale
+    pulses = [
+        {
+            "id": hashlib.md5(f"{indicator}{i}".encode()).hexdigest()[:24],
+            "name": f"Campaign {i}",
+            "description": "Indicators observed in an active campaign. " * 10,
+            "tags": ["malware", "c2", "phishing"][: rng.randint(0, 3)],
+            "created": "2024-01-01T00:00:00.000000",
+            "modified": "2024-02-01T00:00:00.000000",
+            "TLP": "white",
+            "references": [f"https://example.com/report/{i}"],
+        }
+        for i in range(count)
+    ]
+    return {
+        "indicator": indicator,
+        "type": type,
+        "type_title": type,
+        "sections": ["general", "geo", "reputation", "url_list", "passive_dns", "malware"],
+        "pulse_info": {"count": count, "pulses": pulses, "references": [], "related": {}},
+        "validation": [{"source": "whitelist", "message": "Whitelisted", "name": "Whitelisted indicator"}] if rng.random() < 0.1 else [],
+        "false_positive": [],
+    }
+
+def greynoise_payload(indicator: str) -> tuple[int, dict]:
+    rng = seeded(indicator)
+    if rng.random() < 0.3:
+        return 404, {"ip": indicator, "noise": False, "riot": False, "message": "IP not observed scanning the internet or contained in RIOT data set."}
+    classification = rng.choice(("benign", "malicious", "unknown"))
+    return 200, {
+        "ip": indicator,
+        "noise": classification != "benign",
+        "riot": classification == "benign",
+        "classification": classification,
+        "name": "Example Scanner",
+        "link": f"https://viz.greynoise.io/ip/{indicator}",
+        "last_seen": "2024-05-01",
+        "message": "Success",
+    }
+
+def maltiverse_payload(kind: str, indicator: str) -> dict:
+    rng = seeded(indicator)
+    classification = rng.choice(("neutral", "suspicious", "malicious", "whitelist"))
+    field = {"ip": "ip_addr", "hostname": "hostname", "url": "url", "sample": "sha256", "sha1": "sha256", "md5": "sha256"}.get(kind, kind)
+    payload = {
+        field: indicator,
+        "classification": classification,
+        "blacklist": [
+            {"source": f"Feed {i}", "description": "Malicious activity", "first_seen": "2024-01-01 00:00:00", "last_seen": "2024-05-01 00:00:00"}
+            for i in range(rng.randint(0, 4))
+        ],
+        "creation_time": "2024-01-01 00:00:00",
+        "modification_time": "2024-05-01 00:00:00",
+        "tag": ["bot"] if classification == "malicious" else [],
+    }
+    if classification == "malicious":
+        payload["is_known_attacker"] = True
+    return payload
+
+def threatminer_payload(indicator: str) -> dict:
+    rng = seeded(indicator)
+    results = [f"report-{i}.pdf" for i in range(rng.choice((0, 0, 2, 6)))]
+    if not results:
+        return {"status_code": "404", "status_message": "No results found.", "results": []}
+    return {"status_code": "200", "status_message": "Results found.", "results": results}
+
+def stopforumspam_payload(indicator: str) -> str:
+    rng = seeded(indicator)
+    appears = rng.random() < 0.3
+    frequency = rng.randint(1, 40) if appears else 0
+    last_seen = "<lastseen>2024-05-01 12:00:00</lastseen>" if appears else ""
+    return (
+        '<response success="true">'
+        f"<type>ip</type><appears>{'yes' if appears else 'no'}</appears>{last_seen}<frequency>{frequency}</frequency>"
+        "</response>"
+    )
+
+def tranco_payload(indicator: str) -> dict:
+    rng = seeded(indicator)
+    if rng.random() < 0.4:
+        return {"domain": indicator, "ranks": []}
+    rank = rng.randint(1, 1000000)
+    return {"domain": indicator, "ranks": [{"date": f"2024-05-{day:02d}", "rank": rank + rng.randint(-100, 100)} for day in range(1, 31)]}
+
+class MockProviders:
+    """
+    aiohttp application serving every stand-in provider under its own path prefix.
+
+    :param behaviours: Dict of provider names and their behaviour, missing providers use the default behaviour
+    :param default: Behaviour used for providers missing from behaviours
+    """
+    def __init__(self, behaviours: dict[str, ProviderBehaviour]=None, default: ProviderBehaviour=None):
+        default = default or ProviderBehaviour()
+        self.behaviours = {name: (behaviours or {}).get(name, default) for name in PROVIDERS}
+        self.requests = Counter()
+        self.statuses = Counter()
+        # Requests being answered at once, the peak shows how many sockets clients held open
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.add_routes([
+            web.get("/virustotal/api/v3/{kind}/{indicator}", self.virustotal),
+            web.get("/abuseipdb/api/v2/check", self.abuseipdb),
+            web.get(r"/otx/api/v1/indicators/{type}/{indicator:.+}/general/", self.otx),
+            web.get("/greynoise/v3/community/{indicator}", self.greynoise),
+            web.get("/maltiverse/{kind}/{indicator}", self.maltiverse),
+            web.get("/threatminer/v2/{endpoint}", self.threatminer),
+            web.get("/stopforumspam/api", self.stopforumspam),
+            web.get("/tranco/api/ranks/domain/{indicator}", self.tranco),
+            web.get("/stats", self.stats),
+        ])
+        return app
+
+    async def respond(self, provider: str, build, content_type: str="application/json", headers: dict=None) -> web.Response:
+        """
+        Applies the provider's behaviour and builds the response.
+
+        :param provider: Name of the provider
+        :param build: Callable returning a tuple of status code and body
+        :param content_type: Content type of successful responses
+        :param headers: Extra headers of successful responses
+        """
+        behaviour = self.behaviours[provider]
+        self.requests[provider] += 1
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(behaviour.delay())
+        finally:
+            self.in_flight -= 1
+
+        if not behaviour.allow():
+            status, body, content_type, headers = 429, {"error": "Rate limit exceeded"}, "application/json", {"Retry-After": "1"}
+        elif behaviour.error_rate and random.random() < behaviour.error_rate:
+            status, body, content_type, headers = 500, {"error": "Internal server error"}, "application/json", None
+        else:
+            status, body = build()
+
+        self.statuses[(provider, status)] += 1
+        text = body if isinstance(body, str) else json.dumps(body)
+        return web.Response(status=status, text=text, content_type=content_type, headers=headers)
+
+    async def virustotal(self, request: web.Request) -> web.Response:
+        kind, indicator = request.match_info["kind"], request.match_info["indicator"]
+        scale = self.behaviours["virustotal"].payload_scale
+        return await self.respond("virustotal", lambda: (200, virustotal_payload(kind, indicator, scale)))
+
+    async def abuseipdb(self, request: web.Request) -> web.Response:
+        indicator = request.query.get("ipAddress", "")
+        headers = {"X-RateLimit-Limit": "1000", "X-RateLimit-Remaining": str(max(1000 - self.requests["abuseipdb"], 0))}
+        return await self.respond("abuseipdb", lambda: (200, abuseipdb_payload(indicator)), headers=headers)
+
+    async def otx(self, request: web.Request) -> web.Response:
+        type, indicator = request.match_info["type"], request.match_info["indicator"]
+        scale = self.behaviours["otx"].payload_scale
+        return await self.respond("otx", lambda: (200, otx_payload(type, indicator, scale)))
+
+    async def greynoise(self, request: web.Request) -> web.Response:
+        indicator = request.match_info["indicator"]
+        return await self.respond("greynoise", lambda: greynoise_payload(indicator))
+
+    async def maltiverse(self, request: web.Request) -> web.Response:
+        kind, indicator = request.match_info["kind"], request.match_info["indicator"]
+        return await self.respond("maltiverse", lambda: (200, maltiverse_payload(kind, indicator)))
+
+    async def threatminer(self, request: web.Request) -> web.Response:
+        indicator = request.query.get("q", "")
+        return await self.respond("threatminer", lambda: (200, threatminer_payload(indicator)))
+
+    async def stopforumspam(self, request: web.Request) -> web.Response:
+        indicator = request.query.get("ip", "")
+        return await self.respond("stopforumspam", lambda: (200, stopforumspam_payload(indicator)), content_type="application/xml")
+
+    async def tranco(self, request: web.Request) -> web.Response:
+        indicator = request.match_info["indicator"]
+        return await self.respond("tranco", lambda: (200, tranco_payload(indicator)))
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response(self.get_stats())
+
+    def get_stats(self) -> dict:
+        """ Requests and response status codes served per provider. """
+        statuses = {}
+        for (provider, status), count in self.statuses.items():
+            statuses.setdefault(provider, {})[str(status)] = count
+        return {"requests": dict(self.requests), "total_requests": sum(self.requests.values()), "statuses": statuses,
+                "peak_in_flight": self.peak_in_flight}
+
+    def reset_stats(self) -> None:
+        self.requests.clear()
+        self.statuses.clear()
+        self.peak_in_flight = self.in_flight
+
+def source_base_urls(base_url: str) -> dict[str, str]:
+    """
+    SOURCE_BASE_URLS setting pointing every source at the stand-ins.
+
+    :param base_url: Base URL of the mock server, e.g. http://127.0.0.1:8081
+
+    :return: Dict of source class names and base URLs
+    """
+    base_url = base_url.rstrip("/")
+    return {
+        "VirusTotalSource": f"{base_url}/virustotal/api/v3/",
+        "AbuseIpDbSource": f"{base_url}/abuseipdb/api/v2/check",
+        "AlienVaultSource": f"{base_url}/otx/api/v1/indicators/{{}}/{{}}/general/",
+        "GreyNoiseSource": f"{base_url}/greynoise/v3/community/",
+        "MaltiverseSource": f"{base_url}/maltiverse/",
+        "ThreatMinerSource": f"{base_url}/threatminer/v2/",
+        "StopForumSpamSource": f"{base_url}/stopforumspam/api",
+        "TrancoListSource": f"{base_url}/tranco/api/ranks/domain/",
+    }
+
+class MockProviderServer:
+    """
+    Runs the stand-ins in a background thread with its own event loop, so they don't compete with the measured loop.
+
+    :param providers: MockProviders to serve
+    :param host: Host to listen on
+    :param port: Port to listen on, 0 picks a free port
+    """
+    def __init__(self, providers: MockProviders, host: str="127.0.0.1", port: int=0):
+        self.providers = providers
+        self.host = host
+        self.port = port
+        self._loop = None
+        self._runner = None
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="mock-providers", daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self) -> "MockProviderServer":
+        self._thread.start()
+        self._started.wait()
+        return self
+
+    def stop(self) -> None:
+        if self._loop:
+            asyncio.run_coroutine_threadsafe(self._runner.cleanup(), self._loop).result()
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+
+    def _run(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self._loop)
+        self._runner = web.AppRunner(self.providers.create_app(), access_log=None)
+        self._loop.run_until_complete(self._runner.setup())
+        site = web.TCPSite(self._runner, self.host, self.port)
+        self._loop.run_until_complete(site.start())
+        self.port = site._server.sockets[0].getsockname()[1]
+        self._started.set()
+        self._loop.run_forever()
+
+def add_behaviour_arguments(parser: argparse.ArgumentParser) -> None:
+    """ Adds arguments configuring the stand-ins' behaviour. """
+    parser.add_argument("--latency-ms", type=float, default=50, help="Mean upstream latency in milliseconds")
+    parser.add_argument("--jitter-ms", type=float, default=10, help="Maximum random deviation of upstream latency in milliseconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of upstream requests answered with 500")
+    parser.add_argument("--rate-limit", type=int, default=0, help="Upstream requests per second per provider before answering 429, 0 for unlimited")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Share of upstream requests delayed by --slow-ms")
+    parser.add_argument("--slow-ms", type=float, default=1000, help="Extra latency of slow upstream requests in milliseconds")
+    parser.add_argument("--payload-scale", type=int, default=1, help="Multiplier of the bulky parts of VirusTotal and OTX payloads")
+    parser.add_argument("--provider-behaviour", type=json.loads, default={},
+                        help='JSON object overriding behaviour per provider, e.g. \'{"virustotal": {"rate_limit": 4}}\'')
+
+def behaviours_from_args(args) -> tuple[ProviderBehaviour, dict[str, ProviderBehaviour]]:
+    """ Builds the default and per-provider behaviours from parsed arguments. """
+    options = {
+        "latency_ms": args.latency_ms, "jitter_ms": args.jitter_ms, "error_rate": args.error_rate,
+        "rate_limit": args.rate_limit, "slow_rate": args.slow_rate, "slow_ms": args.slow_ms, "payload_scale": args.payload_scale,
+    }
+    behaviours = {name: ProviderBehaviour(**{**options, **overrides}) for name, overrides in args.provider_behaviour.items()}
+    return ProviderBehaviour(**options), behaviours
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve local stand-ins for the upstream providers")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    add_behaviour_arguments(parser)
+    args = parser.parse_args()
+
+    default, behaviours = behaviours_from_args(args)
+    providers = MockProviders(behaviours, default)
+    print(f"SOURCE_BASE_URLS='{json.dumps(source_base_urls(f'http://{args.host}:{args.port}'))}'", flush=True)
+    web.run_app(providers.create_app(), host=args.host, port=args.port, access_log=None, print=None)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""
+Records the providers' responses to the sources' requests as fixtures, which SOURCE_FIXTURES_MODE=replay answers
+requests with and benchmarks.bench_parsers measures the parsers on.
+
+Responses are recorded from the stand-ins of benchmarks.mock_providers by default, large ones with their payloads scaled up.
+Sources pointed at the real providers record their responses instead, API keys are given per source class.
+Recorded responses replace earlier ones of the same request.
+
+Examples:
+    python -m benchmarks.record_fixtures
+    python -m benchmarks.record_fixtures --per-type 5 --large 2 --payload-scale 20 --output-dir /tmp/fixtures
+    python -m benchmarks.record_fixtures --live --indicators 8.8.8.8,example.com --sources VirusTotalSource,TrancoListSource \\
+        --api-keys '{"VirusTotalSource": "..."}'
+"""
+import argparse
+import asyncio
+import json
+import os
+
+from benchmarks.common import INDICATOR_TYPES, generate_indicators, prepare_environment, write_report
+from benchmarks.mock_providers import MockProviders, MockProviderServer, ProviderBehaviour, source_base_urls
+
+async def record(indicators: list[str], sources: dict, api_keys: dict[str, str]) -> None:
+    """ Searches every indicator with each source supporting it, one request at a time. """
+    from app.utils.concurrency import set_request_flow
+    from app.utils.indicator_type import get_indicator_type
+
+    for indicator in indicators:
+        # Responses are recorded under the indicator of the running search
+        set_request_flow(indicator, "interactive")
+        indicator_type = get_indicator_type(indicator)
+        for key, source in sources.items():
+            if source.requires_api_key and key not in api_keys:
+                continue
+            await source.fetch_intel(indicator, indicator_type, api_keys.get(key))
+
+def main():
+    parser = argparse.ArgumentParser(description="Record the providers' responses to the sources' requests as fixtures")
+    parser.add_argument("--output-dir", default="benchmarks/fixtures", help="Directory of the fixtures, SOURCE_FIXTURES_DIR")
+    parser.add_argument("--indicators", help="Comma separated indicators to record, generated if not given")
+    parser.add_argument("--per-type", type=int, default=2, help="Generated indicators of each type")
+    parser.add_argument("--large", type=int, default=2, help="Generated hashes and domains recorded with scaled up payloads")
+    parser.add_argument("--payload-scale", type=int, default=10, help="Multiplier of the bulky parts of the large payloads")
+    parser.add_argument("--seed", type=int, default=1, help="Seed of the generated indicators")
+    parser.add_argument("--sources", help="Comma separated source class names to record, all by default")
+    parser.add_argument("--live", action="store_true", help="Record the real providers instead of the stand-ins")
+    parser.add_argument("--api-keys", type=json.loads, default={}, help="JSON object of source class names and API keys, sources requiring "
+                                                                       "a key without one are skipped. The stand-ins accept any key.")
+    args = parser.parse_args()
+
+    os.environ["SOURCE_FIXTURES_MODE"] = "record"
+    os.environ["SOURCE_FIXTURES_DIR"] = args.output_dir
+    # Hedged requests would record the same response twice
+    os.environ.setdefault("HEDGE_BUDGET_RATIO", "0")
+    providers = server = None
+    if not args.live:
+        providers = MockProviders(default=ProviderBehaviour(latency_ms=0, jitter_ms=0))
+        server = MockProviderServer(providers).start()
+    prepare_environment(source_base_urls(server.base_url) if server else None, fake_redis=True)
+    from app.utils.fixtures import get_fixture_store
+    from app.utils.source_registry import SourceRegistry
+
+    sources = SourceRegistry.get_instance()
+    if args.sources:
+        sources = {key: sources[key] for key in args.sources.split(",")}
+    api_keys = args.api_keys if args.live else {key: "benchmark-key" for key in sources}
+    if args.indicators:
+        indicators, large = args.indicators.split(","), []
+    else:
+        indicators = generate_indicators(args.per_type * len(INDICATOR_TYPES), seed=args.seed)
+        # Hashes and domains are searched by most sources, including the ones with bulky payloads
+        large = generate_indicators(args.large, ("hash", "domain"), seed=args.seed + 1) if not args.live else []
+    try:
+        asyncio.run(record(indicators, sources, api_keys))
+        if large:
+            for behaviour in providers.behaviours.values():
+                behaviour.payload_scale = args.payload_scale
+            asyncio.run(record(large, sources, api_keys))
+    finally:
+        if server:
+            server.stop()
+
+    store = get_fixture_store()
+    write_report({key: len(store.responses(key)) for key in sources}, None)
+
+if __name__ == "__main__":
+    main()
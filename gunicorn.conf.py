@@ -0,0 +1,14 @@
+from app.utils.logger import stop_logging
+from app.utils.metrics import mark_process_dead, reset_multiprocess_dir
+
+def on_starting(server):
+    """ Removes metric files of previous web server runs. """
+    reset_multiprocess_dir()
+
+def worker_exit(server, worker):
+    """ Writes the queued logs of exiting gunicorn workers. """
+    stop_logging()
+
+def child_exit(server, worker):
+    """ Cleans up live metrics of exited gunicorn workers. """
+    mark_process_dead(worker.pid)